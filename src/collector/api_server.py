@@ -1,12 +1,20 @@
 """The UW Solar API server."""
 
+import concurrent.futures
 import dataclasses
 import datetime
+import functools
+import logging
 import time
 import typing
 import bottle
+from collector import collect_jobs, collection_scheduler, metric_cache
+from collector import sampling_scheduler
 from db import db_model
 
+# The default number of panels that may be read at once.
+DEFAULT_MAX_WORKERS = 8
+
 
 @dataclasses.dataclass(frozen=True)
 class Route:
@@ -18,42 +26,102 @@ class Route:
 class ApiServer:
   """The UW Solar API server."""
 
-  def __init__(self, db_con, panel_con):
+  def __init__(self, db_con, panels, max_workers=DEFAULT_MAX_WORKERS,
+               max_staleness=metric_cache.DEFAULT_MAX_STALENESS,
+               collect_interval=None, writer=None):
     """Initializes routes and the WSGI application.
 
     Args:
       db_con: A handle to the database.
-      panel_con: A handle to the solar panel.
+      panels: A dict from each solar panel's topic prefix to its handle.
+      max_workers: The largest number of panels to read at once.
+      max_staleness: The age in seconds after which a collected metric value
+          is no longer served by "GET /metric", in addition to the metric's
+          sampling interval.
+      collect_interval: The time in seconds between collection cycles run by
+          the server itself, or None to only collect data when "POST /collect"
+          is invoked.
+      writer: A write_queue.WriteBehindQueue through which collected data is
+          written, or None to write it to db_con directly.
     """
     self._app = bottle.Bottle()
     self._db_con = db_con
-    self._panel_con = panel_con
+    self._writer = writer or db_con
+    self._panels = panels
+    self._metric_cache = metric_cache.MetricCache(max_staleness)
+    self._schedulers = {
+      prefix: sampling_scheduler.SamplingScheduler(panel_con.metrics)
+      for prefix, panel_con in panels.items()}
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers=max(1, min(max_workers, len(panels))),
+      thread_name_prefix='collect')
+    self._jobs = collect_jobs.JobManager(self._run_collect_job)
 
     self._init_routes()
-    self._init_topics()
+    topic_ids_by_name = self._init_topics()
+
+    self._scheduler = None
+    if collect_interval:
+      self._scheduler = collection_scheduler.CollectionScheduler(
+        {prefix: functools.partial(self._collect_panel, prefix, panel_con,
+                                   topic_ids_by_name, collect_interval)
+         for prefix, panel_con in panels.items()}, collect_interval)
+      self._scheduler.start()
 
   def _init_routes(self):
     routes = [
       Route('GET', '/ping', ApiServer.ping),
+      Route('GET', '/health', self.get_health),
       Route('GET', '/metric', self.get_metric),
-      Route('POST', '/collect', self.collect)
+      Route('POST', '/collect', self.collect),
+      Route('GET', '/collect/<job_id>', self.get_collect_job)
     ]
 
     for route in routes:
       self._app.route(route.path, method=route.method, callback=route.callback)
 
   def _init_topics(self):
-    """Adds the current panel connection's topics to the database."""
-    topics = [db_model.Topic(None, m.topic_name)
-              for m in self._panel_con.metrics.values()
-              if not self._db_con.topic_exists(m.topic_name)]
-    if topics:
-      self._db_con.write_topics(topics)
+    """Adds every panel's topics to the database.
+
+    Returns:
+      A dict from the topic name to its ID.
+    """
+    return self._db_con.get_topic_ids(
+      m.topic_name for panel_con in self._panels.values()
+      for m in panel_con.metrics.values())
+
+  def _get_panel(self):
+    """Finds the panel named by the request's query string.
+
+    The panel may be omitted when the server only has one panel.
+
+    Returns:
+      A (topic prefix, panel handle) pair.
+
+    Raises:
+      bottle.HTTPError: When the panel is missing or unknown.
+    """
+    prefix = bottle.request.query.get('panel', None)
+    if prefix is None and len(self._panels) == 1:
+      return next(iter(self._panels.items()))
+
+    if prefix not in self._panels:
+      raise bottle.HTTPError(400)
+
+    return prefix, self._panels[prefix]
 
   def app(self):
     """Returns a reference to the WSGI application."""
     return self._app
 
+  def close(self):
+    """Stops scheduled collection and releases the server's threads."""
+    if self._scheduler is not None:
+      self._scheduler.close()
+
+    self._jobs.close()
+    self._executor.shutdown()
+
   @staticmethod
   def ping():
     """Returns a ping response.
@@ -65,36 +133,82 @@ class ApiServer:
     """
     pass
 
+  def get_health(self):
+    """Reports the health of the connection to each solar panel.
+
+    Returns:
+      A JSON object keyed by panel topic prefix. Each entry describes the
+      panel's circuit breaker state, its number of consecutive failures, and
+      the times of its last success and failure.
+    """
+    return {prefix: panel_con.health.to_json()
+            for prefix, panel_con in self._panels.items()}
+
   def get_metric(self):
     """Retrieves the value for a particular metric.
 
     Query string format:
 
       - name: The metric name.
+      - panel: The topic prefix of the panel to query. This may be omitted when
+            the server only has one panel.
+
+    Values are served from the readings taken during collection. When the
+    latest reading is older than the server's maximum staleness plus the
+    metric's sampling interval, the panel is read again; concurrent requests
+    share a single read.
 
     Returns:
-      The current value of the metric.
+      The current value of the metric. The time at which the value was read is
+      returned in the X-Sample-Time header, as an ISO-8601 string.
     """
+    prefix, panel_con = self._get_panel()
     name = bottle.request.query.get('name', None)
-    if not name or not self._panel_con.has_metric(name):
+    if not name or not panel_con.has_metric(name):
       raise bottle.HTTPError(400)
 
+    sample = self._metric_cache.get(
+      prefix, name, panel_con.get_metrics,
+      panel_con.metrics[name].sampling_interval or 0)
     bottle.response.content_type = 'text/plain'
-    return str(self._panel_con.get_metric(name))
+    bottle.response.set_header('X-Sample-Time', sample.ts.isoformat())
+    return str(sample.value)
 
   def collect(self):
-    """Queries all known metrics and writes their values to the database.
+    """Starts a job that queries metrics and writes their values to a database.
 
     Query string format:
 
       - iterations: The number of times to query the metrics.
       - wait_time: The time in seconds to wait between iterations.
+      - panel: The topic prefix of a panel to query. This may be repeated, and
+            defaults to every panel.
 
     It is expected that this method will be invoked periodically by a task
     scheduling service (e.g. cron). Cron specifically may invoke a task as
     frequently as once per minute. To collect data approximately once per
     second, the number of iterations may be set to 60 and the wait time may be
     set to 1.
+
+    Panels are read in parallel, and each iteration's values from every panel
+    are written to the database in a single transaction. A panel that cannot
+    be read is skipped for that iteration. Metrics with a sampling interval
+    longer than the wait time are only read once they are due.
+
+    Iterations start on wall-clock aligned ticks that are wait_time seconds
+    apart, so the time spent reading and writing does not add to the period.
+    An iteration that overruns its tick delays the next one, and ticks that are
+    missed entirely are skipped.
+
+    The job runs in the background, and this method returns immediately with
+    status 202 and a Location header naming the job's status resource. Panels
+    that are already being collected by another job are left out of the new
+    job, and when every panel is already being collected, the running job that
+    collects the first of them is returned instead of starting another one.
+    Scheduled collection skips panels while a job collects them.
+
+    Returns:
+      A JSON object describing the job (see get_collect_job).
     """
     iterations = bottle.request.query.get('iterations', '1')
     try:
@@ -108,16 +222,132 @@ class ApiServer:
     except ValueError:
       raise bottle.HTTPError(400)
 
+    panels = bottle.request.query.getall('panel') or list(self._panels)
+    if any(prefix not in self._panels for prefix in panels):
+      raise bottle.HTTPError(400)
+
+    job, _ = self._jobs.submit(panels, iterations, wait_time)
+    bottle.response.status = 202
+    bottle.response.set_header('Location', '/collect/%s' % job.id)
+    return job.to_json()
+
+  def get_collect_job(self, job_id):
+    """Reports the progress of a collection job.
+
+    Returns:
+      A JSON object containing the job's ID, panels and state (PENDING,
+      RUNNING, SUCCEEDED, FAILED or CANCELLED), the number of iterations
+      requested and completed, the number of values written to the database
+      so far (values written in the background are counted once they have been
+      written, and values that fail to be written are not), any error, and
+      the times at which the job was created, started and finished. Status
+      404 is returned for unknown jobs.
+    """
+    job = self._jobs.get(job_id)
+    if job is None:
+      raise bottle.HTTPError(404)
+
+    return job.to_json()
+
+  def _run_collect_job(self, job):
+    """Performs the collection requested by a job.
+
+    Args:
+      job: A collect_jobs.CollectJob.
+    """
     # Map topic names to their IDs.
-    topics = self._db_con.get_all_topics()
-    topic_ids_by_name = {t.topic_name: t.topic_id for t in topics}
+    topic_ids_by_name = self._db_con.get_topic_ids(
+      m.topic_name for prefix in job.panels
+      for m in self._panels[prefix].metrics.values())
 
     # Query metrics.
-    metrics = self._panel_con.metrics
-    for _ in range(0, iterations):
-      data = [db_model.TopicDatum(datetime.datetime.now(),
-                                  topic_ids_by_name[m.topic_name],
-                                  self._panel_con.get_metric(m.name))
-              for m in metrics.values()]
+    wait_time = job.wait_time
+    ticker = collection_scheduler.Ticker(wait_time) if wait_time > 0 else None
+    for _ in range(0, job.iterations):
+      if ticker:
+        ts = ticker.wait(job.cancel_event)
+      else:
+        ts = None if job.cancelled else datetime.datetime.now()
+      if ts is None:
+        return
+
+      futures = [self._executor.submit(self._read_panel, prefix,
+                                       self._panels[prefix], topic_ids_by_name,
+                                       wait_time, ts)
+                 for prefix in job.panels]
+      data = [datum for f in futures for datum in f.result()]
+
+      if data:
+        self._write_data(data, job.record_written)
+
+      job.record_iteration()
+
+  def _collect_panel(self, prefix, panel_con, topic_ids_by_name, interval,
+                     ts):
+    """Reads a panel and writes its values during scheduled collection.
+
+    Args:
+      prefix: The panel's topic prefix.
+      panel_con: A handle to the solar panel.
+      topic_ids_by_name: A dict from the topic name to its ID.
+      interval: The time in seconds between collection cycles.
+      ts: The time of the collection tick.
+    """
+    if self._jobs.is_collecting(prefix):
+      return
+
+    data = self._read_panel(prefix, panel_con, topic_ids_by_name, interval, ts)
+    if data:
+      self._write_data(data)
+
+  def _write_data(self, data, on_written=None):
+    """Writes collected data, directly or through the write-behind queue.
+
+    Args:
+      data: A list of topic values to be written.
+      on_written: A function that is called with the number of values written
+          to the database, once they have been written.
+    """
+    if self._writer is self._db_con:
       self._db_con.write_data(data)
-      time.sleep(wait_time)
+      if on_written is not None:
+        on_written(len(data))
+    else:
+      self._writer.write_data(data, on_written=on_written)
+
+  def _read_panel(self, prefix, panel_con, topic_ids_by_name, wait_time,
+                  ts=None):
+    """Reads the metrics that are due from a panel and caches the values.
+
+    Args:
+      prefix: The panel's topic prefix.
+      panel_con: A handle to the solar panel.
+      topic_ids_by_name: A dict from the topic name to its ID.
+      wait_time: The time in seconds between collection iterations.
+      ts: The time with which to record the values. Defaults to the current
+          time.
+
+    Returns:
+      A list of TopicDatum objects, or an empty list if the panel could not be
+      read.
+    """
+    scheduler = self._schedulers[prefix]
+    monotonic_ts = time.monotonic()
+    ts = ts or datetime.datetime.now()
+    names = scheduler.due(monotonic_ts, wait_time / 2)
+    if not names:
+      return []
+
+    try:
+      values = panel_con.get_metrics(names)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.warning('Failed to read %s: %r', prefix, e)
+      return []
+
+    scheduler.observe(values, monotonic_ts)
+    self._metric_cache.put(prefix, values, ts, monotonic_ts)
+
+    metrics = panel_con.metrics
+    return [db_model.TopicDatum(ts, topic_ids_by_name[metrics[name].topic_name],
+                                value)
+            for name, value in values.items()]
@@ -0,0 +1,259 @@
+"""API server unit tests."""
+
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+import urllib.parse
+import wsgiref.util
+import sqlalchemy.orm
+from collector import api_server, model
+from db import db_model, testdb, write_queue
+
+
+class FakePanel:
+  """A stand-in for a solar panel that serves fixed values."""
+
+  def __init__(self, prefix, values, error=None):
+    """Creates a new fake panel.
+
+    Args:
+      prefix: The panel's topic prefix.
+      values: A dict from the metric name to its value.
+      error: An exception to raise from each read, if any.
+    """
+    self.metrics = {
+      name: model.Metric(name, name, i, 1, 1, model.MetricDataType.UINT16,
+                         '%s/%s' % (prefix, name))
+      for i, name in enumerate(values)}
+    self.values = values
+    self.error = error
+    self.reads = 0
+
+  def has_metric(self, name):
+    return name in self.metrics
+
+  def get_metric(self, name):
+    return self.get_metrics([name])[name]
+
+  def get_metrics(self, names=None):
+    self.reads += 1
+    if self.error:
+      raise self.error
+
+    return {n: self.values[n] for n in names or self.values}
+
+
+class UnavailableDatabase:
+  """A stand-in for a database that cannot be written to."""
+
+  def write_data(self, data):
+    raise ConnectionError('unavailable')
+
+
+def call(app, method, path, query=None):
+  """Sends a request to a WSGI application.
+
+  Args:
+    app: The WSGI application.
+    method: The HTTP method.
+    path: The request path.
+    query: A dict of query string parameters.
+
+  Returns:
+    A (status, headers, body) tuple.
+  """
+  environ = {
+    'REQUEST_METHOD': method,
+    'PATH_INFO': path,
+    'QUERY_STRING': urllib.parse.urlencode(query or {}),
+    'wsgi.input': io.BytesIO()
+  }
+  wsgiref.util.setup_testing_defaults(environ)
+  response = {}
+
+  def start_response(status, headers, exc_info=None):
+    response['status'] = int(status.split()[0])
+    response['headers'] = dict(headers)
+
+  body = b''.join(app(environ, start_response))
+  return response['status'], response['headers'], body.decode('utf-8')
+
+
+class ApiServerTestCase(unittest.TestCase):
+  """A test case for API server operations."""
+
+  def setUp(self):
+    """Creates a temporary database and a server with two panels."""
+    _, self.db_file = tempfile.mkstemp()
+    self.engine = testdb.create_engine(self.db_file)
+    self.db_con = testdb.create_accessor(self.db_file)
+    self.panels = {
+      'UW/Alder/eaton_meter': FakePanel('UW/Alder/eaton_meter',
+                                        {'W': 1.5, 'freq': 60.0}),
+      'UW/Elm/eaton_meter': FakePanel('UW/Elm/eaton_meter', {'W': 2.5}),
+      'UW/Maple/eaton_meter': FakePanel('UW/Maple/eaton_meter', {'W': 3.5},
+                                        ConnectionError('unreachable'))
+    }
+    self.server = api_server.ApiServer(self.db_con, self.panels)
+    self.app = self.server.app()
+
+  def tearDown(self):
+    """Stops the server and removes the temporary database file."""
+    self.server.close()
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def collect(self, query):
+    """Starts a collection job and waits for it to finish.
+
+    Returns:
+      The job's final status.
+    """
+    status, headers, body = call(self.app, 'POST', '/collect', query)
+    self.assertEqual(202, status)
+    job = json.loads(body)
+    self.assertEqual('/collect/%s' % job['id'], headers['Location'])
+    while job['state'] in ('PENDING', 'RUNNING'):
+      time.sleep(0.01)
+      status, _, body = call(self.app, 'GET', headers['Location'])
+      self.assertEqual(200, status)
+      job = json.loads(body)
+
+    return job
+
+  def test_init_topics(self):
+    """Tests that every panel's topics are added to the database."""
+    names = sorted(t.topic_name for t in self.db_con.get_all_topics())
+    self.assertEqual(['UW/Alder/eaton_meter/W', 'UW/Alder/eaton_meter/freq',
+                      'UW/Elm/eaton_meter/W', 'UW/Maple/eaton_meter/W'],
+                     names)
+
+  def test_get_metric(self):
+    """Tests that metrics are routed to the panel with the given prefix."""
+    status, headers, body = call(self.app, 'GET', '/metric',
+                                 {'panel': 'UW/Elm/eaton_meter', 'name': 'W'})
+    self.assertEqual(200, status)
+    self.assertEqual('2.5', body)
+    self.assertIn('X-Sample-Time', headers)
+
+  def test_get_metric_from_collection(self):
+    """Tests that collected values are served without reading the panel."""
+    self.collect({'iterations': '1', 'wait_time': '0'})
+    panel = self.panels['UW/Alder/eaton_meter']
+    panel.values = {'W': 9.5, 'freq': 59.0}
+    reads = panel.reads
+
+    for name, expected in (('W', '1.5'), ('freq', '60.0')):
+      status, _, body = call(self.app, 'GET', '/metric',
+                             {'panel': 'UW/Alder/eaton_meter', 'name': name})
+      self.assertEqual(200, status)
+      self.assertEqual(expected, body)
+
+    self.assertEqual(reads, panel.reads)
+
+  def test_get_metric_unknown_panel(self):
+    """Tests that an error is returned for unknown or missing panels."""
+    status, _, _ = call(self.app, 'GET', '/metric', {'name': 'W'})
+    self.assertEqual(400, status)
+    status, _, _ = call(self.app, 'GET', '/metric',
+                        {'panel': 'UW/Oak/eaton_meter', 'name': 'W'})
+    self.assertEqual(400, status)
+
+  def test_collect(self):
+    """Tests that readable panels are written in a single batch."""
+    job = self.collect({'iterations': '1', 'wait_time': '0'})
+    self.assertEqual('SUCCEEDED', job['state'])
+    self.assertEqual(1, job['completed_iterations'])
+    self.assertEqual(3, job['samples_written'])
+
+    session = sqlalchemy.orm.Session(bind=self.engine)
+    topics = {t.topic_id: t.topic_name
+              for t in session.query(db_model.Topic).all()}
+    data = {topics[d.topic_id]: d.value_string
+            for d in session.query(db_model.TopicDatum).all()}
+    session.close()
+    self.assertEqual({'UW/Alder/eaton_meter/W': '1.5',
+                      'UW/Alder/eaton_meter/freq': '60.0',
+                      'UW/Elm/eaton_meter/W': '2.5'}, data)
+
+  def test_collect_panel(self):
+    """Tests that collection may be limited to some panels."""
+    job = self.collect({'iterations': '2', 'wait_time': '0',
+                        'panel': 'UW/Elm/eaton_meter'})
+    self.assertEqual(['UW/Elm/eaton_meter'], job['panels'])
+    self.assertEqual(2, job['samples_written'])
+
+    status, _, _ = call(self.app, 'POST', '/collect',
+                        {'panel': 'UW/Oak/eaton_meter'})
+    self.assertEqual(400, status)
+
+  def test_collect_write_failure(self):
+    """Tests that values that fail to be written are not counted."""
+    self.server.close()
+    writer = write_queue.WriteBehindQueue(UnavailableDatabase(),
+                                          max_delay=0.01)
+    self.server = api_server.ApiServer(self.db_con, self.panels, writer=writer)
+    self.app = self.server.app()
+    job = self.collect({'iterations': '2', 'wait_time': '0'})
+    writer.close()
+    self.assertEqual(2, job['completed_iterations'])
+    self.assertEqual(0, self.server.get_collect_job(job['id'])[
+      'samples_written'])
+    self.assertEqual(6, writer.failed_rows)
+
+  def test_collect_deduplicates(self):
+    """Tests that panels already being collected are not collected again."""
+    query = {'iterations': '100', 'wait_time': '1'}
+    _, _, body = call(self.app, 'POST', '/collect', query)
+    first = json.loads(body)
+    _, _, body = call(self.app, 'POST', '/collect', query)
+    self.assertEqual(first['id'], json.loads(body)['id'])
+
+    _, _, body = call(self.app, 'POST', '/collect',
+                      dict(query, panel='UW/Elm/eaton_meter'))
+    self.assertEqual(first['id'], json.loads(body)['id'])
+
+  def test_get_unknown_collect_job(self):
+    """Tests that unknown jobs are not found."""
+    status, _, _ = call(self.app, 'GET', '/collect/unknown')
+    self.assertEqual(404, status)
+
+  def test_scheduled_collection(self):
+    """Tests that the server collects data on its own when configured to."""
+    server = api_server.ApiServer(self.db_con, self.panels,
+                                  collect_interval=0.05)
+    time.sleep(0.2)
+    server.close()
+
+    session = sqlalchemy.orm.Session(bind=self.engine)
+    data = session.query(db_model.TopicDatum).all()
+    session.close()
+    self.assertGreaterEqual(len(data), 6)
+
+    # Each of the three panels is collected on its own third of the interval.
+    for d in data:
+      remainder = d.ts.timestamp() % (0.05 / 3)
+      self.assertAlmostEqual(0, min(remainder, 0.05 / 3 - remainder),
+                             places=5)
+
+  def test_scheduled_collection_skips_jobs(self):
+    """Tests that scheduled collection skips panels collected by a job."""
+    server = api_server.ApiServer(self.db_con, self.panels,
+                                  collect_interval=0.05)
+    call(server.app(), 'POST', '/collect',
+         {'iterations': '1', 'wait_time': '60',
+          'panel': 'UW/Elm/eaton_meter'})
+    time.sleep(0.2)
+    server.close()
+
+    self.assertLessEqual(self.panels['UW/Elm/eaton_meter'].reads, 1)
+    self.assertGreaterEqual(self.panels['UW/Alder/eaton_meter'].reads, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,265 @@
+"""Runs data collection requests in the background.
+
+A collection request may take a minute or more to complete. Rather than tying
+up a server worker for that long, each request becomes a job that runs on its
+own thread, and whose progress may be queried while it runs.
+
+Each panel is collected by at most one job at a time, so that overlapping cron
+invocations or retried requests do not read a meter twice or write the same
+values twice. Panels that are already being collected by an earlier job are
+left out of a new job, and when every requested panel is already being
+collected, the earlier job is returned instead.
+"""
+
+import datetime
+import enum
+import logging
+import threading
+import time
+import uuid
+
+# The default number of finished jobs whose status is retained.
+DEFAULT_MAX_HISTORY = 100
+
+
+class JobState(enum.Enum):
+  """An enumeration of collection job states."""
+  PENDING = 0
+  RUNNING = 1
+  SUCCEEDED = 2
+  FAILED = 3
+  CANCELLED = 4
+
+
+class CollectJob:
+  """The progress of a single collection request."""
+
+  def __init__(self, panels, iterations, wait_time):
+    """Creates a new pending job.
+
+    Args:
+      panels: A tuple of the topic prefixes of the panels to collect.
+      iterations: The number of times to collect the panels.
+      wait_time: The time in seconds between iterations.
+    """
+    self.id = uuid.uuid4().hex
+    self.panels = panels
+    self.iterations = iterations
+    self.wait_time = wait_time
+
+    self._lock = threading.Lock()
+    self._cancelled = threading.Event()
+    self._done = threading.Event()
+    self._state = JobState.PENDING
+    self._completed_iterations = 0
+    self._samples_written = 0
+    self._error = None
+    self._created = datetime.datetime.now()
+    self._started = None
+    self._finished = None
+    self._monotonic_started = None
+    self._elapsed = None
+
+  @property
+  def state(self):
+    with self._lock:
+      return self._state
+
+  @property
+  def cancelled(self):
+    """Whether the job has been asked to stop."""
+    return self._cancelled.is_set()
+
+  @property
+  def cancel_event(self):
+    """A threading.Event that is set when the job is asked to stop."""
+    return self._cancelled
+
+  @property
+  def active(self):
+    """Whether the job is pending or running."""
+    return not self._done.is_set()
+
+  def record_iteration(self):
+    """Records the completion of an iteration."""
+    with self._lock:
+      self._completed_iterations += 1
+
+  def record_written(self, samples):
+    """Records values that have been written to the database.
+
+    Values may be written after the iteration that collected them completes,
+    or even after the job finishes, when they are written in the background.
+
+    Args:
+      samples: The number of values written.
+    """
+    with self._lock:
+      self._samples_written += samples
+
+  def cancel(self):
+    """Asks the job to stop after its current iteration."""
+    self._cancelled.set()
+
+  def wait(self, timeout=None):
+    """Waits for the job to finish.
+
+    Args:
+      timeout: The longest time in seconds to wait, or None to wait forever.
+
+    Returns:
+      True if the job finished, and False if the wait timed out.
+    """
+    return self._done.wait(timeout)
+
+  def to_json(self):
+    """Returns a JSON-serializable representation of the job's progress."""
+    with self._lock:
+      elapsed = self._elapsed
+      if elapsed is None and self._monotonic_started is not None:
+        elapsed = time.monotonic() - self._monotonic_started
+
+      return {
+        'id': self.id,
+        'panels': list(self.panels),
+        'state': self._state.name,
+        'iterations': self.iterations,
+        'wait_time': self.wait_time,
+        'completed_iterations': self._completed_iterations,
+        'samples_written': self._samples_written,
+        'error': self._error,
+        'created': self._created.isoformat(),
+        'started': self._started.isoformat() if self._started else None,
+        'finished': self._finished.isoformat() if self._finished else None,
+        'elapsed': elapsed
+      }
+
+  def start(self):
+    """Marks the job as running."""
+    with self._lock:
+      self._state = JobState.RUNNING
+      self._started = datetime.datetime.now()
+      self._monotonic_started = time.monotonic()
+
+  def finish(self, error=None):
+    """Marks the job as finished.
+
+    Args:
+      error: The exception that caused the job to fail, if any.
+    """
+    with self._lock:
+      if error is not None:
+        self._state = JobState.FAILED
+        self._error = repr(error)
+      elif self._cancelled.is_set():
+        self._state = JobState.CANCELLED
+      else:
+        self._state = JobState.SUCCEEDED
+
+      self._finished = datetime.datetime.now()
+      if self._monotonic_started is not None:
+        self._elapsed = time.monotonic() - self._monotonic_started
+
+    self._done.set()
+
+
+class JobManager:
+  """Starts collection jobs and tracks their progress."""
+
+  def __init__(self, run, max_history=DEFAULT_MAX_HISTORY):
+    """Creates a new job manager.
+
+    Args:
+      run: A function that performs a job's collection. It is passed the
+          CollectJob, which it should update as iterations complete, and should
+          return early when the job is cancelled.
+      max_history: The number of finished jobs whose status is retained.
+    """
+    self._run = run
+    self._max_history = max_history
+    self._lock = threading.Lock()
+    self._jobs = {}
+    self._threads = []
+
+  def submit(self, panels, iterations, wait_time):
+    """Starts a job collecting the panels that are not already being collected.
+
+    Args:
+      panels: An iterable of the topic prefixes of the panels to collect.
+      iterations: The number of times to collect the panels.
+      wait_time: The time in seconds between iterations.
+
+    Returns:
+      A (job, created) pair. The new job only collects the panels that no
+      active job collects. When every panel is already being collected, an
+      existing job collecting one of them is returned and created is False.
+    """
+    requested = sorted(set(panels))
+    with self._lock:
+      owners = self._owners()
+      panels = tuple(p for p in requested if p not in owners)
+      if not panels:
+        return owners[requested[0]], False
+
+      job = CollectJob(panels, iterations, wait_time)
+      self._jobs[job.id] = job
+      self._prune()
+
+      thread = threading.Thread(target=self._execute, args=(job,),
+                                name='collect-job-%s' % job.id, daemon=True)
+      self._threads = [t for t in self._threads if t.is_alive()]
+      self._threads.append(thread)
+
+    thread.start()
+    return job, True
+
+  def is_collecting(self, panel):
+    """Whether an active job collects a panel.
+
+    Args:
+      panel: The topic prefix of the panel.
+    """
+    with self._lock:
+      return panel in self._owners()
+
+  def get(self, job_id):
+    """Finds a job by its ID.
+
+    Returns:
+      A CollectJob, or None if the job is unknown.
+    """
+    with self._lock:
+      return self._jobs.get(job_id)
+
+  def close(self):
+    """Cancels every active job and waits for them to stop."""
+    with self._lock:
+      jobs = list(self._jobs.values())
+      threads = list(self._threads)
+
+    for job in jobs:
+      job.cancel()
+    for thread in threads:
+      thread.join()
+
+  def _execute(self, job):
+    """Runs a job, recording its outcome."""
+    job.start()
+    try:
+      self._run(job)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('Collection job %s failed.', job.id)
+      job.finish(e)
+    else:
+      job.finish()
+
+  def _owners(self):
+    """Returns a dict from each panel collected by an active job to the job."""
+    return {panel: job for job in self._jobs.values() if job.active
+            for panel in job.panels}
+
+  def _prune(self):
+    """Forgets the oldest finished jobs beyond the history limit."""
+    finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+    for job_id in finished[:max(0, len(finished) - self._max_history)]:
+      del self._jobs[job_id]
@@ -0,0 +1,102 @@
+"""Collection job unit tests."""
+
+import threading
+import unittest
+from collector import collect_jobs
+
+
+class JobManagerTestCase(unittest.TestCase):
+  """A test case for job manager operations."""
+
+  def setUp(self):
+    """Creates a job manager whose jobs run until released."""
+    self.release = threading.Event()
+    self.manager = collect_jobs.JobManager(self.run_job, max_history=1)
+
+  def tearDown(self):
+    """Stops any running jobs."""
+    self.release.set()
+    self.manager.close()
+
+  def run_job(self, job):
+    """Records one iteration per panel once the job is released."""
+    for _ in range(0, job.iterations):
+      while not self.release.wait(0.01):
+        if job.cancelled:
+          return
+
+      job.record_iteration()
+      job.record_written(len(job.panels))
+
+    if job.wait_time < 0:
+      raise ValueError('invalid wait time')
+
+  def test_submit(self):
+    """Tests that jobs report their progress and outcome."""
+    job, created = self.manager.submit(['b', 'a'], 2, 0)
+    self.assertTrue(created)
+    self.assertEqual(('a', 'b'), job.panels)
+    self.assertIs(job, self.manager.get(job.id))
+
+    self.release.set()
+    self.assertTrue(job.wait(5))
+    status = job.to_json()
+    self.assertEqual('SUCCEEDED', status['state'])
+    self.assertEqual(2, status['completed_iterations'])
+    self.assertEqual(4, status['samples_written'])
+    self.assertIsNotNone(status['finished'])
+    self.assertGreaterEqual(status['elapsed'], 0)
+
+  def test_failure(self):
+    """Tests that exceptions raised by a job are reported."""
+    self.release.set()
+    job, _ = self.manager.submit(['a'], 1, -1)
+    job.wait(5)
+    self.assertEqual(collect_jobs.JobState.FAILED, job.state)
+    self.assertIn('invalid wait time', job.to_json()['error'])
+
+  def test_deduplication(self):
+    """Tests that each panel is collected by at most one active job."""
+    first, _ = self.manager.submit(['a', 'b'], 1, 0)
+    second, created = self.manager.submit(['b', 'a', 'a'], 1, 0)
+    self.assertFalse(created)
+    self.assertIs(first, second)
+
+    other, created = self.manager.submit(['a'], 1, 0)
+    self.assertFalse(created)
+    self.assertIs(first, other)
+
+    other, created = self.manager.submit(['c', 'b'], 1, 0)
+    self.assertTrue(created)
+    self.assertEqual(('c',), other.panels)
+    self.assertTrue(self.manager.is_collecting('b'))
+    self.assertTrue(self.manager.is_collecting('c'))
+    self.assertFalse(self.manager.is_collecting('d'))
+
+    self.release.set()
+    first.wait(5)
+    third, created = self.manager.submit(['a', 'b'], 1, 0)
+    self.assertTrue(created)
+    self.assertIsNot(first, third)
+
+  def test_cancel(self):
+    """Tests that closing the manager cancels active jobs."""
+    job, _ = self.manager.submit(['a'], 10, 0)
+    self.manager.close()
+    self.assertEqual(collect_jobs.JobState.CANCELLED, job.state)
+
+  def test_history(self):
+    """Tests that only the most recent finished jobs are retained."""
+    self.release.set()
+    first, _ = self.manager.submit(['a'], 1, 0)
+    first.wait(5)
+    second, _ = self.manager.submit(['b'], 1, 0)
+    second.wait(5)
+    third, _ = self.manager.submit(['c'], 1, 0)
+    third.wait(5)
+    self.assertIsNone(self.manager.get(first.id))
+    self.assertIs(third, self.manager.get(third.id))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,141 @@
+"""Runs data collection at a fixed rate, aligned to wall-clock ticks.
+
+Sleeping for a fixed time between collection cycles makes the real period the
+sleep time plus the time taken to read and write the data, so samples drift
+away from whole seconds and successive cron-triggered runs overlap. Instead,
+every cycle is given a deadline on the monotonic clock. The first deadline is
+aligned to a multiple of the interval on the wall clock, and each subsequent
+deadline is exactly one interval later, regardless of how long a cycle takes.
+
+A cycle that overruns its interval is not queued behind the next one. A late
+tick runs as soon as the previous cycle finishes, and ticks that were missed
+entirely are skipped and coalesced into the most recent one.
+
+When several meters are collected, each one is given its own thread and its
+ticks are offset by an even share of the interval, so that the meters and the
+database are not all hit at the same instant.
+"""
+
+import datetime
+import logging
+import math
+import threading
+import time
+
+# The default time in seconds between collection cycles.
+DEFAULT_INTERVAL = 1
+
+
+def align(now, interval, offset=0):
+  """Finds the first tick at or after a time.
+
+  Args:
+    now: A time in seconds since the epoch.
+    interval: The time in seconds between ticks.
+    offset: The offset in seconds of each tick from a multiple of the interval.
+
+  Returns:
+    The time of the tick, in seconds since the epoch.
+  """
+  return math.ceil((now - offset) / interval) * interval + offset
+
+
+class Ticker:
+  """Produces wall-clock aligned ticks at a fixed rate without drifting."""
+
+  def __init__(self, interval, offset=0):
+    """Creates a new ticker whose first tick is the next aligned time.
+
+    Args:
+      interval: The time in seconds between ticks.
+      offset: The offset in seconds of each tick from a multiple of the
+          interval.
+    """
+    if interval <= 0:
+      raise ValueError('The tick interval must be positive.')
+
+    self._interval = interval
+    wall = time.time()
+    monotonic = time.monotonic()
+    self._origin = align(wall, interval, offset)
+    self._monotonic_origin = monotonic + (self._origin - wall)
+    self._tick = 0
+    self.skipped = 0
+
+  def wait(self, stop=None):
+    """Waits for the next tick.
+
+    Ticks that have already been missed entirely are skipped, and the most
+    recent one is returned immediately.
+
+    Args:
+      stop: An optional threading.Event that interrupts the wait when set.
+
+    Returns:
+      The time of the tick as a datetime, or None if the stop event was set.
+    """
+    deadline = self._monotonic_origin + self._tick * self._interval
+    now = time.monotonic()
+    missed = int((now - deadline) // self._interval)
+    if missed > 0:
+      logging.warning('Skipping %d missed tick(s) of %g seconds.', missed,
+                      self._interval)
+      self.skipped += missed
+      self._tick += missed
+      deadline += missed * self._interval
+
+    delay = deadline - now
+    if stop is not None:
+      if stop.wait(max(0, delay)):
+        return None
+    elif delay > 0:
+      time.sleep(delay)
+
+    ts = self._origin + self._tick * self._interval
+    self._tick += 1
+    return datetime.datetime.fromtimestamp(ts)
+
+
+class CollectionScheduler:
+  """Invokes a collection task for each meter on every tick."""
+
+  def __init__(self, tasks, interval=DEFAULT_INTERVAL):
+    """Creates a new scheduler. Collection begins when start() is called.
+
+    Args:
+      tasks: A dict from each meter's name to a function that collects its
+          data. The function is passed the time of the tick as a datetime.
+      interval: The time in seconds between collection cycles.
+    """
+    self._tasks = tasks
+    self._interval = interval
+    self._stop = threading.Event()
+    self._threads = []
+
+  def start(self):
+    """Starts a collection thread for every meter."""
+    for i, (name, task) in enumerate(sorted(self._tasks.items())):
+      offset = i * self._interval / len(self._tasks)
+      thread = threading.Thread(
+        target=self._run, args=(task, Ticker(self._interval, offset)),
+        name='collect-%s' % name, daemon=True)
+      thread.start()
+      self._threads.append(thread)
+
+  def close(self):
+    """Stops collection and waits for in-progress cycles to finish."""
+    self._stop.set()
+    for thread in self._threads:
+      thread.join()
+
+  def _run(self, task, ticker):
+    """Runs a task on every tick until the scheduler is closed."""
+    while True:
+      ts = ticker.wait(self._stop)
+      if ts is None:
+        return
+
+      try:
+        task(ts)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Collection failed.')
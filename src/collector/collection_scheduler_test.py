@@ -0,0 +1,98 @@
+"""Collection scheduler unit tests."""
+
+import threading
+import time
+import unittest
+from collector import collection_scheduler
+
+
+def phase(ts, interval):
+  """Returns the distance of a datetime from the nearest multiple of a time."""
+  remainder = ts.timestamp() % interval
+  return min(remainder, interval - remainder)
+
+
+class AlignTestCase(unittest.TestCase):
+  """A test case for tick alignment."""
+
+  def test_align(self):
+    """Tests that times are rounded up to the next tick."""
+    self.assertEqual(10, collection_scheduler.align(9.2, 1))
+    self.assertEqual(10, collection_scheduler.align(10, 1))
+    self.assertEqual(9.5, collection_scheduler.align(9.2, 1, 0.5))
+    self.assertEqual(15, collection_scheduler.align(11, 5))
+
+
+class TickerTestCase(unittest.TestCase):
+  """A test case for ticker operations."""
+
+  def test_ticks_are_aligned(self):
+    """Tests that ticks are exactly one interval apart on the wall clock."""
+    ticker = collection_scheduler.Ticker(0.05)
+    ticks = [ticker.wait() for _ in range(0, 4)]
+    for a, b in zip(ticks, ticks[1:]):
+      self.assertAlmostEqual(0.05, (b - a).total_seconds(), places=5)
+
+    self.assertAlmostEqual(0, phase(ticks[0], 0.05), places=5)
+    self.assertEqual(0, ticker.skipped)
+
+  def test_overruns_are_skipped(self):
+    """Tests that missed ticks are coalesced into the most recent one."""
+    ticker = collection_scheduler.Ticker(0.05)
+    first = ticker.wait().timestamp()
+    time.sleep(0.18)
+    start = time.monotonic()
+    second = ticker.wait().timestamp()
+    self.assertLess(time.monotonic() - start, 0.01)
+    self.assertGreaterEqual(ticker.skipped, 2)
+    self.assertAlmostEqual(0.05 * (ticker.skipped + 1), second - first,
+                           places=5)
+
+  def test_stop(self):
+    """Tests that setting the stop event interrupts the wait."""
+    stop = threading.Event()
+    stop.set()
+    self.assertIsNone(collection_scheduler.Ticker(10).wait(stop))
+
+  def test_invalid_interval(self):
+    """Tests that the interval must be positive."""
+    with self.assertRaises(ValueError):
+      collection_scheduler.Ticker(0)
+
+
+class CollectionSchedulerTestCase(unittest.TestCase):
+  """A test case for collection scheduler operations."""
+
+  def test_tasks_are_staggered(self):
+    """Tests that each meter is collected on its own offset."""
+    ticks = {'a': [], 'b': []}
+    scheduler = collection_scheduler.CollectionScheduler(
+      {name: ticks[name].append for name in ticks}, 0.1)
+    scheduler.start()
+    time.sleep(0.45)
+    scheduler.close()
+
+    self.assertGreaterEqual(len(ticks['a']), 3)
+    self.assertGreaterEqual(len(ticks['b']), 3)
+    for ts in ticks['a']:
+      self.assertAlmostEqual(0, phase(ts, 0.1), places=5)
+    for ts in ticks['b']:
+      self.assertAlmostEqual(0.05, phase(ts, 0.1), places=5)
+
+  def test_failures_do_not_stop_collection(self):
+    """Tests that a failing task is run again on the next tick."""
+    calls = []
+
+    def task(ts):
+      calls.append(ts)
+      raise RuntimeError('failed')
+
+    scheduler = collection_scheduler.CollectionScheduler({'a': task}, 0.05)
+    scheduler.start()
+    time.sleep(0.2)
+    scheduler.close()
+    self.assertGreaterEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
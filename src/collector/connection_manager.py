@@ -0,0 +1,207 @@
+"""Manages the Modbus connection to a single meter.
+
+Meters are occasionally unreachable (e.g. during a power cycle or a network
+outage). Rather than spending seconds timing out on every request to a meter
+that is known to be down, the connection manager tracks the meter's health with
+a circuit breaker:
+
+  * CLOSED: The meter is healthy and requests are sent normally.
+  * OPEN: The meter has failed repeatedly. Requests fail immediately, without
+    touching the network, while a background thread probes the meter by
+    attempting to reconnect with exponential backoff.
+  * HALF_OPEN: A probe succeeded. Requests are sent again; the first success
+    closes the circuit and the first failure reopens it.
+"""
+
+import dataclasses
+import datetime
+import enum
+import logging
+import threading
+import typing
+from pymodbus.exceptions import ConnectionException, ModbusException
+
+# The default number of consecutive failures that open the circuit.
+DEFAULT_FAILURE_THRESHOLD = 3
+
+# The default delay in seconds before the first reconnection probe.
+DEFAULT_INITIAL_BACKOFF = 1
+
+# The default upper bound in seconds on the delay between probes.
+DEFAULT_MAX_BACKOFF = 60
+
+
+class CircuitState(enum.Enum):
+  """An enumeration of circuit breaker states."""
+  CLOSED = 0
+  OPEN = 1
+  HALF_OPEN = 2
+
+
+class CircuitOpenError(ConnectionException):
+  """Raised instead of sending a request to a meter that is known to be down."""
+
+
+# A snapshot of a meter's connection health.
+#
+# Args:
+#   state: The circuit breaker state.
+#   consecutive_failures: The number of failed requests since the last success.
+#   last_success: The time of the last successful request.
+#   last_failure: The time of the last failed request.
+#   last_error: A description of the last failure.
+#   backoff: The current delay in seconds between reconnection probes.
+@dataclasses.dataclass(frozen=True)
+class MeterHealth:
+  state: CircuitState
+  consecutive_failures: int
+  last_success: typing.Optional[datetime.datetime]
+  last_failure: typing.Optional[datetime.datetime]
+  last_error: typing.Optional[str]
+  backoff: float
+
+  def to_json(self):
+    """Returns a JSON-serializable representation of the health state."""
+    return {
+      'state': self.state.name,
+      'consecutive_failures': self.consecutive_failures,
+      'last_success': (self.last_success.isoformat()
+                       if self.last_success else None),
+      'last_failure': (self.last_failure.isoformat()
+                       if self.last_failure else None),
+      'last_error': self.last_error,
+      'backoff': self.backoff
+    }
+
+
+class ConnectionManager:
+  """Guards a Modbus client with a circuit breaker."""
+
+  def __init__(self, client, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+               initial_backoff=DEFAULT_INITIAL_BACKOFF,
+               max_backoff=DEFAULT_MAX_BACKOFF):
+    """Creates a new connection manager.
+
+    Args:
+      client: The Modbus client used to communicate with the meter.
+      failure_threshold: The number of consecutive failures that open the
+          circuit.
+      initial_backoff: The delay in seconds before the first reconnection
+          probe. The delay doubles after every failed probe.
+      max_backoff: The upper bound in seconds on the delay between probes.
+    """
+    self._client = client
+    self._failure_threshold = max(1, failure_threshold)
+    self._initial_backoff = initial_backoff
+    self._max_backoff = max_backoff
+
+    self._lock = threading.Lock()
+    self._closed = threading.Event()
+    self._prober = None
+    self._state = CircuitState.CLOSED
+    self._consecutive_failures = 0
+    self._backoff = initial_backoff
+    self._last_success = None
+    self._last_failure = None
+    self._last_error = None
+
+  @property
+  def health(self):
+    with self._lock:
+      return MeterHealth(self._state, self._consecutive_failures,
+                         self._last_success, self._last_failure,
+                         self._last_error, self._backoff)
+
+  def read_holding_registers(self, address, count):
+    """Reads a range of holding registers.
+
+    Args:
+      address: The address of the first register.
+      count: The number of registers to read.
+
+    Returns:
+      A list of register values.
+
+    Raises:
+      CircuitOpenError: When the meter is known to be unreachable.
+      ConnectionException: When the meter cannot be reached.
+      ModbusException: When the meter rejects the request.
+    """
+    with self._lock:
+      if self._state == CircuitState.OPEN:
+        raise CircuitOpenError('The circuit to %s is open.' % self._client)
+
+    try:
+      result = self._client.read_holding_registers(address, count, unit=0x01)
+    except ConnectionException as e:
+      self._record_failure(e)
+      raise
+
+    if result.isError():
+      # An exception response means that the meter is reachable but rejected
+      # the request. Anything else (e.g. a timeout) is a connection failure.
+      if not hasattr(result, 'exception_code'):
+        e = ConnectionException(str(result))
+        self._record_failure(e)
+        raise e
+
+      self._record_success()
+      raise ModbusException(str(result))
+
+    self._record_success()
+    return result.registers
+
+  def close(self):
+    """Stops probing and closes the connection."""
+    self._closed.set()
+    self._client.close()
+
+  def _record_success(self):
+    """Closes the circuit after a successful request."""
+    with self._lock:
+      if self._state != CircuitState.CLOSED:
+        logging.info('Connection to %s restored.', self._client)
+
+      self._state = CircuitState.CLOSED
+      self._consecutive_failures = 0
+      self._backoff = self._initial_backoff
+      self._last_success = datetime.datetime.now()
+
+  def _record_failure(self, error):
+    """Records a failed request, opening the circuit if necessary."""
+    with self._lock:
+      self._consecutive_failures += 1
+      self._last_failure = datetime.datetime.now()
+      self._last_error = str(error)
+      if self._state == CircuitState.HALF_OPEN:
+        self._backoff = min(self._backoff * 2, self._max_backoff)
+      elif (self._state == CircuitState.OPEN
+            or self._consecutive_failures < self._failure_threshold):
+        return
+
+      logging.warning('Opening circuit to %s after %d failures: %s',
+                      self._client, self._consecutive_failures, error)
+      self._state = CircuitState.OPEN
+      self._client.close()
+      if self._prober is None:
+        self._prober = threading.Thread(
+          target=self._probe, name='probe-%s' % self._client, daemon=True)
+        self._prober.start()
+
+  def _probe(self):
+    """Attempts to reconnect to the meter until it becomes reachable."""
+    while True:
+      with self._lock:
+        backoff = self._backoff
+
+      if self._closed.wait(backoff):
+        return
+
+      if self._client.connect():
+        with self._lock:
+          self._state = CircuitState.HALF_OPEN
+          self._prober = None
+        return
+
+      with self._lock:
+        self._backoff = min(self._backoff * 2, self._max_backoff)
@@ -0,0 +1,122 @@
+"""Connection manager unit tests."""
+
+import time
+import unittest
+from pymodbus.exceptions import ConnectionException
+from collector import connection_manager
+
+
+class FlakyModbusClient:
+  """A Modbus client whose reachability can be toggled."""
+
+  def __init__(self):
+    """Creates a new, reachable client."""
+    self.reachable = True
+    self.reads = 0
+    self.connects = 0
+
+  def read_holding_registers(self, address, count, unit):
+    """Returns zeroed registers, or raises when unreachable."""
+    self.reads += 1
+    if not self.reachable:
+      raise ConnectionException('unreachable')
+
+    return type('ReadHoldingRegistersResponse', (object,), {
+      'registers': [0] * count, 'isError': lambda self: False})()
+
+  def connect(self):
+    """Connects if the meter is reachable."""
+    self.connects += 1
+    return self.reachable
+
+  def close(self):
+    """Pretends to close the connection."""
+
+
+def wait_for_state(manager, state, timeout=2):
+  """Waits for a connection manager to enter a given state."""
+  deadline = time.monotonic() + timeout
+  while manager.health.state != state and time.monotonic() < deadline:
+    time.sleep(0.005)
+
+  return manager.health.state
+
+
+class ConnectionManagerTestCase(unittest.TestCase):
+  """A test case for connection manager operations."""
+
+  def setUp(self):
+    """Creates a manager that opens its circuit after two failures."""
+    self.client = FlakyModbusClient()
+    self.manager = connection_manager.ConnectionManager(
+      self.client, failure_threshold=2, initial_backoff=0.01, max_backoff=0.04)
+
+  def tearDown(self):
+    """Stops any background probes."""
+    self.manager.close()
+
+  def test_read(self):
+    """Tests that registers are read while the meter is healthy."""
+    self.assertEqual([0, 0], self.manager.read_holding_registers(10, 2))
+    health = self.manager.health
+    self.assertEqual(connection_manager.CircuitState.CLOSED, health.state)
+    self.assertIsNotNone(health.last_success)
+
+  def test_circuit_opens_and_fails_fast(self):
+    """Tests that requests are not sent while the circuit is open."""
+    self.client.reachable = False
+    for _ in range(0, 2):
+      with self.assertRaises(ConnectionException):
+        self.manager.read_holding_registers(10, 2)
+
+    self.assertEqual(connection_manager.CircuitState.OPEN,
+                     self.manager.health.state)
+    reads = self.client.reads
+    with self.assertRaises(connection_manager.CircuitOpenError):
+      self.manager.read_holding_registers(10, 2)
+    self.assertEqual(reads, self.client.reads)
+
+  def test_probe_backs_off_and_recovers(self):
+    """Tests that the circuit closes once the meter becomes reachable."""
+    self.client.reachable = False
+    for _ in range(0, 2):
+      with self.assertRaises(ConnectionException):
+        self.manager.read_holding_registers(10, 2)
+
+    time.sleep(0.1)
+    self.assertGreater(self.client.connects, 1)
+    self.assertEqual(0.04, self.manager.health.backoff)
+
+    self.client.reachable = True
+    self.assertEqual(
+      connection_manager.CircuitState.HALF_OPEN,
+      wait_for_state(self.manager, connection_manager.CircuitState.HALF_OPEN))
+    self.manager.read_holding_registers(10, 2)
+    health = self.manager.health
+    self.assertEqual(connection_manager.CircuitState.CLOSED, health.state)
+    self.assertEqual(0, health.consecutive_failures)
+    self.assertEqual(0.01, health.backoff)
+
+  def test_half_open_failure_reopens(self):
+    """Tests that a failure after a successful probe reopens the circuit."""
+    self.client.reachable = False
+    for _ in range(0, 2):
+      with self.assertRaises(ConnectionException):
+        self.manager.read_holding_registers(10, 2)
+
+    self.client.reachable = True
+    wait_for_state(self.manager, connection_manager.CircuitState.HALF_OPEN)
+    self.client.reachable = False
+    with self.assertRaises(ConnectionException):
+      self.manager.read_holding_registers(10, 2)
+    self.assertEqual(connection_manager.CircuitState.OPEN,
+                     self.manager.health.state)
+
+    self.client.reachable = True
+    self.assertEqual(
+      connection_manager.CircuitState.HALF_OPEN,
+      wait_for_state(self.manager, connection_manager.CircuitState.HALF_OPEN))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,4 +1,4 @@
-"""A program that launches the UW Solar web server for a single solar panel.
+"""A program that launches the UW Solar web server for one or more solar panels.
 
 This launcher should only be used for development purposes. It is not suitable
 for production deployments. A WSGI container such as Green Unicorn or uWSGI, or
@@ -9,20 +9,30 @@ deploy the application for production purposes.
 import argparse
 import bottle
 import logging
-from collector import api_server, metrics_builder, panel_accessor
-from db import db_accessor
+from collector import api_server, metric_cache, panel_config, read_planner
+from db import db_accessor, spool, write_queue
 
 DEFAULT_HTTP_SERVER_HOST = '0.0.0.0'
 DEFAULT_HTTP_SERVER_PORT = 8080
+DEFAULT_COLLECT_MAX_WORKERS = api_server.DEFAULT_MAX_WORKERS
+DEFAULT_METRIC_MAX_STALENESS = metric_cache.DEFAULT_MAX_STALENESS
+DEFAULT_COLLECT_INTERVAL = 0
 DEFAULT_DB_TYPE = 'sqlite'
 DEFAULT_DB_USER = 'uwsolar'
 DEFAULT_DB_PASSWORD = ''
 DEFAULT_DB_HOST = ':memory:'
 DEFAULT_DB_NAME = 'uwsolar'
 DEFAULT_DB_POOL_SIZE = 3
+DEFAULT_DB_STORAGE_MODE = db_accessor.STORAGE_LEGACY
+DEFAULT_DB_WRITE_QUEUE_SIZE = write_queue.DEFAULT_MAX_SIZE
+DEFAULT_DB_WRITE_BATCH_SIZE = write_queue.DEFAULT_BATCH_SIZE
+DEFAULT_DB_WRITE_MAX_DELAY = write_queue.DEFAULT_MAX_DELAY
+DEFAULT_DB_SPOOL_MAX_BYTES = spool.DEFAULT_MAX_BYTES
+DEFAULT_DB_SPOOL_FSYNC = spool.FSYNC_INTERVAL
 DEFAULT_PANEL_METRICS_WORKSHEET_NAME = 'Metrics'
 DEFAULT_PANEL_MODBUS_RETRIES = 3
 DEFAULT_PANEL_MODBUS_RETRY_WAIT_TIME = 1
+DEFAULT_PANEL_MODBUS_MAX_GAP = read_planner.DEFAULT_MAX_GAP
 
 
 def parse_arguments():
@@ -46,6 +56,19 @@ def parse_arguments():
   http_group.add_argument(
     '--port', type=int, default=DEFAULT_HTTP_SERVER_PORT,
     help='The port on which to listen for requests.')
+  http_group.add_argument(
+    '--collect_max_workers', type=int, default=DEFAULT_COLLECT_MAX_WORKERS,
+    help='The largest number of panels to read at once during collection.')
+  http_group.add_argument(
+    '--metric_max_staleness', type=float,
+    default=DEFAULT_METRIC_MAX_STALENESS,
+    help='The age in seconds after which a collected metric value is no '
+         'longer served by GET /metric, in addition to the sampling interval '
+         'of the metric.')
+  http_group.add_argument(
+    '--collect_interval', type=float, default=DEFAULT_COLLECT_INTERVAL,
+    help='The time in seconds between collection cycles run by the server '
+         'itself. When zero, data is only collected by POST /collect.')
 
   # Database connectivity arguments.
   db_group = parser.add_argument_group(
@@ -64,31 +87,89 @@ def parse_arguments():
   db_group.add_argument(
     '--db_pool_size', type=int, default=DEFAULT_DB_POOL_SIZE,
     help='The database pool size.')
+  db_group.add_argument(
+    '--db_storage_mode', choices=db_accessor.STORAGE_MODES,
+    default=DEFAULT_DB_STORAGE_MODE,
+    help='Whether values are stored in the data table (legacy), the typed_data '
+         'table (typed), both while existing data is copied (dual), or the '
+         'typed_data table with past hours compressed into chunks (chunked).')
+  db_group.add_argument(
+    '--db_archive_dir',
+    help='A directory of archived values (see db/archive_data.py), which are '
+         'read along with those of the database.')
+  db_group.add_argument(
+    '--db_sqlite_production', action='store_true',
+    help='Use write-ahead logging and a single writer thread with a SQLite '
+         'database file, so that it may be read and written concurrently.')
+  db_group.add_argument(
+    '--db_write_queue_size', type=int, default=DEFAULT_DB_WRITE_QUEUE_SIZE,
+    help='The number of collected values that may await writing before '
+         'collection blocks.')
+  db_group.add_argument(
+    '--db_write_batch_size', type=int, default=DEFAULT_DB_WRITE_BATCH_SIZE,
+    help='The largest number of values written in a single transaction.')
+  db_group.add_argument(
+    '--db_write_max_delay', type=float, default=DEFAULT_DB_WRITE_MAX_DELAY,
+    help='The time in seconds that a collected value may wait before it is '
+         'written.')
+  db_group.add_argument(
+    '--db_spool_dir',
+    help='A directory in which to spool collected values while the database '
+         'cannot be written to. When absent, such values are discarded.')
+  db_group.add_argument(
+    '--db_spool_max_bytes', type=int, default=DEFAULT_DB_SPOOL_MAX_BYTES,
+    help='The largest size in bytes of the spool. The oldest values are '
+         'discarded to stay within this size.')
+  db_group.add_argument(
+    '--db_spool_fsync', choices=spool.FSYNC_POLICIES,
+    default=DEFAULT_DB_SPOOL_FSYNC,
+    help='When spooled values are flushed to disk: after every write, at most '
+         'once per second, or when the operating system chooses.')
+  db_group.add_argument(
+    '--db_spool_mmap', action='store_true',
+    help='Whether to memory-map spool files while replaying them.')
 
   # Solar panel connectivity arguments.
   panel_group = parser.add_argument_group(
     'panel', 'Solar panel connectivity arguments.')
   panel_group.add_argument(
-    '--panel_host', required=True, help='The solar panel host address.')
+    '--panels_file',
+    help='A JSON file containing a list of panels. When present, the '
+         'single-panel flags below are ignored.')
   panel_group.add_argument(
-    '--panel_topic_prefix', required=True,
+    '--panel_host', help='The solar panel host address.')
+  panel_group.add_argument(
+    '--panel_topic_prefix',
     help='The solar panel topic prefix (e.g. UW/Mercer/nexus_meter).')
   panel_group.add_argument(
-    '--panel_metrics_workbook', required=True,
+    '--panel_metrics_workbook',
     help='The workbook containing solar panel metrics data.')
   panel_group.add_argument(
     '--panel_metrics_worksheet_name',
     default=DEFAULT_PANEL_METRICS_WORKSHEET_NAME,
     help='The name of the worksheet containing metrics data.')
   panel_group.add_argument(
-    '--panel_modbus_retries', default=DEFAULT_PANEL_MODBUS_RETRIES,
-    help='The number of times to retry Modbus RPCs.')
+    '--panel_modbus_retries', type=int, default=DEFAULT_PANEL_MODBUS_RETRIES,
+    help='The number of times to retry Modbus RPCs. This many consecutive '
+         'failures mark the panel as unreachable.')
   panel_group.add_argument(
-    '--panel_modbus_retry_wait_time',
+    '--panel_modbus_retry_wait_time', type=float,
     default=DEFAULT_PANEL_MODBUS_RETRY_WAIT_TIME,
-    help='The delay in seconds to wait between Modbus RPC retries.')
+    help='The initial delay in seconds between attempts to reconnect to an '
+         'unreachable panel.')
+  panel_group.add_argument(
+    '--panel_modbus_max_gap', type=int, default=DEFAULT_PANEL_MODBUS_MAX_GAP,
+    help='The number of unused registers that may be read in order to '
+         'coalesce neighbouring metrics into a single Modbus RPC.')
 
-  return parser.parse_args()
+  args = parser.parse_args()
+  if not args.panels_file and not (args.panel_host and args.panel_topic_prefix
+                                   and args.panel_metrics_workbook):
+    parser.error('Either --panels_file or all of --panel_host, '
+                 '--panel_topic_prefix and --panel_metrics_workbook are '
+                 'required.')
+
+  return args
 
 
 def main():
@@ -99,20 +180,45 @@ def main():
   # Initialize database connection.
   db_opts = db_accessor.DatabaseOptions(
     args.db_type, args.db_user, args.db_password, args.db_host, args.db_name,
-    args.db_pool_size)
+    args.db_pool_size, args.db_storage_mode, args.db_archive_dir,
+    args.db_sqlite_production)
   db_con = db_accessor.DatabaseAccessor(db_opts)
-
-  # Initialize solar panel connection.
-  panel_metrics = metrics_builder.build_metrics(
-    args.panel_metrics_workbook, args.panel_metrics_worksheet_name,
-    args.panel_topic_prefix)
-  panel_con = panel_accessor.PanelAccessor(
-    args.panel_host, panel_metrics, args.panel_modbus_retries,
-    args.panel_modbus_retry_wait_time)
+  db_spool = replayer = None
+  if args.db_spool_dir:
+    db_spool = spool.Spool(args.db_spool_dir, max_bytes=args.db_spool_max_bytes,
+                           fsync=args.db_spool_fsync,
+                           use_mmap=args.db_spool_mmap)
+    replayer = spool.SpoolReplayer(db_spool, db_con)
+
+  writer = write_queue.WriteBehindQueue(
+    db_con, args.db_write_queue_size, args.db_write_batch_size,
+    args.db_write_max_delay, db_spool)
+
+  # Initialize solar panel connections.
+  if args.panels_file:
+    panel_options = panel_config.load_panel_options(args.panels_file)
+  else:
+    panel_options = [panel_config.PanelOptions(
+      args.panel_host, args.panel_topic_prefix, args.panel_metrics_workbook,
+      args.panel_metrics_worksheet_name)]
+
+  panels = {o.topic_prefix: panel_config.create_panel_accessor(
+    o, args.panel_modbus_retries, args.panel_modbus_retry_wait_time,
+    args.panel_modbus_max_gap) for o in panel_options}
 
   # Initialize and run API server.
-  app = api_server.ApiServer(db_con, panel_con).app()
-  bottle.run(app=app, host=args.host, port=args.port, debug=args.debug)
+  server = api_server.ApiServer(db_con, panels, args.collect_max_workers,
+                                args.metric_max_staleness,
+                                args.collect_interval, writer)
+  try:
+    bottle.run(app=server.app(), host=args.host, port=args.port,
+               debug=args.debug)
+  finally:
+    server.close()
+    writer.close()
+    if db_spool:
+      replayer.close()
+      db_spool.close()
 
 
 if __name__ == '__main__':
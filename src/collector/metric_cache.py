@@ -0,0 +1,146 @@
+"""An in-process cache of the most recent value of every metric.
+
+The collection loop reads every metric of every panel once per cycle. Storing
+those readings lets the server answer requests for a metric's current value
+from memory, instead of issuing a Modbus RPC per request.
+
+When a reading is older than the configured maximum staleness (e.g. when
+collection is not running), the panel is read again. Metrics that are sampled
+less often than every cycle are allowed to be older by their sampling interval,
+since collection only refreshes them that often. Concurrent misses for the
+same panel are coalesced: one caller reads the panel while the others wait for
+its result.
+"""
+
+import dataclasses
+import datetime
+import threading
+import time
+import typing
+
+# The default age in seconds after which a cached value is no longer served.
+DEFAULT_MAX_STALENESS = 5
+
+
+# A metric value and the time at which it was read.
+#
+# Args:
+#   value: The metric value.
+#   ts: The time at which the value was read.
+#   monotonic_ts: The value of time.monotonic() when the value was read.
+@dataclasses.dataclass(frozen=True)
+class Sample:
+  value: typing.Any
+  ts: datetime.datetime
+  monotonic_ts: float
+
+
+class _Flight:
+  """A panel read that other callers may wait on."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.error = None
+
+
+class MetricCache:
+  """A cache of the latest reading of each metric, keyed by panel."""
+
+  def __init__(self, max_staleness=DEFAULT_MAX_STALENESS):
+    """Creates a new cache.
+
+    Args:
+      max_staleness: The age in seconds after which a cached value is no
+          longer served.
+    """
+    self._max_staleness = max_staleness
+    self._lock = threading.Lock()
+    self._samples = {}
+    self._flights = {}
+
+  def put(self, panel, values, ts, monotonic_ts=None):
+    """Stores a set of readings from a panel.
+
+    Args:
+      panel: The panel's topic prefix.
+      values: A dict from the metric name to its value.
+      ts: The time at which the values were read.
+      monotonic_ts: The value of time.monotonic() when the values were read.
+          Defaults to the current time.
+    """
+    if monotonic_ts is None:
+      monotonic_ts = time.monotonic()
+
+    with self._lock:
+      for name, value in values.items():
+        current = self._samples.get((panel, name))
+        if current is None or current.monotonic_ts <= monotonic_ts:
+          self._samples[(panel, name)] = Sample(value, ts, monotonic_ts)
+
+  def get(self, panel, name, load, sampling_interval=0):
+    """Gets the latest value of a metric, reading the panel if necessary.
+
+    Args:
+      panel: The panel's topic prefix.
+      name: The metric name.
+      load: A function that reads the panel and returns a dict from the metric
+          name to its value. It is invoked at most once at a time per panel.
+      sampling_interval: The time in seconds between the metric's samples
+          during collection, by which its value may be older than the maximum
+          staleness.
+
+    Returns:
+      A Sample object.
+
+    Raises:
+      Exception: Any exception raised by the load function.
+    """
+    while True:
+      with self._lock:
+        sample = self._samples.get((panel, name))
+        if sample is not None and self._is_fresh(sample, sampling_interval):
+          return sample
+
+        flight = self._flights.get(panel)
+        leader = flight is None
+        if leader:
+          flight = _Flight()
+          self._flights[panel] = flight
+
+      if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+          raise flight.error
+
+        with self._lock:
+          sample = self._samples.get((panel, name))
+        if sample is not None:
+          return sample
+
+        # The panel was read, but did not report this metric. Retry as the
+        # leader of a new flight.
+        continue
+
+      try:
+        monotonic_ts = time.monotonic()
+        ts = datetime.datetime.now()
+        self.put(panel, load(), ts, monotonic_ts)
+      except Exception as e:
+        flight.error = e
+        raise
+      finally:
+        with self._lock:
+          del self._flights[panel]
+        flight.done.set()
+
+      with self._lock:
+        sample = self._samples.get((panel, name))
+      if sample is None:
+        raise KeyError(name)
+
+      return sample
+
+  def _is_fresh(self, sample, sampling_interval):
+    """Checks whether a sample may still be served."""
+    return (time.monotonic() - sample.monotonic_ts
+            <= self._max_staleness + sampling_interval)
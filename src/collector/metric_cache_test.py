@@ -0,0 +1,125 @@
+"""Metric cache unit tests."""
+
+import datetime
+import threading
+import time
+import unittest
+from collector import metric_cache
+
+
+class CountingLoader:
+  """A panel read that counts its invocations."""
+
+  def __init__(self, values, delay=0, error=None):
+    self.values = values
+    self.delay = delay
+    self.error = error
+    self.calls = 0
+
+  def __call__(self):
+    self.calls += 1
+    time.sleep(self.delay)
+    if self.error:
+      raise self.error
+
+    return self.values
+
+
+class MetricCacheTestCase(unittest.TestCase):
+  """A test case for metric cache operations."""
+
+  def test_get_fresh(self):
+    """Tests that fresh values are served without reading the panel."""
+    cache = metric_cache.MetricCache(60)
+    ts = datetime.datetime(2018, 1, 1)
+    cache.put('UW/Alder/eaton_meter', {'W': 1.5}, ts)
+
+    load = CountingLoader({'W': 2.5})
+    sample = cache.get('UW/Alder/eaton_meter', 'W', load)
+    self.assertEqual(1.5, sample.value)
+    self.assertEqual(ts, sample.ts)
+    self.assertEqual(0, load.calls)
+
+  def test_get_stale(self):
+    """Tests that stale values cause the panel to be read."""
+    cache = metric_cache.MetricCache(1)
+    cache.put('UW/Alder/eaton_meter', {'W': 1.5}, datetime.datetime(2018, 1, 1),
+              time.monotonic() - 2)
+
+    load = CountingLoader({'W': 2.5, 'freq': 60.0})
+    self.assertEqual(2.5, cache.get('UW/Alder/eaton_meter', 'W', load).value)
+    self.assertEqual(60.0,
+                     cache.get('UW/Alder/eaton_meter', 'freq', load).value)
+    self.assertEqual(1, load.calls)
+
+  def test_get_sampling_interval(self):
+    """Tests that values may be older by their metric's sampling interval."""
+    cache = metric_cache.MetricCache(1)
+    cache.put('UW/Alder/eaton_meter', {'pf': 0.9},
+              datetime.datetime(2018, 1, 1), time.monotonic() - 5)
+
+    load = CountingLoader({'pf': 0.95})
+    self.assertEqual(0.9, cache.get('UW/Alder/eaton_meter', 'pf', load,
+                                    10).value)
+    self.assertEqual(0.95, cache.get('UW/Alder/eaton_meter', 'pf', load,
+                                     1).value)
+    self.assertEqual(1, load.calls)
+
+  def test_put_ignores_older_readings(self):
+    """Tests that an older reading does not replace a newer one."""
+    cache = metric_cache.MetricCache(60)
+    now = time.monotonic()
+    cache.put('p', {'W': 2.5}, datetime.datetime(2018, 1, 1, 0, 0, 1), now)
+    cache.put('p', {'W': 1.5}, datetime.datetime(2018, 1, 1), now - 1)
+    self.assertEqual(2.5, cache.get('p', 'W', CountingLoader({})).value)
+
+  def test_get_single_flight(self):
+    """Tests that concurrent misses share a single panel read."""
+    cache = metric_cache.MetricCache(60)
+    load = CountingLoader({'W': 2.5, 'freq': 60.0}, delay=0.1)
+    results = []
+
+    def get(name):
+      results.append(cache.get('p', name, load).value)
+
+    threads = [threading.Thread(target=get, args=(n,))
+               for n in ('W', 'freq') * 5]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    self.assertEqual(1, load.calls)
+    self.assertEqual([2.5] * 5 + [60.0] * 5, sorted(results))
+
+  def test_get_error(self):
+    """Tests that read errors are raised to every waiting caller."""
+    cache = metric_cache.MetricCache(60)
+    error = ConnectionError('unreachable')
+    load = CountingLoader({}, delay=0.1, error=error)
+    errors = []
+
+    def get():
+      try:
+        cache.get('p', 'W', load)
+      except ConnectionError as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=get) for _ in range(0, 3)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    self.assertEqual(1, load.calls)
+    self.assertEqual([error] * 3, errors)
+
+  def test_get_unknown_metric(self):
+    """Tests that an error is raised when the panel lacks the metric."""
+    cache = metric_cache.MetricCache(60)
+    with self.assertRaises(KeyError):
+      cache.get('p', 'W', CountingLoader({'freq': 60.0}))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,13 +14,18 @@ DATA_TYPE_STR_TO_ENUM = {
   'INT32': model.MetricDataType.INT32,
   'INT64': model.MetricDataType.INT64,
   'FLOAT32': model.MetricDataType.FLOAT32,
-  'FLOAT64': model.MetricDataType.FLOAT64
+  'FLOAT64': model.MetricDataType.FLOAT64,
+  'STRING': model.MetricDataType.STRING
 }
 
 
 def build_metrics(input_workbook, metrics_worksheet_name, topic_name_prefix):
   """Builds metrics information from an Excel workbook.
 
+  The worksheet's columns are the metric name, description, address, size,
+  scaling factor and data type, optionally followed by the sampling interval
+  and variance threshold.
+
   Args:
     input_workbook: The Excel workbook containing metrics information.
     metrics_worksheet_name: The name of the worksheet containing data.
@@ -44,7 +49,12 @@ def build_metrics(input_workbook, metrics_worksheet_name, topic_name_prefix):
     scaling_factor = row[4].value
     data_type = DATA_TYPE_STR_TO_ENUM[row[5].value]
     topic_name = '{}/{}'.format(topic_name_prefix, name)
+
+    # Sampling options are optional columns.
+    sampling_interval = row[6].value if len(row) > 6 else None
+    variance_threshold = row[7].value if len(row) > 7 else None
     result[name] = model.Metric(
-      name, description, address, size, scaling_factor, data_type, topic_name)
+      name, description, address, size, scaling_factor, data_type, topic_name,
+      sampling_interval, variance_threshold)
 
   return result
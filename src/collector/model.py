@@ -30,6 +30,11 @@ class MetricDataType(enum.Enum):
 #   scaling_factor: The scaling factor to apply to the metric value.
 #   data_type: The metric data type.
 #   topic_name: The topic name.
+#   sampling_interval: The time in seconds between samples of the metric, or
+#       None to sample it during every collection iteration.
+#   variance_threshold: The variance above which the metric is considered to be
+#       changing quickly, and is sampled during every collection iteration
+#       regardless of its sampling interval. None disables this behaviour.
 @dataclasses.dataclass(frozen=True)
 class Metric:
   name: str
@@ -39,3 +44,5 @@ class Metric:
   scaling_factor: float
   data_type: str
   topic_name: str
+  sampling_interval: float = None
+  variance_threshold: float = None
@@ -6,52 +6,71 @@ heterogeneous, so register mappings for each different configuration are
 provided in Excel spreadsheets.
 """
 
-import time
+import functools
 from pymodbus.client.sync import ModbusTcpClient
-from pymodbus.constants import Endian
 from pymodbus.exceptions import ConnectionException
-from pymodbus.payload import BinaryPayloadDecoder
-from collector import model
-
-# The number of bits per register (2 bytes = 16 bits).
-BITS_PER_REGISTER = 16
-
-# A mapping from metric data type to decoding method.
-DATA_TYPE_TO_DECODER_MAP = {
-  model.MetricDataType.UINT8: BinaryPayloadDecoder.decode_8bit_uint,
-  model.MetricDataType.UINT16: BinaryPayloadDecoder.decode_16bit_uint,
-  model.MetricDataType.UINT32: BinaryPayloadDecoder.decode_32bit_uint,
-  model.MetricDataType.UINT64: BinaryPayloadDecoder.decode_64bit_uint,
-  model.MetricDataType.INT8: BinaryPayloadDecoder.decode_8bit_int,
-  model.MetricDataType.INT16: BinaryPayloadDecoder.decode_16bit_int,
-  model.MetricDataType.INT32: BinaryPayloadDecoder.decode_32bit_int,
-  model.MetricDataType.INT64: BinaryPayloadDecoder.decode_64bit_int,
-  model.MetricDataType.FLOAT32: BinaryPayloadDecoder.decode_32bit_float,
-  model.MetricDataType.FLOAT64: BinaryPayloadDecoder.decode_64bit_float
-}
+from collector import connection_manager, read_planner, register_decoder
+
+# The default Modbus TCP port.
+DEFAULT_PORT = 502
+
+# The default time in seconds to wait for a Modbus response.
+DEFAULT_TIMEOUT = 3
+
+# The default number of plans for subsets of metrics that are kept.
+DEFAULT_MAX_SUBSET_PLANS = 32
 
 
 class PanelAccessor:
   """A data accessor for solar panels."""
 
-  def __init__(self, host, metrics, retries, retry_wait_time):
+  def __init__(self, host, metrics, retries, retry_wait_time,
+               max_gap=read_planner.DEFAULT_MAX_GAP, port=DEFAULT_PORT,
+               timeout=DEFAULT_TIMEOUT,
+               max_subset_plans=DEFAULT_MAX_SUBSET_PLANS):
     """Creates a new solar panel accessor.
 
     Args:
       host: The TCP host.
       metrics: A mapping of metric names to metric metadata for this panel.
-      retries: The number of times to retry a Modbus RPC.
-      retry_wait_time: The delay in seconds between Modbus RPC retries.
+      retries: The number of times to retry a Modbus RPC. This many
+          consecutive failures mark the panel as unreachable, after which
+          requests fail immediately until the panel can be reconnected.
+      retry_wait_time: The delay in seconds before the first attempt to
+          reconnect to an unreachable panel. The delay doubles after every
+          failed attempt.
+      max_gap: The largest number of unused registers that may be read in order
+          to coalesce neighbouring metrics into a single RPC.
+      port: The TCP port.
+      timeout: The time in seconds to wait for a Modbus response.
+      max_subset_plans: The number of plans for subsets of metrics that are
+          kept, in least recently used order.
     """
-    self._modbus_client = ModbusTcpClient(host)
+    self._connection = connection_manager.ConnectionManager(
+      ModbusTcpClient(host, port, timeout=timeout), retries, retry_wait_time)
     self._metrics = metrics
     self._retries = retries
-    self._retry_wait_time = retry_wait_time
+    self._max_gap = max_gap
+    self._read_plan = self._compile_plan(metrics.values())
+    self._subset_plan = functools.lru_cache(maxsize=max_subset_plans)(
+      self._compile_subset_plan)
+    self._metric_decoders = {
+      name: register_decoder.BlockDecoder(
+        read_planner.ReadBlock(m.address, m.size, (m,)))
+      for name, m in metrics.items()}
 
   @property
   def metrics(self):
     return self._metrics
 
+  @property
+  def health(self):
+    return self._connection.health
+
+  def close(self):
+    """Closes the connection to the solar panel."""
+    self._connection.close()
+
   def has_metric(self, name):
     """Checks if a particular metric is supported by this panel.
 
@@ -77,19 +96,67 @@ class PanelAccessor:
       The current value of the metric.
     """
     metric = self._metrics[name]
+    registers = self._read_registers(metric.address, metric.size)
+    return self._metric_decoders[name].decode(registers)[name]
+
+  def get_metrics(self, names=None):
+    """Gets the current values of several metrics.
+
+    Metrics are read in coalesced blocks of contiguous registers, so that a
+    full set of metrics costs only a handful of Modbus RPCs.
+
+    Args:
+      names: The metric names to read. All known metrics are read by default.
+
+    Returns:
+      A dict from the metric name to its current value.
+    """
+    if names is None:
+      plan = self._read_plan
+    else:
+      plan = self._subset_plan(frozenset(names))
+
+    result = {}
+    for block, decoder in plan:
+      registers = self._read_registers(block.address, block.size)
+      result.update(decoder.decode(registers))
+
+    return result
+
+  def _compile_subset_plan(self, names):
+    """Compiles the plan for a frozenset of metric names."""
+    return self._compile_plan([self._metrics[n] for n in names])
+
+  def _compile_plan(self, metrics):
+    """Plans block reads for a set of metrics and compiles their decoders.
+
+    Args:
+      metrics: The metrics to be read.
+
+    Returns:
+      A list of (ReadBlock, BlockDecoder) pairs.
+    """
+    return [(block, register_decoder.BlockDecoder(block))
+            for block in read_planner.plan_reads(metrics, self._max_gap)]
+
+  def _read_registers(self, address, size):
+    """Reads a range of holding registers, retrying on connection errors.
+
+    Retries are attempted immediately. Once the panel is marked unreachable,
+    the connection manager fails requests without waiting on the network.
+
+    Args:
+      address: The address of the first register.
+      size: The number of registers to read.
+
+    Returns:
+      A list of register values.
+    """
     for i in range(0, self._retries):
-      result = None
       try:
-        result = self._modbus_client.read_holding_registers(
-          metric.address, metric.size, unit=0x01)
-      except ConnectionException as e:
+        return self._connection.read_holding_registers(address, size)
+      except connection_manager.CircuitOpenError:
+        raise
+      except ConnectionException:
         if i == self._retries - 1:
-          raise e
-
-        time.sleep(self._retry_wait_time)
-        continue
-
-      decoder = BinaryPayloadDecoder.fromRegisters(
-        result.registers, byteorder=Endian.Big, wordorder=Endian.Big)
-      decoded_value = DATA_TYPE_TO_DECODER_MAP[metric.data_type](decoder)
-      return decoded_value * metric.scaling_factor
+          raise
@@ -0,0 +1,96 @@
+"""Panel accessor unit tests."""
+
+import struct
+import unittest
+from collector import connection_manager, model, panel_accessor
+
+
+class FakeModbusClient:
+  """A Modbus client that serves registers from memory."""
+
+  def __init__(self, registers):
+    """Creates a new fake client.
+
+    Args:
+      registers: A dict from register address to value.
+    """
+    self.registers = registers
+    self.reads = []
+
+  def read_holding_registers(self, address, count, unit):
+    """Reads registers from memory and records the request."""
+    self.reads.append((address, count))
+    registers = [self.registers.get(i, 0)
+                 for i in range(address, address + count)]
+    return type('ReadHoldingRegistersResponse', (object,),
+                {'registers': registers, 'isError': lambda self: False})()
+
+  def connect(self):
+    """Pretends to connect."""
+    return True
+
+  def close(self):
+    """Pretends to close the connection."""
+
+
+def float32_registers(value):
+  """Encodes a float as two big-endian registers."""
+  return list(struct.unpack('>HH', struct.pack('>f', value)))
+
+
+class PanelAccessorTestCase(unittest.TestCase):
+  """A test case for panel accessor operations."""
+
+  def setUp(self):
+    """Creates an accessor backed by a fake Modbus client."""
+    self.metrics = {
+      'W': model.Metric('W', '', 4650, 2, 1, model.MetricDataType.FLOAT32,
+                        'UW/Test/W'),
+      'freq': model.Metric('freq', '', 4660, 2, 1,
+                           model.MetricDataType.FLOAT32, 'UW/Test/freq'),
+      'pf': model.Metric('pf', '', 232, 1, 0.001, model.MetricDataType.UINT16,
+                         'UW/Test/pf')
+    }
+    w = float32_registers(1500.5)
+    freq = float32_registers(60.0)
+    self.client = FakeModbusClient(
+      {4650: w[0], 4651: w[1], 4660: freq[0], 4661: freq[1], 232: 950})
+    self.accessor = panel_accessor.PanelAccessor('localhost', self.metrics, 3,
+                                                 0)
+    self.accessor._connection = connection_manager.ConnectionManager(
+      self.client)
+
+  def test_get_metric(self):
+    """Tests that a single metric is read and scaled."""
+    self.assertAlmostEqual(0.95, self.accessor.get_metric('pf'))
+    self.assertEqual([(232, 1)], self.client.reads)
+
+  def test_get_metrics(self):
+    """Tests that all metrics are read with coalesced requests."""
+    values = self.accessor.get_metrics()
+    self.assertEqual({'W', 'freq', 'pf'}, set(values))
+    self.assertAlmostEqual(1500.5, values['W'])
+    self.assertAlmostEqual(60.0, values['freq'])
+    self.assertAlmostEqual(0.95, values['pf'])
+    self.assertEqual([(232, 1), (4650, 12)], self.client.reads)
+
+  def test_get_metrics_subset(self):
+    """Tests that only the requested metrics are read."""
+    values = self.accessor.get_metrics(['freq'])
+    self.assertEqual(['freq'], list(values))
+    self.assertEqual([(4660, 2)], self.client.reads)
+
+  def test_subset_plans(self):
+    """Tests that only the most recently used subset plans are kept."""
+    accessor = panel_accessor.PanelAccessor('localhost', self.metrics, 3, 0,
+                                            max_subset_plans=2)
+    accessor._connection = connection_manager.ConnectionManager(self.client)
+    for names in (['freq'], ['W'], ['pf'], ['freq', 'W'], ['W', 'freq']):
+      accessor.get_metrics(names)
+
+    info = accessor._subset_plan.cache_info()
+    self.assertEqual((1, 4, 2), (info.hits, info.misses, info.currsize))
+
+
+if __name__ == '__main__':
+  unittest.main()
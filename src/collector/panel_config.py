@@ -0,0 +1,118 @@
+"""Loads connection settings for a set of solar panels.
+
+A deployment that monitors several meters describes them in a JSON file
+containing a list of panels. Each entry requires a host, a topic prefix, and a
+metrics workbook. For example:
+
+[
+  {
+    "host": "10.154.120.13",
+    "topic_prefix": "UW/Mercer/nexus_meter",
+    "metrics_workbook": "collector/maps/nexus-metrics.xlsx"
+  },
+  {
+    "host": "10.154.120.14",
+    "topic_prefix": "UW/Maple/eaton_meter",
+    "metrics_workbook": "collector/maps/eaton-metrics.xlsx",
+    // Optional settings.
+    "port": 502,
+    "metrics_worksheet_name": "Metrics",
+    "timeout": 3,
+    "max_in_flight": 1
+  }
+]
+"""
+
+import dataclasses
+import json
+import jsmin
+from collector import metrics_builder, panel_accessor
+
+DEFAULT_METRICS_WORKSHEET_NAME = 'Metrics'
+DEFAULT_MAX_IN_FLIGHT = 1
+
+
+# Connection settings for a single solar panel.
+#
+# Args:
+#   host: The meter host address.
+#   topic_prefix: The meter topic prefix (e.g. UW/Mercer/nexus_meter).
+#   metrics_workbook: The workbook containing the meter's metrics data.
+#   metrics_worksheet_name: The name of the worksheet containing metrics data.
+#   port: The Modbus TCP port.
+#   timeout: The time in seconds to wait for a response from the meter.
+#   max_in_flight: The largest number of requests that may be outstanding
+#       against the meter at once.
+@dataclasses.dataclass(frozen=True)
+class PanelOptions:
+  host: str
+  topic_prefix: str
+  metrics_workbook: str
+  metrics_worksheet_name: str = DEFAULT_METRICS_WORKSHEET_NAME
+  port: int = panel_accessor.DEFAULT_PORT
+  timeout: float = panel_accessor.DEFAULT_TIMEOUT
+  max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+
+
+def panel_options_from_json(obj):
+  """Creates panel settings from a JSON object.
+
+  Args:
+    obj: The JSON object to be converted.
+
+  Returns:
+    A list of PanelOptions objects.
+
+  Raises:
+    ValueError: When a required parameter is not present.
+  """
+  options = []
+  for item in obj:
+    for key in ('host', 'topic_prefix', 'metrics_workbook'):
+      if key not in item:
+        raise ValueError('A %s is required for every panel.' % key)
+
+    options.append(PanelOptions(
+      item['host'], item['topic_prefix'], item['metrics_workbook'],
+      item.get('metrics_worksheet_name', DEFAULT_METRICS_WORKSHEET_NAME),
+      int(item.get('port', panel_accessor.DEFAULT_PORT)),
+      float(item.get('timeout', panel_accessor.DEFAULT_TIMEOUT)),
+      int(item.get('max_in_flight', DEFAULT_MAX_IN_FLIGHT))))
+
+  return options
+
+
+def load_panel_options(filename):
+  """Reads panel settings from a JSON file.
+
+  Args:
+    filename: The file containing a list of panels.
+
+  Returns:
+    A list of PanelOptions objects.
+  """
+  with open(filename, 'r') as f:
+    # jsmin strips comments from the JSON file.
+    return panel_options_from_json(json.loads(jsmin.jsmin(f.read())))
+
+
+def create_panel_accessor(options, retries, retry_wait_time, max_gap):
+  """Creates an accessor for a single panel.
+
+  Args:
+    options: The panel's settings.
+    retries: The number of times to retry a Modbus RPC.
+    retry_wait_time: The initial delay in seconds between attempts to
+        reconnect to an unreachable panel.
+    max_gap: The largest number of unused registers that may be read in order
+        to coalesce neighbouring metrics into a single RPC.
+
+  Returns:
+    A PanelAccessor object.
+  """
+  metrics = metrics_builder.build_metrics(
+    options.metrics_workbook, options.metrics_worksheet_name,
+    options.topic_prefix)
+  return panel_accessor.PanelAccessor(
+    options.host, metrics, retries, retry_wait_time, max_gap, options.port,
+    options.timeout)
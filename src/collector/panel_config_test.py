@@ -0,0 +1,46 @@
+"""Panel configuration unit tests."""
+
+import unittest
+from collector import panel_config
+
+
+class PanelConfigTestCase(unittest.TestCase):
+  """A test case for panel configuration operations."""
+
+  def test_panel_options_from_json(self):
+    """Tests that defaults are applied to optional settings."""
+    cfg = [{
+      'host': '10.0.0.1',
+      'topic_prefix': 'UW/Mercer/nexus_meter',
+      'metrics_workbook': 'maps/nexus-metrics.xlsx'
+    }, {
+      'host': '10.0.0.2',
+      'topic_prefix': 'UW/Maple/eaton_meter',
+      'metrics_workbook': 'maps/eaton-metrics.xlsx',
+      'port': 5020,
+      'timeout': 0.5,
+      'max_in_flight': 2
+    }]
+
+    expected = [
+      panel_config.PanelOptions('10.0.0.1', 'UW/Mercer/nexus_meter',
+                                'maps/nexus-metrics.xlsx'),
+      panel_config.PanelOptions('10.0.0.2', 'UW/Maple/eaton_meter',
+                                'maps/eaton-metrics.xlsx', 'Metrics', 5020, 0.5,
+                                2)
+    ]
+    self.assertEqual(expected, panel_config.panel_options_from_json(cfg))
+
+  def test_panel_options_from_json_no_host(self):
+    """Tests that an error is raised when there is no host."""
+    cfg = [{
+      'topic_prefix': 'UW/Mercer/nexus_meter',
+      'metrics_workbook': 'maps/nexus-metrics.xlsx'
+    }]
+
+    with self.assertRaises(ValueError):
+      panel_config.panel_options_from_json(cfg)
+
+
+if __name__ == '__main__':
+  unittest.main()
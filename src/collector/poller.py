@@ -0,0 +1,213 @@
+"""Polls many solar panels concurrently from a single process.
+
+Polling is I/O-bound: almost all of the time spent reading a meter is spent
+waiting on the network. The polling engine runs an asyncio event loop that
+issues reads against every meter at once, so a cycle over N meters takes about
+as long as the slowest meter rather than the sum of all of them.
+
+Each meter keeps its own Modbus connection. Since a Modbus TCP connection
+handles one request at a time, a meter's reads are run on a dedicated worker
+thread and serialized over that connection. Every meter has its own timeout
+and a limit on the number of requests that may be outstanding against it, so
+that a slow meter cannot accumulate an unbounded backlog of requests or delay
+the results of its neighbours.
+
+Only the waiting is asynchronous: each read is a blocking call to the panel's
+get_metrics, which is run with run_in_executor on the meter's single-thread
+pool. The unit tests exercise the engine with fake panels rather than a Modbus
+server.
+"""
+
+import asyncio
+import concurrent.futures
+import dataclasses
+import datetime
+import inspect
+import logging
+import math
+import time
+import typing
+
+
+class MeterBusyError(Exception):
+  """Raised when a meter already has its limit of requests outstanding."""
+
+
+# The outcome of reading a single meter.
+#
+# Args:
+#   meter: The name of the meter.
+#   ts: The time at which the read began.
+#   values: A dict from the metric name to its value, or None on failure.
+#   error: The exception raised while reading the meter, or None on success.
+#   duration: The time in seconds taken to read the meter.
+@dataclasses.dataclass(frozen=True)
+class PollResult:
+  meter: str
+  ts: datetime.datetime
+  values: typing.Optional[dict]
+  error: typing.Optional[Exception]
+  duration: float
+
+  @property
+  def ok(self):
+    return self.error is None
+
+
+class MeterPoller:
+  """Reads a single meter on behalf of the polling engine."""
+
+  def __init__(self, name, panel_con, timeout, max_in_flight):
+    """Creates a new meter poller.
+
+    Args:
+      name: The name of the meter (e.g. its topic prefix).
+      panel_con: A handle to the solar panel.
+      timeout: The time in seconds to wait for a complete set of readings.
+      max_in_flight: The largest number of reads that may be outstanding
+          against the meter at once, including reads that have timed out but
+          have not yet returned.
+    """
+    self._name = name
+    self._panel_con = panel_con
+    self._timeout = timeout
+    self._max_in_flight = max_in_flight
+    self._in_flight = 0
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers=1, thread_name_prefix='poller-%s' % name)
+
+  @property
+  def name(self):
+    return self._name
+
+  @property
+  def panel_con(self):
+    return self._panel_con
+
+  @property
+  def in_flight(self):
+    return self._in_flight
+
+  async def poll(self, names=None):
+    """Reads a set of metrics from the meter.
+
+    Args:
+      names: The metric names to read. All known metrics are read by default.
+
+    Returns:
+      A PollResult object. Failures, including timeouts, are reported in the
+      result rather than raised.
+    """
+    ts = datetime.datetime.now()
+    start = time.monotonic()
+    try:
+      values = await self._read(names)
+      error = None
+    except Exception as e:  # pylint: disable=broad-except
+      values = None
+      error = e
+
+    return PollResult(self._name, ts, values, error, time.monotonic() - start)
+
+  async def _read(self, names):
+    """Submits a read to the meter's worker thread and awaits its result.
+
+    Raises:
+      MeterBusyError: When too many reads are already outstanding.
+      asyncio.TimeoutError: When the read does not complete in time.
+    """
+    if self._in_flight >= self._max_in_flight:
+      raise MeterBusyError(
+        '%s has %d requests outstanding.' % (self._name, self._in_flight))
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(self._executor, self._panel_con.get_metrics,
+                                  names)
+
+    # The in-flight count is only decremented once the worker thread finishes,
+    # so that reads which outlive their timeout still count against the limit.
+    self._in_flight += 1
+    future.add_done_callback(self._on_read_done)
+    return await asyncio.wait_for(asyncio.shield(future), self._timeout)
+
+  def _on_read_done(self, future):
+    """Releases an in-flight slot and consumes any unobserved exception."""
+    self._in_flight -= 1
+    if not future.cancelled():
+      future.exception()
+
+  def close(self):
+    """Stops the meter's worker thread and closes its connection."""
+    self._executor.shutdown(wait=False)
+    self._panel_con.close()
+
+
+class PollingEngine:
+  """Polls a set of meters concurrently."""
+
+  def __init__(self, meters):
+    """Creates a new polling engine.
+
+    Args:
+      meters: A list of MeterPoller objects.
+    """
+    self._meters = meters
+    self.skipped = 0
+
+  @property
+  def meters(self):
+    return self._meters
+
+  async def poll_once(self):
+    """Reads every meter concurrently.
+
+    Returns:
+      A list of PollResult objects, in the same order as the meters.
+    """
+    return await asyncio.gather(*[m.poll() for m in self._meters])
+
+  async def run(self, callback, iterations=0, interval=1):
+    """Polls every meter periodically.
+
+    Cycles start at fixed intervals. When a cycle takes longer than the
+    interval, the cycles that were missed are skipped, and the next cycle
+    begins at the next interval boundary, as with collection_scheduler.Ticker.
+
+    Args:
+      callback: A function invoked with the list of results from each cycle.
+          If it returns an awaitable, the awaitable is awaited before the next
+          cycle begins.
+      iterations: The number of cycles to run, or 0 to run until cancelled.
+      interval: The time in seconds between the start of successive cycles.
+    """
+    deadline = time.monotonic()
+    i = 0
+    while True:
+      results = await self.poll_once()
+      for result in results:
+        if not result.ok:
+          logging.warning('Failed to poll %s: %r', result.meter, result.error)
+
+      outcome = callback(results)
+      if inspect.isawaitable(outcome):
+        await outcome
+
+      i += 1
+      if iterations and i >= iterations:
+        break
+
+      deadline += interval
+      now = time.monotonic()
+      if deadline < now:
+        missed = math.ceil((now - deadline) / interval)
+        logging.warning('Skipping %d missed cycle(s) of %g seconds.', missed,
+                        interval)
+        self.skipped += missed
+        deadline += missed * interval
+
+      await asyncio.sleep(deadline - now)
+
+  def close(self):
+    """Closes every meter's connection."""
+    for meter in self._meters:
+      meter.close()
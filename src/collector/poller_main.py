@@ -0,0 +1,252 @@
+"""A program that polls several solar panels from a single process.
+
+Panels are described in a JSON file (see panel_config.py). Every panel is read
+concurrently at a fixed interval. The results are queued and written to the
+database in batches by a background thread, so that database latency does not
+delay polling.
+
+    $ PYTHONPATH=. python collector/poller_main.py \
+          --panels_file=panels.json \
+          --db_host=sqlite.db
+"""
+
+import argparse
+import asyncio
+import logging
+from collector import panel_config, poller, read_planner
+from db import db_accessor, db_model, spool, write_queue
+
+DEFAULT_DB_TYPE = 'sqlite'
+DEFAULT_DB_USER = 'uwsolar'
+DEFAULT_DB_PASSWORD = ''
+DEFAULT_DB_HOST = ':memory:'
+DEFAULT_DB_NAME = 'uwsolar'
+DEFAULT_DB_POOL_SIZE = 3
+DEFAULT_DB_STORAGE_MODE = db_accessor.STORAGE_LEGACY
+DEFAULT_DB_WRITE_QUEUE_SIZE = write_queue.DEFAULT_MAX_SIZE
+DEFAULT_DB_WRITE_BATCH_SIZE = write_queue.DEFAULT_BATCH_SIZE
+DEFAULT_DB_WRITE_MAX_DELAY = write_queue.DEFAULT_MAX_DELAY
+DEFAULT_DB_SPOOL_MAX_BYTES = spool.DEFAULT_MAX_BYTES
+DEFAULT_DB_SPOOL_FSYNC = spool.FSYNC_INTERVAL
+DEFAULT_ITERATIONS = 0
+DEFAULT_INTERVAL = 1
+DEFAULT_PANEL_MODBUS_RETRIES = 3
+DEFAULT_PANEL_MODBUS_RETRY_WAIT_TIME = 1
+DEFAULT_PANEL_MODBUS_MAX_GAP = read_planner.DEFAULT_MAX_GAP
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+    '--log_level', default='WARNING', help='The logging threshold.')
+
+  # Polling arguments.
+  poll_group = parser.add_argument_group('polling', 'Polling arguments.')
+  poll_group.add_argument(
+    '--iterations', type=int, default=DEFAULT_ITERATIONS,
+    help='The number of polling cycles to run, or 0 to run indefinitely.')
+  poll_group.add_argument(
+    '--interval', type=float, default=DEFAULT_INTERVAL,
+    help='The time in seconds between the start of successive cycles.')
+
+  # Database connectivity arguments.
+  db_group = parser.add_argument_group(
+    'database', 'Database connectivity arguments.')
+  db_group.add_argument(
+    '--db_type', choices=['mysql+mysqlconnector', 'sqlite'],
+    default=DEFAULT_DB_TYPE, help='Which database type should be used.')
+  db_group.add_argument(
+    '--db_user', default=DEFAULT_DB_USER, help='The database user.')
+  db_group.add_argument(
+    '--db_password', default=DEFAULT_DB_PASSWORD, help='The database password.')
+  db_group.add_argument(
+    '--db_host', default=DEFAULT_DB_HOST, help='The database host.')
+  db_group.add_argument(
+    '--db_name', default=DEFAULT_DB_NAME, help='The database name.')
+  db_group.add_argument(
+    '--db_pool_size', type=int, default=DEFAULT_DB_POOL_SIZE,
+    help='The database pool size.')
+  db_group.add_argument(
+    '--db_storage_mode', choices=db_accessor.STORAGE_MODES,
+    default=DEFAULT_DB_STORAGE_MODE,
+    help='Whether values are stored in the data table (legacy), the typed_data '
+         'table (typed), both while existing data is copied (dual), or the '
+         'typed_data table with past hours compressed into chunks (chunked).')
+  db_group.add_argument(
+    '--db_sqlite_production', action='store_true',
+    help='Use write-ahead logging and a single writer thread with a SQLite '
+         'database file, so that it may be read and written concurrently.')
+  db_group.add_argument(
+    '--db_write_queue_size', type=int, default=DEFAULT_DB_WRITE_QUEUE_SIZE,
+    help='The number of collected values that may await writing before '
+         'polling blocks.')
+  db_group.add_argument(
+    '--db_write_batch_size', type=int, default=DEFAULT_DB_WRITE_BATCH_SIZE,
+    help='The largest number of values written in a single transaction.')
+  db_group.add_argument(
+    '--db_write_max_delay', type=float, default=DEFAULT_DB_WRITE_MAX_DELAY,
+    help='The time in seconds that a collected value may wait before it is '
+         'written.')
+  db_group.add_argument(
+    '--db_spool_dir',
+    help='A directory in which to spool collected values while the database '
+         'cannot be written to. When absent, such values are discarded.')
+  db_group.add_argument(
+    '--db_spool_max_bytes', type=int, default=DEFAULT_DB_SPOOL_MAX_BYTES,
+    help='The largest size in bytes of the spool. The oldest values are '
+         'discarded to stay within this size.')
+  db_group.add_argument(
+    '--db_spool_fsync', choices=spool.FSYNC_POLICIES,
+    default=DEFAULT_DB_SPOOL_FSYNC,
+    help='When spooled values are flushed to disk: after every write, at most '
+         'once per second, or when the operating system chooses.')
+  db_group.add_argument(
+    '--db_spool_mmap', action='store_true',
+    help='Whether to memory-map spool files while replaying them.')
+
+  # Solar panel connectivity arguments.
+  panel_group = parser.add_argument_group(
+    'panel', 'Solar panel connectivity arguments.')
+  panel_group.add_argument(
+    '--panels_file', required=True,
+    help='A JSON file containing the list of panels to poll.')
+  panel_group.add_argument(
+    '--panel_modbus_retries', type=int, default=DEFAULT_PANEL_MODBUS_RETRIES,
+    help='The number of times to retry Modbus RPCs. This many consecutive '
+         'failures mark a panel as unreachable.')
+  panel_group.add_argument(
+    '--panel_modbus_retry_wait_time', type=float,
+    default=DEFAULT_PANEL_MODBUS_RETRY_WAIT_TIME,
+    help='The initial delay in seconds between attempts to reconnect to an '
+         'unreachable panel.')
+  panel_group.add_argument(
+    '--panel_modbus_max_gap', type=int, default=DEFAULT_PANEL_MODBUS_MAX_GAP,
+    help='The number of unused registers that may be read in order to '
+         'coalesce neighbouring metrics into a single Modbus RPC.')
+
+  return parser.parse_args()
+
+
+def create_engine(args):
+  """Creates a polling engine for every panel in the panels file.
+
+  Args:
+    args: Arguments containing panel connectivity options.
+
+  Returns:
+    A PollingEngine object.
+  """
+  meters = []
+  for options in panel_config.load_panel_options(args.panels_file):
+    panel_con = panel_config.create_panel_accessor(
+      options, args.panel_modbus_retries, args.panel_modbus_retry_wait_time,
+      args.panel_modbus_max_gap)
+    meters.append(poller.MeterPoller(options.topic_prefix, panel_con,
+                                     options.timeout, options.max_in_flight))
+
+  return poller.PollingEngine(meters)
+
+
+def init_topics(db_con, engine):
+  """Adds every panel's topics to the database.
+
+  Args:
+    db_con: A handle to the database.
+    engine: The polling engine.
+
+  Returns:
+    A dict from the topic name to its ID.
+  """
+  return db_con.get_topic_ids(m.topic_name for meter in engine.meters
+                              for m in meter.panel_con.metrics.values())
+
+
+def to_data(engine, topic_ids_by_name, results):
+  """Converts the results of a polling cycle into data to be written.
+
+  Args:
+    engine: The polling engine.
+    topic_ids_by_name: A dict from the topic name to its ID.
+    results: The results of a polling cycle.
+
+  Returns:
+    A list of TopicDatum objects.
+  """
+  data = []
+  for meter, result in zip(engine.meters, results):
+    if not result.ok:
+      continue
+
+    metrics = meter.panel_con.metrics
+    data.extend(db_model.TopicDatum(
+      result.ts, topic_ids_by_name[metrics[name].topic_name], value)
+                for name, value in result.values.items())
+
+  return data
+
+
+async def run(db_con, engine, iterations, interval, writer=None):
+  """Polls every panel and writes the results to the database.
+
+  Args:
+    db_con: A handle to the database.
+    engine: The polling engine.
+    iterations: The number of cycles to run, or 0 to run indefinitely.
+    interval: The time in seconds between the start of successive cycles.
+    writer: An object whose write_data method is used to write the results
+        (e.g. a write_queue.WriteBehindQueue). Defaults to db_con.
+  """
+  writer = writer or db_con
+  loop = asyncio.get_running_loop()
+  topic_ids_by_name = await loop.run_in_executor(None, init_topics, db_con,
+                                                 engine)
+
+  async def write(results):
+    data = to_data(engine, topic_ids_by_name, results)
+    if data:
+      await loop.run_in_executor(None, writer.write_data, data)
+
+  await engine.run(write, iterations, interval)
+
+
+def main():
+  """Parses command line arguments and polls every panel."""
+  args = parse_arguments()
+  logging.basicConfig(level=logging.getLevelName(args.log_level))
+
+  # Initialize database connection.
+  db_opts = db_accessor.DatabaseOptions(
+    args.db_type, args.db_user, args.db_password, args.db_host, args.db_name,
+    args.db_pool_size, args.db_storage_mode,
+    sqlite_production=args.db_sqlite_production)
+  db_con = db_accessor.DatabaseAccessor(db_opts)
+
+  db_spool = replayer = None
+  if args.db_spool_dir:
+    db_spool = spool.Spool(args.db_spool_dir, max_bytes=args.db_spool_max_bytes,
+                           fsync=args.db_spool_fsync,
+                           use_mmap=args.db_spool_mmap)
+    replayer = spool.SpoolReplayer(db_spool, db_con)
+
+  writer = write_queue.WriteBehindQueue(
+    db_con, args.db_write_queue_size, args.db_write_batch_size,
+    args.db_write_max_delay, db_spool)
+
+  engine = create_engine(args)
+  try:
+    asyncio.run(run(db_con, engine, args.iterations, args.interval, writer))
+  finally:
+    engine.close()
+    writer.close()
+    if db_spool:
+      replayer.close()
+      db_spool.close()
+
+
+if __name__ == '__main__':
+  main()
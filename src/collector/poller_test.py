@@ -0,0 +1,119 @@
+"""Polling engine unit tests."""
+
+import asyncio
+import threading
+import time
+import unittest
+from collector import poller
+
+
+class FakePanel:
+  """A stand-in for a solar panel that answers after a fixed delay."""
+
+  def __init__(self, delay=0, error=None):
+    """Creates a new fake panel.
+
+    Args:
+      delay: The time in seconds taken by each read.
+      error: An exception to raise from each read, if any.
+    """
+    self.delay = delay
+    self.error = error
+    self.metrics = {}
+    self.closed = False
+    self.release = threading.Event()
+
+  def get_metrics(self, names=None):
+    """Returns a fixed set of values after the configured delay."""
+    self.release.wait(self.delay)
+    if self.error:
+      raise self.error
+
+    return {'W': 1.0}
+
+  def close(self):
+    """Records that the panel was closed."""
+    self.closed = True
+
+
+class PollerTestCase(unittest.TestCase):
+  """A test case for polling engine operations."""
+
+  def test_poll_once_concurrent(self):
+    """Tests that meters are read concurrently."""
+    meters = [poller.MeterPoller(str(i), FakePanel(0.2), 1, 1)
+              for i in range(0, 5)]
+    engine = poller.PollingEngine(meters)
+
+    start = time.monotonic()
+    results = asyncio.run(engine.poll_once())
+    elapsed = time.monotonic() - start
+    engine.close()
+
+    self.assertEqual(['0', '1', '2', '3', '4'], [r.meter for r in results])
+    self.assertTrue(all(r.ok for r in results))
+    self.assertEqual({'W': 1.0}, results[0].values)
+    self.assertLess(elapsed, 0.6)
+
+  def test_poll_error(self):
+    """Tests that read failures are reported in the result."""
+    error = ConnectionError('unreachable')
+    meter = poller.MeterPoller('a', FakePanel(error=error), 1, 1)
+    result = asyncio.run(meter.poll())
+    meter.close()
+
+    self.assertFalse(result.ok)
+    self.assertIs(error, result.error)
+    self.assertIsNone(result.values)
+
+  def test_poll_timeout_holds_in_flight_slot(self):
+    """Tests that a timed out read counts against the in-flight limit."""
+    panel = FakePanel(delay=10)
+    meter = poller.MeterPoller('a', panel, 0.05, 1)
+
+    async def poll_twice():
+      first = await meter.poll()
+      second = await meter.poll()
+      return first, second
+
+    first, second = asyncio.run(poll_twice())
+    self.assertIsInstance(first.error, asyncio.TimeoutError)
+    self.assertIsInstance(second.error, poller.MeterBusyError)
+    panel.release.set()
+    meter.close()
+    self.assertTrue(panel.closed)
+
+  def test_run(self):
+    """Tests that the engine polls for the requested number of cycles."""
+    engine = poller.PollingEngine([poller.MeterPoller('a', FakePanel(), 1, 1)])
+    cycles = []
+
+    async def callback(results):
+      cycles.append(results)
+
+    asyncio.run(engine.run(callback, iterations=3, interval=0.01))
+    engine.close()
+    self.assertEqual(3, len(cycles))
+    self.assertTrue(all(r[0].ok for r in cycles))
+
+  def test_run_skips_missed_cycles(self):
+    """Tests that cycles missed by a slow cycle are skipped."""
+    engine = poller.PollingEngine(
+      [poller.MeterPoller('a', FakePanel(delay=0.05), 1, 1)])
+    starts = []
+
+    def callback(results):
+      starts.append(results[0].ts)
+
+    with self.assertLogs(level='WARNING'):
+      asyncio.run(engine.run(callback, iterations=3, interval=0.02))
+
+    engine.close()
+    self.assertEqual(3, len(starts))
+    # Each cycle takes at least two and a half intervals, so at least two
+    # cycles are skipped after each of the first two.
+    self.assertGreaterEqual(engine.skipped, 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+"""Plans coalesced Modbus register reads for a set of metrics.
+
+Reading each metric with its own RPC is expensive: most of the cost of a Modbus
+TCP request is the network round trip, not the payload. Meters typically lay
+out related metrics in adjacent registers, so a single read of a contiguous
+block can service many metrics at once.
+
+The planner sorts metrics by address and greedily merges them into blocks. A
+new block is started when a metric would push the block past the Modbus
+protocol limit, or when the gap between the end of the current block and the
+next metric is larger than the configured gap tolerance.
+"""
+
+import dataclasses
+import typing
+
+# The maximum number of holding registers that may be read in a single request,
+# as defined by the Modbus application protocol specification.
+MAX_REGISTERS_PER_READ = 125
+
+# The default number of unused registers that may be read in order to merge two
+# neighbouring metrics into a single block.
+DEFAULT_MAX_GAP = 32
+
+
+# A contiguous range of registers to be read in a single Modbus request.
+#
+# Args:
+#   address: The address of the first register in the block.
+#   size: The number of registers in the block.
+#   metrics: The metrics contained within the block, ordered by address.
+@dataclasses.dataclass(frozen=True)
+class ReadBlock:
+  address: int
+  size: int
+  metrics: typing.Tuple
+
+
+def plan_reads(metrics, max_gap=DEFAULT_MAX_GAP,
+               max_block_size=MAX_REGISTERS_PER_READ):
+  """Groups metrics into contiguous blocks of registers.
+
+  Metrics that share or overlap registers (e.g. two names mapped to the same
+  address) are placed in the same block.
+
+  Args:
+    metrics: An iterable of metrics to be read.
+    max_gap: The largest number of unused registers that may separate two
+        metrics in the same block.
+    max_block_size: The largest number of registers that may be read at once.
+
+  Returns:
+    A list of ReadBlock objects, ordered by address.
+
+  Raises:
+    ValueError: When a single metric is larger than the maximum block size.
+  """
+  blocks = []
+  start = end = None
+  members = []
+  for metric in sorted(metrics, key=lambda m: (m.address, m.size)):
+    if metric.size > max_block_size:
+      raise ValueError('Metric %s spans %d registers, more than the limit of %d.'
+                       % (metric.name, metric.size, max_block_size))
+
+    metric_end = metric.address + metric.size
+    if members and (metric.address - end <= max_gap
+                    and max(end, metric_end) - start <= max_block_size):
+      end = max(end, metric_end)
+      members.append(metric)
+      continue
+
+    if members:
+      blocks.append(ReadBlock(start, end - start, tuple(members)))
+
+    start, end, members = metric.address, metric_end, [metric]
+
+  if members:
+    blocks.append(ReadBlock(start, end - start, tuple(members)))
+
+  return blocks
@@ -0,0 +1,70 @@
+"""Read planner unit tests."""
+
+import unittest
+from collector import model, read_planner
+
+
+def new_metric(name, address, size):
+  """Creates a metric with the given register layout.
+
+  Args:
+    name: The metric name.
+    address: The metric's Modbus address.
+    size: The number of registers used by the metric.
+
+  Returns:
+    A metric object.
+  """
+  return model.Metric(name, name, address, size, 1,
+                      model.MetricDataType.UINT16, 'Topic/' + name)
+
+
+class ReadPlannerTestCase(unittest.TestCase):
+  """A test case for read planning operations."""
+
+  def test_plan_reads_empty(self):
+    """Tests that no blocks are planned when there are no metrics."""
+    self.assertEqual([], read_planner.plan_reads([]))
+
+  def test_plan_reads_contiguous(self):
+    """Tests that adjacent metrics are coalesced into one block."""
+    a = new_metric('a', 100, 2)
+    b = new_metric('b', 102, 2)
+    c = new_metric('c', 104, 1)
+    blocks = read_planner.plan_reads([c, a, b], max_gap=0)
+    self.assertEqual([read_planner.ReadBlock(100, 5, (a, b, c))], blocks)
+
+  def test_plan_reads_gap_tolerance(self):
+    """Tests that metrics separated by more than the gap are split."""
+    a = new_metric('a', 100, 2)
+    b = new_metric('b', 110, 2)
+    self.assertEqual([read_planner.ReadBlock(100, 12, (a, b))],
+                     read_planner.plan_reads([a, b], max_gap=8))
+    self.assertEqual([read_planner.ReadBlock(100, 2, (a,)),
+                      read_planner.ReadBlock(110, 2, (b,))],
+                     read_planner.plan_reads([a, b], max_gap=7))
+
+  def test_plan_reads_shared_address(self):
+    """Tests that metrics mapped to the same registers share a block."""
+    a = new_metric('a', 4690, 2)
+    b = new_metric('b', 4690, 2)
+    self.assertEqual([read_planner.ReadBlock(4690, 2, (a, b))],
+                     read_planner.plan_reads([a, b], max_gap=0))
+
+  def test_plan_reads_max_block_size(self):
+    """Tests that blocks do not exceed the maximum read size."""
+    metrics = [new_metric(str(i), i * 2, 2) for i in range(0, 100)]
+    blocks = read_planner.plan_reads(metrics)
+    self.assertEqual(2, len(blocks))
+    self.assertEqual(124, blocks[0].size)
+    self.assertEqual(76, blocks[1].size)
+    self.assertEqual(metrics, list(blocks[0].metrics + blocks[1].metrics))
+
+  def test_plan_reads_oversized_metric(self):
+    """Tests that an error is raised for metrics that cannot be read."""
+    with self.assertRaises(ValueError):
+      read_planner.plan_reads([new_metric('a', 0, 126)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,188 @@
+"""Decodes metric values from raw Modbus registers.
+
+Decoding is compiled ahead of time. When a panel's metrics are loaded, each
+block of registers in its read plan is turned into a struct format string that
+describes the block's layout: one field per metric, with pad bytes covering any
+unused registers. Decoding a block read is then a single call to
+struct.unpack_from, followed by one pass that applies every scaling factor.
+
+All registers are big-endian, and multi-register values are stored with the
+most significant word first. Values narrower than their registers (e.g. 8-bit
+integers) occupy the most significant bytes of the first register.
+
+The inverse operation, encoding a value into registers, is provided for tools
+that simulate meters.
+"""
+
+import struct
+from collector import model
+
+# The number of bytes per register.
+BYTES_PER_REGISTER = 2
+
+# A mapping from metric data type to struct format character. Strings are
+# handled separately, since their width depends on the metric size.
+DATA_TYPE_TO_STRUCT_FORMAT = {
+  model.MetricDataType.UINT8: 'B',
+  model.MetricDataType.UINT16: 'H',
+  model.MetricDataType.UINT32: 'I',
+  model.MetricDataType.UINT64: 'Q',
+  model.MetricDataType.INT8: 'b',
+  model.MetricDataType.INT16: 'h',
+  model.MetricDataType.INT32: 'i',
+  model.MetricDataType.INT64: 'q',
+  model.MetricDataType.FLOAT32: 'f',
+  model.MetricDataType.FLOAT64: 'd'
+}
+
+# The range of values that may be stored by each integer data type.
+INTEGER_DATA_TYPE_RANGES = {
+  model.MetricDataType.UINT8: (0, 2 ** 8 - 1),
+  model.MetricDataType.UINT16: (0, 2 ** 16 - 1),
+  model.MetricDataType.UINT32: (0, 2 ** 32 - 1),
+  model.MetricDataType.UINT64: (0, 2 ** 64 - 1),
+  model.MetricDataType.INT8: (-2 ** 7, 2 ** 7 - 1),
+  model.MetricDataType.INT16: (-2 ** 15, 2 ** 15 - 1),
+  model.MetricDataType.INT32: (-2 ** 31, 2 ** 31 - 1),
+  model.MetricDataType.INT64: (-2 ** 63, 2 ** 63 - 1)
+}
+
+
+def _field_format(metric):
+  """Builds the struct format for a single metric, including padding.
+
+  Args:
+    metric: The metric metadata.
+
+  Returns:
+    A struct format string that consumes exactly the metric's registers.
+
+  Raises:
+    ValueError: When the metric's data type does not fit in its registers.
+  """
+  width = metric.size * BYTES_PER_REGISTER
+  if metric.data_type == model.MetricDataType.STRING:
+    return '%ds' % width
+
+  if metric.data_type not in DATA_TYPE_TO_STRUCT_FORMAT:
+    raise ValueError('Metric %s has an unsupported data type: %s.'
+                     % (metric.name, metric.data_type))
+
+  fmt = DATA_TYPE_TO_STRUCT_FORMAT[metric.data_type]
+  padding = width - struct.calcsize('>' + fmt)
+  if padding < 0:
+    raise ValueError('Metric %s is too small to hold a %s value.'
+                     % (metric.name, metric.data_type.name))
+
+  return fmt + ('%dx' % padding if padding else '')
+
+
+def encode_value(metric, value):
+  """Encodes a metric value into registers, as a meter would store it.
+
+  This is the inverse of decoding: the value is divided by the metric's
+  scaling factor and packed according to its data type. Integer values are
+  rounded and clamped to the range of the data type.
+
+  Args:
+    metric: The metric metadata.
+    value: The true (scaled) metric value, or text for STRING metrics.
+
+  Returns:
+    A list of register values.
+  """
+  fmt = '>' + _field_format(metric)
+  if metric.data_type == model.MetricDataType.STRING:
+    raw = value.encode('ascii', errors='replace')
+  elif metric.data_type in INTEGER_DATA_TYPE_RANGES:
+    low, high = INTEGER_DATA_TYPE_RANGES[metric.data_type]
+    raw = min(high, max(low, round(value / metric.scaling_factor)))
+  else:
+    raw = value / metric.scaling_factor
+
+  return list(struct.unpack('>%dH' % metric.size, struct.pack(fmt, raw)))
+
+
+def _decode_string(value):
+  """Converts a null-padded byte string into text."""
+  return value.rstrip(b'\x00').decode('ascii', errors='replace')
+
+
+class BlockDecoder:
+  """Decodes every metric in a block of registers with a single unpack."""
+
+  def __init__(self, block):
+    """Compiles a decoder for a block of registers.
+
+    Metrics that occupy identical registers with the same data type share a
+    single field. Metrics that partially overlap one another cannot be
+    expressed in one format string, and are decoded in additional passes.
+
+    Args:
+      block: A read_planner.ReadBlock describing the registers to decode.
+    """
+    self._registers_struct = struct.Struct('>%dH' % block.size)
+
+    # Group metrics that decode from the same field.
+    fields = {}
+    for metric in block.metrics:
+      key = (metric.address, metric.size, metric.data_type)
+      fields.setdefault(key, []).append(metric)
+
+    # Assign fields to passes so that no two fields in a pass overlap.
+    passes = []
+    for key in sorted(fields):
+      address, size, _ = key
+      for p in passes:
+        if p[-1][0] + p[-1][1] <= address:
+          p.append(key)
+          break
+      else:
+        passes.append([key])
+
+    self._passes = []
+    for p in passes:
+      fmt = ['>']
+      cursor = block.address
+      names = []
+      scales = []
+      is_string = []
+      for key in p:
+        address, size, data_type = key
+        if address > cursor:
+          fmt.append('%dx' % ((address - cursor) * BYTES_PER_REGISTER))
+
+        fmt.append(_field_format(fields[key][0]))
+        cursor = address + size
+        names.append(tuple(m.name for m in fields[key]))
+        scales.append(tuple(m.scaling_factor for m in fields[key]))
+        is_string.append(data_type == model.MetricDataType.STRING)
+
+      self._passes.append((struct.Struct(''.join(fmt)), tuple(names),
+                           tuple(scales), tuple(is_string)))
+
+  def decode(self, registers):
+    """Decodes and scales all metrics in a block.
+
+    Args:
+      registers: The register values returned from reading the block.
+
+    Returns:
+      A dict from the metric name to its scaled value. String values are
+      returned as text and are not scaled.
+    """
+    payload = self._registers_struct.pack(*registers)
+    result = {}
+    for fields_struct, names, scales, is_string in self._passes:
+      values = fields_struct.unpack_from(payload)
+      for value, field_names, field_scales, string in zip(
+          values, names, scales, is_string):
+        if string:
+          value = _decode_string(value)
+          for name in field_names:
+            result[name] = value
+        else:
+          for name, scale in zip(field_names, field_scales):
+            result[name] = value * scale
+
+    return result
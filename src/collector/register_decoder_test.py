@@ -0,0 +1,89 @@
+"""Register decoder unit tests."""
+
+import struct
+import unittest
+from pymodbus.constants import Endian
+from pymodbus.payload import BinaryPayloadDecoder
+from collector import model, read_planner, register_decoder
+
+
+def new_metric(name, address, size, data_type, scaling_factor=1):
+  """Creates a metric with the given register layout and type."""
+  return model.Metric(name, name, address, size, scaling_factor, data_type,
+                      'Topic/' + name)
+
+
+def to_registers(payload):
+  """Splits a big-endian byte string into 16-bit registers."""
+  return list(struct.unpack('>%dH' % (len(payload) // 2), payload))
+
+
+class RegisterDecoderTestCase(unittest.TestCase):
+  """A test case for register decoding operations."""
+
+  def test_decode_matches_pymodbus(self):
+    """Tests that every numeric type decodes as pymodbus would."""
+    cases = [
+      (model.MetricDataType.UINT8, 1, BinaryPayloadDecoder.decode_8bit_uint),
+      (model.MetricDataType.INT8, 1, BinaryPayloadDecoder.decode_8bit_int),
+      (model.MetricDataType.UINT16, 1, BinaryPayloadDecoder.decode_16bit_uint),
+      (model.MetricDataType.INT16, 1, BinaryPayloadDecoder.decode_16bit_int),
+      (model.MetricDataType.UINT32, 2, BinaryPayloadDecoder.decode_32bit_uint),
+      (model.MetricDataType.INT32, 2, BinaryPayloadDecoder.decode_32bit_int),
+      (model.MetricDataType.UINT64, 4, BinaryPayloadDecoder.decode_64bit_uint),
+      (model.MetricDataType.INT64, 4, BinaryPayloadDecoder.decode_64bit_int),
+      (model.MetricDataType.FLOAT32, 2,
+       BinaryPayloadDecoder.decode_32bit_float),
+      (model.MetricDataType.FLOAT64, 4,
+       BinaryPayloadDecoder.decode_64bit_float)
+    ]
+
+    registers = [0xfe81, 0x4a3c, 0x9b02, 0x7d11]
+    for data_type, size, decode in cases:
+      metric = new_metric('m', 10, size, data_type)
+      decoder = register_decoder.BlockDecoder(
+        read_planner.ReadBlock(10, size, (metric,)))
+      expected = decode(BinaryPayloadDecoder.fromRegisters(
+        registers[:size], byteorder=Endian.Big, wordorder=Endian.Big))
+      self.assertEqual(expected, decoder.decode(registers[:size])['m'],
+                       data_type)
+
+  def test_decode_block(self):
+    """Tests that a block with gaps and shared fields is decoded and scaled."""
+    a = new_metric('a', 100, 2, model.MetricDataType.INT32, 0.5)
+    b = new_metric('b', 104, 1, model.MetricDataType.UINT16, 0.001)
+    c = new_metric('c', 104, 1, model.MetricDataType.UINT16, 0.01)
+    block = read_planner.ReadBlock(100, 5, (a, b, c))
+    registers = to_registers(struct.pack('>i4xH', -300, 950))
+
+    values = register_decoder.BlockDecoder(block).decode(registers)
+    self.assertEqual({'a', 'b', 'c'}, set(values))
+    self.assertEqual(-150, values['a'])
+    self.assertAlmostEqual(0.95, values['b'])
+    self.assertAlmostEqual(9.5, values['c'])
+
+  def test_decode_overlapping(self):
+    """Tests that partially overlapping metrics are both decoded."""
+    a = new_metric('a', 100, 2, model.MetricDataType.UINT32)
+    b = new_metric('b', 101, 1, model.MetricDataType.UINT16)
+    block = read_planner.ReadBlock(100, 2, (a, b))
+    values = register_decoder.BlockDecoder(block).decode([1, 2])
+    self.assertEqual({'a': 65538, 'b': 2}, values)
+
+  def test_decode_string(self):
+    """Tests that strings are decoded and stripped of padding."""
+    metric = new_metric('s', 0, 4, model.MetricDataType.STRING, 1000)
+    block = read_planner.ReadBlock(0, 4, (metric,))
+    registers = to_registers(b'PXM4K\x00\x00\x00')
+    self.assertEqual({'s': 'PXM4K'},
+                     register_decoder.BlockDecoder(block).decode(registers))
+
+  def test_metric_too_small(self):
+    """Tests that an error is raised when a type does not fit its registers."""
+    metric = new_metric('m', 0, 1, model.MetricDataType.FLOAT32)
+    with self.assertRaises(ValueError):
+      register_decoder.BlockDecoder(read_planner.ReadBlock(0, 1, (metric,)))
+
+
+if __name__ == '__main__':
+  unittest.main()
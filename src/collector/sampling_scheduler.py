@@ -0,0 +1,100 @@
+"""Decides which of a panel's metrics to sample during each collection tick.
+
+Metrics change at very different rates. Power and current follow the sun and
+the building's load, while phase angles and power factors are nearly constant.
+Each metric may therefore be given its own sampling interval in the metrics
+workbook. During every collection tick the scheduler reports which metrics are
+due, so that they can be read together in a single set of coalesced RPCs.
+
+A metric with a variance threshold is watched for sudden activity. When the
+variance of its recent samples exceeds the threshold, it is promoted to being
+sampled on every tick. It returns to its configured interval once its variance
+falls back below the threshold.
+"""
+
+import collections
+import logging
+import statistics
+
+# The default number of recent samples used to estimate a metric's variance.
+DEFAULT_WINDOW = 10
+
+
+class _MetricState:
+  """The sampling state of a single metric."""
+
+  def __init__(self, metric, window):
+    self.interval = metric.sampling_interval or 0
+    self.configured_interval = self.interval
+    self.threshold = metric.variance_threshold
+    self.next_due = None
+    self.samples = collections.deque(maxlen=window)
+
+
+class SamplingScheduler:
+  """Tracks when each of a panel's metrics is next due to be sampled."""
+
+  def __init__(self, metrics, window=DEFAULT_WINDOW):
+    """Creates a new scheduler.
+
+    Args:
+      metrics: A dict from the metric name to its metadata.
+      window: The number of recent samples used to estimate each metric's
+          variance.
+    """
+    self._states = {name: _MetricState(m, window)
+                    for name, m in metrics.items()}
+
+  def interval(self, name):
+    """Returns the current sampling interval of a metric, in seconds."""
+    return self._states[name].interval
+
+  def due(self, now, tolerance=0):
+    """Finds the metrics that should be sampled.
+
+    Args:
+      now: The current time, as returned by time.monotonic().
+      tolerance: How early in seconds a metric may be sampled. Callers that
+          tick at a fixed rate should pass half of their tick interval, so that
+          metrics are sampled on the tick closest to when they are due.
+
+    Returns:
+      A list of metric names.
+    """
+    return [name for name, state in self._states.items()
+            if state.next_due is None or state.next_due <= now + tolerance]
+
+  def observe(self, values, now):
+    """Records newly sampled values and schedules the next samples.
+
+    Args:
+      values: A dict from the metric name to its sampled value.
+      now: The time at which the values were sampled, as returned by
+          time.monotonic().
+    """
+    for name, value in values.items():
+      state = self._states.get(name)
+      if state is None:
+        continue
+
+      if state.threshold is not None and isinstance(value, (int, float)):
+        state.samples.append(value)
+        self._adapt(name, state)
+
+      state.next_due = now + state.interval
+
+  @staticmethod
+  def _adapt(name, state):
+    """Promotes or demotes a metric based on the variance of its samples."""
+    if len(state.samples) < 2 or not state.configured_interval:
+      return
+
+    variance = statistics.pvariance(state.samples)
+    if variance > state.threshold and state.interval:
+      logging.info('Sampling %s on every tick (variance %g > %g).', name,
+                   variance, state.threshold)
+      state.interval = 0
+    elif variance <= state.threshold and not state.interval:
+      logging.info('Sampling %s every %g seconds (variance %g <= %g).', name,
+                   state.configured_interval, variance, state.threshold)
+      state.interval = state.configured_interval
@@ -0,0 +1,60 @@
+"""Sampling scheduler unit tests."""
+
+import unittest
+from collector import model, sampling_scheduler
+
+
+def new_metric(name, sampling_interval=None, variance_threshold=None):
+  """Creates a metric with the given sampling options."""
+  return model.Metric(name, name, 0, 1, 1, model.MetricDataType.UINT16,
+                      'Topic/' + name, sampling_interval, variance_threshold)
+
+
+class SamplingSchedulerTestCase(unittest.TestCase):
+  """A test case for sampling scheduler operations."""
+
+  def setUp(self):
+    """Creates a scheduler with fast, slow and adaptive metrics."""
+    self.scheduler = sampling_scheduler.SamplingScheduler({
+      'W': new_metric('W'),
+      'Angle_V_AN': new_metric('Angle_V_AN', 10),
+      'pf': new_metric('pf', 10, 0.01)
+    }, window=3)
+
+  def sample(self, now, values):
+    """Samples the metrics that are due at a one second tick."""
+    due = self.scheduler.due(now, 0.5)
+    self.scheduler.observe({n: values[n] for n in due}, now)
+    return sorted(due)
+
+  def test_due(self):
+    """Tests that metrics are sampled according to their intervals."""
+    values = {'W': 1, 'Angle_V_AN': 120, 'pf': 0.95}
+    self.assertEqual(['Angle_V_AN', 'W', 'pf'], self.sample(0, values))
+    for now in range(1, 10):
+      self.assertEqual(['W'], self.sample(now, values))
+
+    # The slow metrics are due on the tenth tick, even if it arrives early.
+    self.assertEqual(['Angle_V_AN', 'W', 'pf'], self.sample(9.6, values))
+
+  def test_promotion_and_demotion(self):
+    """Tests that fast-changing metrics are sampled on every tick."""
+    now = 0
+    for value in (0.95, 0.5, 0.95):
+      self.sample(now, {'W': 1, 'Angle_V_AN': 120, 'pf': value})
+      now += self.scheduler.interval('pf') or 1
+
+    self.assertEqual(0, self.scheduler.interval('pf'))
+    self.assertIn('pf', self.sample(now, {'W': 1, 'Angle_V_AN': 120,
+                                          'pf': 0.95}))
+
+    for _ in range(0, 3):
+      now += 1
+      self.sample(now, {'W': 1, 'Angle_V_AN': 120, 'pf': 0.95})
+
+    self.assertEqual(10, self.scheduler.interval('pf'))
+    self.assertEqual(10, self.scheduler.interval('Angle_V_AN'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,10 +14,39 @@ queries a MySQL instance:
           -e UWSOLAR_PANEL_HOST=10.0.0.1 \
           -e UWSOLAR_PANEL_TOPIC_PREFIX=UW/Smithsonian/nexus_meter \
           gunicorn_main
+
+To serve several panels, list them in a JSON file (see panel_config.py) and set
+UWSOLAR_PANELS_FILE instead of the UWSOLAR_PANEL_HOST,
+UWSOLAR_PANEL_TOPIC_PREFIX and UWSOLAR_PANEL_METRICS_WORKBOOK variables.
+
+Set UWSOLAR_COLLECT_INTERVAL (e.g. to 1) to have the server collect data on its
+own instead of relying on a scheduled "POST /collect". Only one server process
+should do so, so the WSGI container must run a single worker process.
+
+Collected data is written to the database in batches by a background thread.
+The batches may be tuned with UWSOLAR_DB_WRITE_QUEUE_SIZE,
+UWSOLAR_DB_WRITE_BATCH_SIZE and UWSOLAR_DB_WRITE_MAX_DELAY. Queued data is
+written when the worker process exits.
+
+Set UWSOLAR_DB_SPOOL_DIR to keep data that cannot be written to the database
+(e.g. during a maintenance window) in a local spool, from which it is written
+once the database is available again. The spool is tuned with
+UWSOLAR_DB_SPOOL_MAX_BYTES, UWSOLAR_DB_SPOOL_FSYNC and UWSOLAR_DB_SPOOL_MMAP.
+
+UWSOLAR_DB_STORAGE_MODE selects whether values are stored in the data table
+("legacy", the default), the typed_data table ("typed"), both ("dual"), or the
+typed_data table with past hours compressed into chunks ("chunked").
+
+Set UWSOLAR_DB_ARCHIVE_DIR to read the values archived by db/archive_data.py.
+
+With a SQLite database file, set UWSOLAR_DB_SQLITE_PRODUCTION (e.g. to 1) to use
+write-ahead logging and a single writer thread (see db/sqlite_profile.py), so
+that several workers may read and write the database concurrently.
 """
+import atexit
 import os
-from collector import api_server, metrics_builder, panel_accessor
-from db import db_accessor
+from collector import api_server, metric_cache, panel_config, read_planner
+from db import db_accessor, spool, write_queue
 
 
 def create_app():
@@ -33,31 +62,76 @@ def create_app():
   db_host = os.environ.get('UWSOLAR_DB_HOST', 'sqlite.db')
   db_name = os.environ.get('UWSOLAR_DB_NAME', '')
   db_pool_size = os.environ.get('UWSOLAR_DB_POOL_SIZE', 0)
+  db_storage_mode = os.environ.get('UWSOLAR_DB_STORAGE_MODE',
+                                   db_accessor.STORAGE_LEGACY)
+  db_archive_dir = os.environ.get('UWSOLAR_DB_ARCHIVE_DIR')
+  db_sqlite_production = bool(os.environ.get('UWSOLAR_DB_SQLITE_PRODUCTION'))
+  db_write_queue_size = int(os.environ.get(
+    'UWSOLAR_DB_WRITE_QUEUE_SIZE', write_queue.DEFAULT_MAX_SIZE))
+  db_write_batch_size = int(os.environ.get(
+    'UWSOLAR_DB_WRITE_BATCH_SIZE', write_queue.DEFAULT_BATCH_SIZE))
+  db_write_max_delay = float(os.environ.get(
+    'UWSOLAR_DB_WRITE_MAX_DELAY', write_queue.DEFAULT_MAX_DELAY))
+  db_spool_dir = os.environ.get('UWSOLAR_DB_SPOOL_DIR')
+  db_spool_max_bytes = int(os.environ.get(
+    'UWSOLAR_DB_SPOOL_MAX_BYTES', spool.DEFAULT_MAX_BYTES))
+  db_spool_fsync = os.environ.get('UWSOLAR_DB_SPOOL_FSYNC',
+                                  spool.FSYNC_INTERVAL)
+  db_spool_mmap = bool(os.environ.get('UWSOLAR_DB_SPOOL_MMAP'))
 
   # Solar panel connectivity variables.
+  panels_file = os.environ.get('UWSOLAR_PANELS_FILE')
   panel_metrics_workbook = os.environ.get('UWSOLAR_PANEL_METRICS_WORKBOOK')
   panel_metrics_worksheet_name = os.environ.get(
     'UWSOLAR_PANEL_METRICS_WORKSHEET_NAME', 'Metrics')
   panel_topic_prefix = os.environ.get('UWSOLAR_PANEL_TOPIC_PREFIX')
   panel_host = os.environ.get('UWSOLAR_PANEL_HOST')
-  panel_modbus_retries = os.environ.get('UWSOLAR_PANEL_MODBUS_RETRIES', 3)
-  panel_modbus_retry_wait_time = os.environ.get(
-    'UWSOLAR_PANEL_MODBUS_RETRY_WAIT_TIME', 1)
+  panel_modbus_retries = int(os.environ.get('UWSOLAR_PANEL_MODBUS_RETRIES', 3))
+  panel_modbus_retry_wait_time = float(os.environ.get(
+    'UWSOLAR_PANEL_MODBUS_RETRY_WAIT_TIME', 1))
+  panel_modbus_max_gap = int(os.environ.get(
+    'UWSOLAR_PANEL_MODBUS_MAX_GAP', read_planner.DEFAULT_MAX_GAP))
+  collect_max_workers = int(os.environ.get(
+    'UWSOLAR_COLLECT_MAX_WORKERS', api_server.DEFAULT_MAX_WORKERS))
+  metric_max_staleness = float(os.environ.get(
+    'UWSOLAR_METRIC_MAX_STALENESS', metric_cache.DEFAULT_MAX_STALENESS))
+  collect_interval = float(os.environ.get('UWSOLAR_COLLECT_INTERVAL', 0))
 
   # Initialize database connection.
   db_opts = db_accessor.DatabaseOptions(db_type, db_user, db_password, db_host,
-                                        db_name, db_pool_size)
+                                        db_name, db_pool_size, db_storage_mode,
+                                        db_archive_dir, db_sqlite_production)
   db_con = db_accessor.DatabaseAccessor(db_opts)
+  db_spool = None
+  if db_spool_dir:
+    db_spool = spool.Spool(db_spool_dir, max_bytes=db_spool_max_bytes,
+                           fsync=db_spool_fsync, use_mmap=db_spool_mmap)
+    replayer = spool.SpoolReplayer(db_spool, db_con)
+    atexit.register(db_spool.close)
+    atexit.register(replayer.close)
+
+  writer = write_queue.WriteBehindQueue(
+    db_con, db_write_queue_size, db_write_batch_size, db_write_max_delay,
+    db_spool)
+
+  # Initialize solar panel connections.
+  if panels_file:
+    panel_options = panel_config.load_panel_options(panels_file)
+  else:
+    panel_options = [panel_config.PanelOptions(
+      panel_host, panel_topic_prefix, panel_metrics_workbook,
+      panel_metrics_worksheet_name)]
 
-  # Initialize solar panel connection.
-  panel_metrics = metrics_builder.build_metrics(
-    panel_metrics_workbook, panel_metrics_worksheet_name, panel_topic_prefix)
-  panel_con = panel_accessor.PanelAccessor(
-    panel_host, panel_metrics, panel_modbus_retries,
-    panel_modbus_retry_wait_time)
+  panels = {o.topic_prefix: panel_config.create_panel_accessor(
+    o, panel_modbus_retries, panel_modbus_retry_wait_time,
+    panel_modbus_max_gap) for o in panel_options}
 
   # Create application instance.
-  return api_server.ApiServer(db_con, panel_con).app()
+  server = api_server.ApiServer(db_con, panels, collect_max_workers,
+                                metric_max_staleness, collect_interval, writer)
+  atexit.register(writer.close)
+  atexit.register(server.close)
+  return server.app()
 
 
 application = create_app()
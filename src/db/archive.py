@@ -0,0 +1,216 @@
+"""Stores cold data in memory-mapped columnar files.
+
+Values that are rarely read are moved from the database into an archive
+directory, with one file per topic and month (e.g. 12/201801.col). Each file
+contains:
+
+  header | ts (int64[count]) | value (float64[count]) | index (int64[...])
+
+where the header is the magic string UWARCH01, the topic ID (int32), the index
+stride (uint32) and the number of values (uint64), ts is the number of
+microseconds since the epoch in increasing order, and the index holds every
+index stride'th timestamp. All numbers are little-endian.
+
+Files are memory-mapped and their columns are read in place: a range of time is
+found by a binary search of the small sparse index, and then of one stride of
+the timestamp column, without copying either column.
+"""
+
+import array
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import sys
+from db import chunks, partitions
+
+# The magic string that begins every archive file.
+FILE_HEADER = b'UWARCH01'
+
+FILE_SUFFIX = '.col'
+
+# The default number of values between the timestamps of the sparse index.
+DEFAULT_INDEX_STRIDE = 1024
+
+_HEADER = struct.Struct('<8siIQ')
+
+
+def _check_byte_order():
+  """Raises a ValueError if columns cannot be read in place on this host."""
+  if sys.byteorder != 'little':
+    raise ValueError('Archives can only be used on little-endian hosts.')
+
+
+class ArchiveFile:
+  """A memory-mapped archive file containing a topic's values in a month.
+
+  The timestamps and values attributes are memoryviews of the file's columns.
+  """
+
+  def __init__(self, path):
+    """Opens an archive file.
+
+    Args:
+      path: The path of the file.
+    """
+    _check_byte_order()
+    with open(path, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, self.topic_id, self._stride, self.count = _HEADER.unpack_from(
+      self._mmap)
+    if magic != FILE_HEADER:
+      self._mmap.close()
+      raise ValueError('%s is not an archive file.' % path)
+
+    view = memoryview(self._mmap)
+    values_start = _HEADER.size + 8 * self.count
+    index_start = values_start + 8 * self.count
+    self._views = [view]
+    self.timestamps = self._cast(view[_HEADER.size:values_start], 'q')
+    self.values = self._cast(view[values_start:index_start], 'd')
+    self._index = self._cast(view[index_start:], 'q')
+
+  def _cast(self, view, fmt):
+    """Casts a memoryview of the file, so that it is released on close."""
+    self._views.append(view)
+    cast = view.cast(fmt)
+    self._views.append(cast)
+    return cast
+
+  def find(self, start, end):
+    """Finds the values within a range of timestamps.
+
+    Args:
+      start: The start timestamp.
+      end: The end timestamp (inclusive).
+
+    Returns:
+      A (lo, hi) pair such that the values from lo up to but excluding hi are
+      within the range.
+    """
+    return (self._bisect(bisect.bisect_left, start),
+            self._bisect(bisect.bisect_right, end))
+
+  def _bisect(self, search, timestamp):
+    """Searches the sparse index, and then one stride of the timestamps."""
+    i = search(self._index, timestamp)
+    return search(self.timestamps, timestamp, max(0, i - 1) * self._stride,
+                  min(self.count, i * self._stride))
+
+  def close(self):
+    """Releases the columns and unmaps the file."""
+    for view in reversed(self._views):
+      view.release()
+
+    self._mmap.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+def write_file(path, topic_id, points, index_stride=DEFAULT_INDEX_STRIDE):
+  """Writes an archive file, replacing any existing file atomically.
+
+  Args:
+    path: The path of the file.
+    topic_id: The topic ID.
+    points: A list of (timestamp, value) pairs, ordered by timestamp.
+    index_stride: The number of values between the timestamps of the index.
+  """
+  _check_byte_order()
+  timestamps = array.array('q', (p[0] for p in points))
+  values = array.array('d', (p[1] for p in points))
+  index = timestamps[::index_stride]
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  temp_path = path + '.tmp'
+  with open(temp_path, 'wb') as f:
+    f.write(_HEADER.pack(FILE_HEADER, topic_id, index_stride, len(points)))
+    f.write(timestamps.tobytes())
+    f.write(values.tobytes())
+    f.write(index.tobytes())
+    f.flush()
+    os.fsync(f.fileno())
+
+  os.replace(temp_path, path)
+
+
+class Archive:
+  """A directory of archive files."""
+
+  def __init__(self, directory, index_stride=DEFAULT_INDEX_STRIDE):
+    """Opens an archive.
+
+    Args:
+      directory: The directory containing the archive files.
+      index_stride: The number of values between the timestamps of the index
+          of new files.
+    """
+    self._directory = directory
+    self._index_stride = index_stride
+
+  def path(self, topic_id, month):
+    """Finds the path of the file for a topic and month."""
+    return os.path.join(self._directory, str(topic_id),
+                        '%04d%02d%s' % (month.year, month.month, FILE_SUFFIX))
+
+  def write(self, topic_id, month, points):
+    """Adds values to the file for a topic and month.
+
+    Args:
+      topic_id: The topic ID.
+      month: The start of the month.
+      points: A list of (timestamp, value) pairs within the month. They replace
+          archived values with the same timestamps.
+    """
+    path = self.path(topic_id, month)
+    merged = {}
+    if os.path.exists(path):
+      with ArchiveFile(path) as f:
+        merged.update(zip(f.timestamps.tolist(), f.values.tolist()))
+
+    merged.update(points)
+    write_file(path, topic_id, sorted(merged.items()), self._index_stride)
+
+  def iter_data(self, topic_ids, start_dt, end_dt):
+    """Streams the archived values for the given topics and date range.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+
+    Yields:
+      (ts, topic_id, value) tuples, ordered by timestamp and topic.
+    """
+    start = chunks.to_timestamp(start_dt)
+    end = chunks.to_timestamp(end_dt)
+    month = partitions.month_floor(start_dt)
+    while month <= end_dt:
+      files = [ArchiveFile(self.path(topic_id, month))
+               for topic_id in sorted(set(topic_ids))
+               if os.path.exists(self.path(topic_id, month))]
+      try:
+        for timestamp, topic_id, value in heapq.merge(
+            *[_iter_file(f, start, end) for f in files]):
+          yield chunks.from_timestamp(timestamp), topic_id, value
+      finally:
+        for f in files:
+          f.close()
+
+      month = partitions.add_months(month, 1)
+
+
+def _iter_file(f, start, end):
+  """Yields the (timestamp, topic_id, value) tuples of a file within a range."""
+  lo, hi = f.find(start, end)
+  topic_id = f.topic_id
+  timestamps = f.timestamps
+  values = f.values
+  for i in range(lo, hi):
+    yield timestamps[i], topic_id, values[i]
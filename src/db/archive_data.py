@@ -0,0 +1,186 @@
+"""A program that moves the values of past months into an archive directory.
+
+Old values are rarely read, but their rows and indexes make up most of the
+database. This program writes the values of each topic in each month that
+ended before --keep_months ago into a file of the archive directory (see
+db/archive.py), and then deletes them from the database. The collector and
+web server read the archived values when they are run with the same
+--db_archive_dir.
+
+    $ PYTHONPATH=. python db/archive_data.py \
+          --db_type=mysql+mysqlconnector --db_host=localhost \
+          --db_storage_mode=typed --archive_dir=/var/lib/uwsolar/archive
+
+Each topic's file is written and synced before its rows are deleted, so the
+program may be interrupted and run again. Values written later for an archived
+month stay in the database until the month is archived again. Like rows, the
+archived values conflict with new values that have the same topic and
+timestamp, and are replaced by updates.
+
+Topic watermarks and rollups are left unchanged, since archived values can
+still be read. They cannot be rebuilt from the database afterwards.
+"""
+
+import argparse
+import datetime
+import logging
+import time
+import sqlalchemy
+from db import archive, chunks, db_accessor, db_model, partitions
+
+DEFAULT_DB_TYPE = 'sqlite'
+DEFAULT_DB_USER = 'uwsolar'
+DEFAULT_DB_PASSWORD = ''
+DEFAULT_DB_HOST = ':memory:'
+DEFAULT_DB_NAME = 'uwsolar'
+DEFAULT_DB_STORAGE_MODE = db_accessor.STORAGE_LEGACY
+DEFAULT_KEEP_MONTHS = 3
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--log_level', default='INFO',
+                      help='The logging threshold.')
+
+  # Database connectivity arguments.
+  db_group = parser.add_argument_group(
+    'database', 'Database connectivity arguments.')
+  db_group.add_argument(
+    '--db_type', choices=['mysql+mysqlconnector', 'sqlite'],
+    default=DEFAULT_DB_TYPE, help='Which database type should be used.')
+  db_group.add_argument(
+    '--db_user', default=DEFAULT_DB_USER, help='The database user.')
+  db_group.add_argument(
+    '--db_password', default=DEFAULT_DB_PASSWORD, help='The database password.')
+  db_group.add_argument(
+    '--db_host', default=DEFAULT_DB_HOST, help='The database host.')
+  db_group.add_argument(
+    '--db_name', default=DEFAULT_DB_NAME, help='The database name.')
+  db_group.add_argument(
+    '--db_storage_mode', choices=db_accessor.STORAGE_MODES,
+    default=DEFAULT_DB_STORAGE_MODE,
+    help='Which tables the collector stores values in.')
+
+  # Archive arguments.
+  archive_group = parser.add_argument_group('archive', 'Archive arguments.')
+  archive_group.add_argument(
+    '--archive_dir', required=True,
+    help='The directory in which archive files are written.')
+  archive_group.add_argument(
+    '--keep_months', type=int, default=DEFAULT_KEEP_MONTHS,
+    help='The number of months of values to keep in the database, including '
+         'the current month.')
+
+  return parser.parse_args()
+
+
+def data_tables(storage_mode):
+  """Finds the tables that hold values in a storage mode.
+
+  Returns:
+    A list of tables with topic_id and ts columns.
+  """
+  if storage_mode == db_accessor.STORAGE_LEGACY:
+    return [db_model.TopicDatum.__table__]
+
+  if storage_mode == db_accessor.STORAGE_DUAL:
+    return [db_model.TopicDatum.__table__, db_model.TypedDatum.__table__]
+
+  return [db_model.TypedDatum.__table__]
+
+
+def archive_month(db_con, arc, month):
+  """Moves the values of a month from the database into the archive.
+
+  Args:
+    db_con: A DatabaseAccessor without an archive directory.
+    arc: The Archive into which values are written.
+    month: The start of the month.
+
+  Returns:
+    The number of values archived.
+
+  Raises:
+    ValueError: A value is not a number. The topic's values are left in the
+        database.
+  """
+  end = partitions.add_months(month, 1)
+  last = end - datetime.timedelta(microseconds=1)
+  topic_ids = sorted(w.topic_id for w in db_con.get_topic_watermarks()
+                     if w.first_ts < end and w.last_ts >= month)
+  count = 0
+  for topic_id in topic_ids:
+    points = [(chunks.to_timestamp(ts), float(value))
+              for ts, _, value in db_con.iter_data([topic_id], month, last,
+                                                   cached=False)]
+    if not points:
+      continue
+
+    arc.write(topic_id, month, points)
+    with db_con.engine.begin() as con:
+      for table in data_tables(db_con.storage_mode):
+        con.execute(table.delete().where(sqlalchemy.and_(
+          table.c.topic_id == topic_id, table.c.ts >= month, table.c.ts < end)))
+
+      if db_con.storage_mode == db_accessor.STORAGE_CHUNKED:
+        table = db_model.DataChunk.__table__
+        con.execute(table.delete().where(sqlalchemy.and_(
+          table.c.topic_id == topic_id, table.c.start_ts >= month,
+          table.c.start_ts < end)))
+
+    count += len(points)
+
+  return count
+
+
+def archive_before(db_con, arc, before):
+  """Moves the values of every month that ended before a time.
+
+  Args:
+    db_con: A DatabaseAccessor without an archive directory.
+    arc: The Archive into which values are written.
+    before: The time before which whole months should be archived.
+
+  Returns:
+    The number of values archived.
+  """
+  earliest = db_con.get_earliest_data_timestamp()
+  if earliest is None:
+    return 0
+
+  month = partitions.month_floor(earliest)
+  end = partitions.month_floor(before)
+  count = 0
+  while month < end:
+    begin = time.monotonic()
+    archived = archive_month(db_con, arc, month)
+    logging.info('Archived %d values from %s in %.1f seconds.', archived,
+                 month.strftime('%Y-%m'), time.monotonic() - begin)
+    count += archived
+    month = partitions.add_months(month, 1)
+
+  return count
+
+
+def main():
+  """Parses command line arguments and archives data."""
+  args = parse_arguments()
+  logging.basicConfig(level=logging.getLevelName(args.log_level))
+
+  db_opts = db_accessor.DatabaseOptions(
+    args.db_type, args.db_user, args.db_password, args.db_host, args.db_name, 1,
+    args.db_storage_mode)
+  db_con = db_accessor.DatabaseAccessor(db_opts)
+  before = partitions.add_months(
+    partitions.month_floor(datetime.datetime.now()),
+    1 - max(1, args.keep_months))
+  archive_before(db_con, archive.Archive(args.archive_dir), before)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,135 @@
+"""Archive unit tests."""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import sqlalchemy
+from db import (archive, archive_data, chunks, db_accessor, db_model, rollups,
+                testdb)
+
+
+class ArchiveTestCase(unittest.TestCase):
+  """A test case for archive files and the archive_data program."""
+
+  def setUp(self):
+    """Creates a temporary database and archive directory."""
+    _, self.db_file = tempfile.mkstemp()
+    self.archive_dir = tempfile.mkdtemp()
+    self.engine = testdb.create_engine(self.db_file)
+    self.start = datetime.datetime(2018, 1, 31, 23, 59, 58)
+    self.second = datetime.timedelta(seconds=1)
+
+  def tearDown(self):
+    """Removes the temporary database file and archive directory."""
+    shutil.rmtree(self.archive_dir)
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def new_data(self, offsets, topic_id, value=None):
+    """Creates values at a number of seconds after the start time."""
+    return [db_model.TopicDatum(self.start + i * self.second, topic_id,
+                                str(i if value is None else value))
+            for i in offsets]
+
+  def count_rows(self, model):
+    """Counts the rows of a table."""
+    with self.engine.connect() as con:
+      return con.execute(sqlalchemy.select([sqlalchemy.func.count()])
+                         .select_from(model.__table__)).scalar()
+
+  def test_find(self):
+    """Tests that ranges are found with the sparse index."""
+    arc = archive.Archive(self.archive_dir, index_stride=4)
+    month = datetime.datetime(2018, 1, 1)
+    arc.write(1, month, [(t, t / 2) for t in range(0, 100, 2)])
+    arc.write(1, month, [(3, 9.0), (4, 8.0)])
+    with archive.ArchiveFile(arc.path(1, month)) as f:
+      self.assertEqual(51, f.count)
+      self.assertEqual([0, 2, 3, 4, 6], f.timestamps[:5].tolist())
+      self.assertEqual([0.0, 1.0, 9.0, 8.0, 3.0], f.values[:5].tolist())
+      for start, end in ((-5, 200), (3, 3), (5, 5), (7, 16), (97, 98),
+                         (99, 200), (-5, -1)):
+        lo, hi = f.find(start, end)
+        self.assertEqual([t for t in f.timestamps.tolist()
+                          if start <= t <= end],
+                         f.timestamps[lo:hi].tolist())
+
+  def test_archive(self):
+    """Tests that past months are moved into the archive and read back."""
+    db_con = testdb.create_accessor(self.db_file, db_accessor.STORAGE_TYPED)
+    db_con.write_data(self.new_data(range(0, 4), 1) + self.new_data([1, 3], 2))
+    expected = list(db_con.iter_data([1, 2], self.start, self.start + 3600
+                                     * self.second))
+    buckets = db_con.get_downsampled_data([1, 2], self.start,
+                                          self.start + 3 * self.second,
+                                          bucket_width=2)
+
+    arc = archive.Archive(self.archive_dir)
+    self.assertEqual(3, archive_data.archive_before(
+      db_con, arc, datetime.datetime(2018, 2, 15)))
+    self.assertEqual(3, self.count_rows(db_model.TypedDatum))
+    self.assertTrue(os.path.exists(arc.path(2, datetime.datetime(2018, 1, 1))))
+
+    archived = testdb.create_accessor(
+      self.db_file, db_accessor.STORAGE_TYPED, self.archive_dir)
+    end = self.start + 3600 * self.second
+    self.assertEqual(expected, list(archived.iter_data([1, 2], self.start,
+                                                       end)))
+    self.assertEqual(expected, sorted((d.ts, d.topic_id, d.value)
+                                      for d in archived.get_data(
+                                        [1, 2], self.start, end, 1)))
+    self.assertEqual(buckets, archived.get_downsampled_data(
+      [1, 2], self.start, self.start + 3 * self.second, bucket_width=2))
+    self.assertEqual(self.start, archived.get_earliest_data_timestamp())
+    self.assertRaises(ValueError, archived.rebuild_topic_watermarks)
+
+    # Archived values conflict with new values, and are replaced by updates
+    # without being counted twice.
+    with self.assertRaises(sqlalchemy.exc.IntegrityError):
+      archived.write_data(self.new_data([0], 1, 7))
+    archived.write_data(self.new_data([0, 1], 1, 8),
+                        on_conflict=db_accessor.ON_CONFLICT_IGNORE)
+    archived.write_data(self.new_data([0], 1, 7),
+                        on_conflict=db_accessor.ON_CONFLICT_UPDATE)
+    self.assertEqual([7.0, 1.0], [v[2] for v in archived.iter_data(
+      [1], self.start, self.start + self.second)])
+    self.assertEqual([4, 2], [w.row_count for w in sorted(
+      archived.get_topic_watermarks(), key=lambda w: w.topic_id)])
+    day = rollups.DAY.model.__table__
+    with self.engine.connect() as con:
+      self.assertEqual((2, 8.0), tuple(con.execute(
+        sqlalchemy.select([day.c.row_count, day.c.value_sum])
+        .where(day.c.topic_id == 1).where(day.c.ts < self.start)).first()))
+
+  def test_chunked(self):
+    """Tests that chunks are archived with rows."""
+    db_con = testdb.create_accessor(self.db_file, db_accessor.STORAGE_CHUNKED)
+    db_con.write_data(self.new_data(range(0, 4), 1))
+    db_con.seal_chunks(self.start + 2 * chunks.WIDTH)
+    self.assertEqual(2, archive_data.archive_before(
+      db_con, archive.Archive(self.archive_dir),
+      datetime.datetime(2018, 2, 1)))
+    self.assertEqual(1, self.count_rows(db_model.DataChunk))
+
+    archived = testdb.create_accessor(
+      self.db_file, db_accessor.STORAGE_CHUNKED, self.archive_dir)
+    self.assertEqual([0.0, 1.0, 2.0, 3.0], [v[2] for v in archived.iter_data(
+      [1], self.start, self.start + 3 * self.second)])
+
+  def test_non_numeric(self):
+    """Tests that values which are not numbers are left in the database."""
+    db_con = testdb.create_accessor(self.db_file)
+    db_con.write_data(self.new_data([0, 1], 1, 'on'))
+    self.assertRaises(ValueError, archive_data.archive_before, db_con,
+                      archive.Archive(self.archive_dir),
+                      datetime.datetime(2018, 3, 1))
+    self.assertEqual(2, self.count_rows(db_model.TopicDatum))
+    self.assertEqual([], os.listdir(self.archive_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,125 @@
+"""A program that fills the rollup tables from existing data.
+
+Rollups are maintained as data is written, but data that was written before
+the rollup tables were created, or by tools that bypass DatabaseAccessor, must
+be rolled up separately. The range is processed in chunks of whole days, each
+in its own transaction, so that the program may be interrupted and resumed with
+a later --start date.
+
+    $ PYTHONPATH=. python db/backfill_rollups.py \
+          --db_type=mysql+mysqlconnector --db_host=localhost
+
+By default, every day from the earliest to the latest datum is rebuilt.
+"""
+
+import argparse
+import datetime
+import logging
+import time
+from db import db_accessor, rollups
+
+DEFAULT_DB_TYPE = 'sqlite'
+DEFAULT_DB_USER = 'uwsolar'
+DEFAULT_DB_PASSWORD = ''
+DEFAULT_DB_HOST = ':memory:'
+DEFAULT_DB_NAME = 'uwsolar'
+DEFAULT_CHUNK_DAYS = 1
+
+
+def parse_date(value):
+  """Parses a date in YYYY-MM-DD form."""
+  return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--log_level', default='INFO',
+                      help='The logging threshold.')
+
+  # Database connectivity arguments.
+  db_group = parser.add_argument_group(
+    'database', 'Database connectivity arguments.')
+  db_group.add_argument(
+    '--db_type', choices=['mysql+mysqlconnector', 'sqlite'],
+    default=DEFAULT_DB_TYPE, help='Which database type should be used.')
+  db_group.add_argument(
+    '--db_user', default=DEFAULT_DB_USER, help='The database user.')
+  db_group.add_argument(
+    '--db_password', default=DEFAULT_DB_PASSWORD, help='The database password.')
+  db_group.add_argument(
+    '--db_host', default=DEFAULT_DB_HOST, help='The database host.')
+  db_group.add_argument(
+    '--db_name', default=DEFAULT_DB_NAME, help='The database name.')
+
+  # Backfill arguments.
+  backfill_group = parser.add_argument_group(
+    'backfill', 'Backfill arguments.')
+  backfill_group.add_argument(
+    '--start', type=parse_date,
+    help='The first day to roll up (YYYY-MM-DD). Defaults to the day of the '
+         'earliest datum.')
+  backfill_group.add_argument(
+    '--end', type=parse_date,
+    help='The last day to roll up (YYYY-MM-DD). Defaults to the day of the '
+         'latest datum.')
+  backfill_group.add_argument(
+    '--chunk_days', type=int, default=DEFAULT_CHUNK_DAYS,
+    help='The number of days rolled up in each transaction.')
+
+  return parser.parse_args()
+
+
+def backfill(db_con, start, end, chunk_days=DEFAULT_CHUNK_DAYS):
+  """Rebuilds the rollups of every day in a range.
+
+  Args:
+    db_con: A handle to the database.
+    start: A time within the first day to roll up.
+    end: A time within the last day to roll up.
+    chunk_days: The number of days rolled up in each transaction.
+
+  Returns:
+    The number of days rolled up.
+  """
+  chunk = datetime.timedelta(days=max(1, chunk_days))
+  day = rollups.DAY.floor(start)
+  end = rollups.DAY.floor(end)
+  days = 0
+  while day <= end:
+    last = min(day + chunk, end + rollups.DAY.width) - rollups.DAY.width
+    begin = time.monotonic()
+    db_con.rebuild_rollups(
+      day, last + rollups.DAY.width - datetime.timedelta(microseconds=1))
+    logging.info('Rolled up %s to %s in %.1f seconds.', day.date(),
+                 last.date(), time.monotonic() - begin)
+    days += (last - day).days + 1
+    day = last + rollups.DAY.width
+
+  return days
+
+
+def main():
+  """Parses command line arguments and fills the rollup tables."""
+  args = parse_arguments()
+  logging.basicConfig(level=logging.getLevelName(args.log_level))
+
+  db_opts = db_accessor.DatabaseOptions(
+    args.db_type, args.db_user, args.db_password, args.db_host, args.db_name, 1)
+  db_con = db_accessor.DatabaseAccessor(db_opts)
+  start = args.start or db_con.get_earliest_data_timestamp()
+  end = args.end or db_con.get_latest_data_timestamp()
+  if start is None or end is None:
+    logging.info('There is no data to roll up.')
+    return
+
+  days = backfill(db_con, start, end, args.chunk_days)
+  logging.info('Rolled up %d days.', days)
+
+
+if __name__ == '__main__':
+  main()
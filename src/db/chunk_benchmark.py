@@ -0,0 +1,166 @@
+"""A program that compares chunked storage with one row per value.
+
+The same values are written to two temporary SQLite databases, one with
+--db_storage_mode=typed and one with --db_storage_mode=chunked, and every hour
+of the chunked database is sealed. For each, the program prints the size of the
+table holding the values in bytes per value, and how many values per second
+iter_data reads back. The throughput of decoding chunks in memory is printed as
+well.
+
+    $ PYTHONPATH=. python db/chunk_benchmark.py
+
+Values follow a random walk rounded to two decimal places, one per second with
+a few milliseconds of jitter, like those read from a meter.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+import sqlalchemy
+from db import chunks, db_accessor, db_model, gorilla
+
+DEFAULT_HOURS = 24
+DEFAULT_TOPICS = 10
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_JITTER_MS = 5
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  benchmark_group = parser.add_argument_group(
+    'benchmark', 'Benchmark arguments.')
+  benchmark_group.add_argument(
+    '--hours', type=int, default=DEFAULT_HOURS,
+    help='The number of hours of values to write for each topic.')
+  benchmark_group.add_argument(
+    '--topics', type=int, default=DEFAULT_TOPICS,
+    help='The number of topics to write values for.')
+  benchmark_group.add_argument(
+    '--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+    help='The number of values written in each transaction.')
+  benchmark_group.add_argument(
+    '--jitter_ms', type=int, default=DEFAULT_JITTER_MS,
+    help='The largest difference between a timestamp and the whole second.')
+  return parser.parse_args()
+
+
+def create_data(hours, topics, jitter_ms, start):
+  """Creates one value per second for several topics.
+
+  Args:
+    hours: The number of hours of values to create.
+    topics: The number of topics.
+    jitter_ms: The largest difference between a timestamp and the whole second.
+    start: The time of the first values.
+
+  Returns:
+    A list of TopicDatum objects, ordered by time.
+  """
+  rng = random.Random(0)
+  values = [rng.uniform(100, 200) for _ in range(0, topics)]
+  data = []
+  for i in range(0, hours * 3600):
+    ts = start + datetime.timedelta(seconds=i)
+    for topic_id in range(0, topics):
+      values[topic_id] += rng.choice([0, 0, 0.01, -0.01, rng.gauss(0, 1)])
+      jitter = datetime.timedelta(
+        milliseconds=rng.uniform(-jitter_ms, jitter_ms))
+      data.append(db_model.TopicDatum(ts + jitter, topic_id + 1,
+                                      '%.2f' % values[topic_id]))
+
+  return data
+
+
+def table_size(engine, table):
+  """Measures the size of a table and its indexes in bytes.
+
+  Requires SQLite's dbstat virtual table.
+  """
+  with engine.connect() as con:
+    return con.execute(sqlalchemy.text(
+      'select sum(pgsize) from dbstat where name = :table or name in '
+      '(select name from sqlite_master where tbl_name = :table)'),
+                       table=table).scalar()
+
+
+def measure(storage_mode, data, batch_size, end):
+  """Writes values with a storage mode and measures their size and read rate.
+
+  Args:
+    storage_mode: The storage mode.
+    data: The values to write.
+    batch_size: The number of values written in each transaction.
+    end: The end of the range of values.
+
+  Returns:
+    A (bytes per value, values read per second) pair.
+  """
+  fd, db_file = tempfile.mkstemp(suffix='.db')
+  os.close(fd)
+  try:
+    db_opts = db_accessor.DatabaseOptions('sqlite', None, None, db_file, None,
+                                          None, storage_mode)
+    db_con = db_accessor.DatabaseAccessor(db_opts)
+    db_model.BASE.metadata.create_all(db_con.engine)
+    for i in range(0, len(data), batch_size):
+      db_con.write_data(data[i:i + batch_size])
+
+    table = db_model.TypedDatum.__table__.name
+    if storage_mode == db_accessor.STORAGE_CHUNKED:
+      db_con.seal_chunks(end + chunks.WIDTH)
+      table = db_model.DataChunk.__table__.name
+
+    with db_con.engine.connect() as con:
+      con.execute('vacuum')
+
+    size = table_size(db_con.engine, table)
+    topic_ids = sorted({d.topic_id for d in data})
+    start = time.perf_counter()
+    count = sum(1 for _ in db_con.iter_data(topic_ids, data[0].ts, end))
+    rate = count / (time.perf_counter() - start)
+    return size / len(data), rate
+  finally:
+    os.unlink(db_file)
+
+
+def measure_decode(data):
+  """Encodes each topic's values by the hour and measures decoding.
+
+  Returns:
+    The number of values decoded per second.
+  """
+  series = {}
+  for d in data:
+    series.setdefault((d.topic_id, chunks.window(d.ts)), []).append(
+      (chunks.to_timestamp(d.ts), float(d.value_string)))
+
+  blobs = [gorilla.encode(points) for points in series.values()]
+  start = time.perf_counter()
+  count = sum(1 for blob in blobs for _ in gorilla.decode(blob))
+  return count / (time.perf_counter() - start)
+
+
+def main():
+  """Parses command line arguments and runs the benchmark."""
+  args = parse_arguments()
+  start = datetime.datetime(2000, 1, 1)
+  data = create_data(args.hours, args.topics, args.jitter_ms, start)
+  end = start + datetime.timedelta(hours=args.hours)
+  for storage_mode in (db_accessor.STORAGE_TYPED, db_accessor.STORAGE_CHUNKED):
+    size, rate = measure(storage_mode, data, args.batch_size, end)
+    print('%-8s %6.2f bytes/value %10.0f values/s read' % (storage_mode, size,
+                                                           rate))
+
+  print('%-8s %30.0f values/s decoded' % ('gorilla', measure_decode(data)))
+
+
+if __name__ == '__main__':
+  main()
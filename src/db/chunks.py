@@ -0,0 +1,219 @@
+"""Compresses the values of each topic into one chunk per hour.
+
+Storing one row per value costs tens of bytes of row and index overhead for
+every eight-byte value. Instead, the values of a topic within an hour may be
+encoded with db/gorilla.py into a single row of the data_chunks table, which
+typically needs a few bytes per value.
+
+New values are still written to the typed_data table, so that they are durable
+and their rollups and watermarks are maintained as usual. While an hour is
+open, the values written for each topic are also appended to an in-memory
+encoder. When a value for a later hour is written, the open chunk is sealed:
+the encoded values are written to the data_chunks table and their rows are
+deleted from the typed_data table, in the same transaction.
+
+If the encoder did not see every value of the hour (e.g. after a restart, or
+when values were written out of order), the chunk is encoded from the rows
+instead. Values written for an hour that was already sealed are merged into
+its chunk, and replace existing values with the same timestamp. Readers combine
+the values of chunks with those of rows that have not been sealed yet.
+"""
+
+import datetime
+import sqlalchemy
+from db import db_model, gorilla
+
+# The width of the window whose values are stored in each chunk.
+WIDTH = datetime.timedelta(hours=1)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def window(ts):
+  """Finds the start of the chunk containing a time."""
+  return _EPOCH + (ts - _EPOCH) // WIDTH * WIDTH
+
+
+def to_timestamp(ts):
+  """Converts a datetime into microseconds since the Unix epoch."""
+  return (ts - _EPOCH) // _MICROSECOND
+
+
+def from_timestamp(timestamp):
+  """Converts microseconds since the Unix epoch into a datetime."""
+  return _EPOCH + timestamp * _MICROSECOND
+
+
+class OpenChunk:
+  """The values of a topic that have been written within the current hour."""
+
+  def __init__(self, start_ts):
+    """Creates an empty chunk.
+
+    Args:
+      start_ts: The start of the hour.
+    """
+    self.start_ts = start_ts
+    self.encoder = gorilla.Encoder()
+    self.complete = True
+
+  def append(self, ts, value):
+    """Appends a value to the chunk.
+
+    A value that is not later than the last one cannot be encoded, so the chunk
+    will be encoded from the typed_data table instead.
+    """
+    timestamp = to_timestamp(ts)
+    if not self.complete or (self.encoder.count
+                             and timestamp <= self.encoder.last_timestamp):
+      self.complete = False
+      return
+
+    self.encoder.append(timestamp, value)
+
+
+def decode(chunk):
+  """Decodes the values of a chunk.
+
+  Args:
+    chunk: A DataChunk, or a row with topic_id and data columns.
+
+  Yields:
+    (ts, topic_id, value) tuples, ordered by timestamp.
+  """
+  for timestamp, value in gorilla.decode(chunk.data):
+    yield from_timestamp(timestamp), chunk.topic_id, value
+
+
+def iter_data(con, topic_ids, start_dt, end_dt):
+  """Streams the values of chunks for the given topics and date range.
+
+  Args:
+    con: The connection on which to execute the query.
+    topic_ids: The topics to query.
+    start_dt: The start datetime.
+    end_dt: The end datetime.
+
+  Yields:
+    (ts, topic_id, value) tuples, ordered by timestamp and topic.
+  """
+  table = db_model.DataChunk.__table__
+  query = (sqlalchemy.select([table.c.start_ts, table.c.topic_id,
+                              table.c.data])
+           .where(table.c.topic_id.in_(topic_ids))
+           .where(table.c.start_ts >= window(start_dt))
+           .where(table.c.start_ts <= end_dt)
+           .order_by(table.c.start_ts, table.c.topic_id))
+
+  # Every value of a chunk precedes those of the chunks of later hours, so
+  # values only need to be sorted within an hour.
+  start_ts = None
+  values = []
+  for row in con.execute(query):
+    if row.start_ts != start_ts:
+      yield from sorted(values)
+      start_ts = row.start_ts
+      values = []
+
+    values.extend(v for v in decode(row) if start_dt <= v[0] <= end_dt)
+
+  yield from sorted(values)
+
+
+def read_values(con, topic_ids, start_dt, end_dt):
+  """Reads the values of rows and chunks for the given topics and date range.
+
+  Unlike DatabaseAccessor.iter_data, the values are read on the given
+  connection, so that values written in its transaction are included.
+
+  Args:
+    con: The connection on which to execute the queries.
+    topic_ids: The topics to query.
+    start_dt: The start datetime.
+    end_dt: The end datetime.
+
+  Returns:
+    A dict from each (ts, topic_id) pair to its value. Rows replace chunk
+    values with the same topic and timestamp.
+  """
+  typed = db_model.TypedDatum.__table__
+  values = {v[:2]: v[2] for v in iter_data(con, topic_ids, start_dt, end_dt)}
+  values.update(((row.ts, row.topic_id), row.value) for row in con.execute(
+    sqlalchemy.select([typed.c.ts, typed.c.topic_id, typed.c.value])
+    .where(typed.c.topic_id.in_(topic_ids))
+    .where(typed.c.ts >= start_dt).where(typed.c.ts <= end_dt)))
+  return values
+
+
+def seal(con, topic_id, start_ts, chunk=None):
+  """Moves the values of a topic within an hour into its chunk.
+
+  Args:
+    con: The connection on which to execute the statements.
+    topic_id: The topic ID.
+    start_ts: The start of the hour.
+    chunk: The OpenChunk of the hour, or None if it is not known.
+  """
+  table = db_model.DataChunk.__table__
+  typed = db_model.TypedDatum.__table__
+  end_ts = start_ts + WIDTH
+  in_window = sqlalchemy.and_(typed.c.topic_id == topic_id,
+                              typed.c.ts >= start_ts, typed.c.ts < end_ts)
+  key = sqlalchemy.and_(table.c.topic_id == topic_id,
+                        table.c.start_ts == start_ts)
+  existing = con.execute(sqlalchemy.select([table.c.topic_id, table.c.data])
+                         .where(key)).first()
+
+  encoder = None
+  if existing is None and chunk is not None and chunk.complete:
+    count = con.execute(sqlalchemy.select([sqlalchemy.func.count()])
+                        .where(in_window)).scalar()
+    if count == chunk.encoder.count:
+      encoder = chunk.encoder
+
+  if encoder is None:
+    values = {}
+    if existing is not None:
+      values.update((to_timestamp(ts), value)
+                    for ts, _, value in decode(existing))
+
+    values.update((to_timestamp(row.ts), row.value) for row in con.execute(
+      sqlalchemy.select([typed.c.ts, typed.c.value]).where(in_window)))
+    encoder = gorilla.Encoder()
+    for timestamp in sorted(values):
+      encoder.append(timestamp, values[timestamp])
+
+  if encoder.count == 0:
+    return
+
+  con.execute(table.delete().where(key))
+  con.execute(table.insert().values(
+    topic_id=topic_id, start_ts=start_ts,
+    first_ts=from_timestamp(encoder.first_timestamp),
+    last_ts=from_timestamp(encoder.last_timestamp),
+    point_count=encoder.count, data=encoder.to_bytes()))
+  con.execute(typed.delete().where(in_window))
+
+
+def seal_before(con, end_dt):
+  """Seals every hour that ended before a time and still has rows.
+
+  Args:
+    con: The connection on which to execute the statements.
+    end_dt: The time before which hours should be sealed.
+
+  Returns:
+    The number of chunks sealed.
+  """
+  typed = db_model.TypedDatum.__table__
+  windows = set()
+  for row in con.execute(
+      sqlalchemy.select([typed.c.topic_id, typed.c.ts])
+      .where(typed.c.ts < window(end_dt))):
+    windows.add((row.topic_id, window(row.ts)))
+
+  for topic_id, start_ts in sorted(windows):
+    seal(con, topic_id, start_ts)
+
+  return len(windows)
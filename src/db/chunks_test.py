@@ -0,0 +1,161 @@
+"""Chunked storage unit tests."""
+
+import datetime
+import os
+import tempfile
+import unittest
+import sqlalchemy
+from db import chunks, db_accessor, db_model, downsampling, rollups, testdb
+
+
+class ChunksTestCase(unittest.TestCase):
+  """A test case for chunked storage."""
+
+  def setUp(self):
+    """Creates a temporary database."""
+    _, self.db_file = tempfile.mkstemp()
+    self.engine = testdb.create_engine(self.db_file)
+    self.db_con = testdb.create_accessor(self.db_file,
+                                         db_accessor.STORAGE_CHUNKED)
+    self.start = datetime.datetime(2018, 1, 1, 10, 59, 58)
+    self.second = datetime.timedelta(seconds=1)
+
+  def tearDown(self):
+    """Removes the temporary database file."""
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def read_table(self, model):
+    """Reads every row of a table, ordered by its primary key."""
+    table = model.__table__
+    with self.engine.connect() as con:
+      return [tuple(row) for row in con.execute(
+        sqlalchemy.select([table]).order_by(*table.primary_key.columns))]
+
+  def read_chunks(self):
+    """Reads every chunk.
+
+    Returns:
+      A list of (topic_id, start_ts, point_count, values) tuples.
+    """
+    with self.engine.connect() as con:
+      return [(row.topic_id, row.start_ts, row.point_count,
+               [v[2] for v in chunks.decode(row)])
+              for row in con.execute(sqlalchemy.select(
+                [db_model.DataChunk.__table__]).order_by('topic_id',
+                                                         'start_ts'))]
+
+  def new_data(self, offsets, topic_id, value=None):
+    """Creates values at a number of seconds after the start time."""
+    return [db_model.TopicDatum(self.start + i * self.second, topic_id,
+                                str(i if value is None else value))
+            for i in offsets]
+
+  def test_window(self):
+    """Tests that times are converted to chunk windows and timestamps."""
+    ts = datetime.datetime(2018, 1, 1, 10, 59, 58, 5)
+    self.assertEqual(datetime.datetime(2018, 1, 1, 10), chunks.window(ts))
+    self.assertEqual(ts, chunks.from_timestamp(chunks.to_timestamp(ts)))
+    self.assertEqual(1514804398000005, chunks.to_timestamp(ts))
+
+  def test_seal(self):
+    """Tests that the chunk of an hour is sealed when a later hour begins."""
+    hour = datetime.datetime(2018, 1, 1, 10)
+    self.db_con.write_data(self.new_data(range(0, 4), 1)
+                           + self.new_data([1], 2))
+    self.assertEqual([(1, hour, 2, [0.0, 1.0])], self.read_chunks())
+    self.assertEqual([(1, self.start + 2 * self.second, 2.0),
+                      (1, self.start + 3 * self.second, 3.0),
+                      (2, self.start + self.second, 1.0)],
+                     self.read_table(db_model.TypedDatum))
+
+    expected = [(self.start, 1, 0.0), (self.start + self.second, 1, 1.0),
+                (self.start + self.second, 2, 1.0),
+                (self.start + 2 * self.second, 1, 2.0),
+                (self.start + 3 * self.second, 1, 3.0)]
+    end = self.start + 3 * self.second
+    self.assertEqual(expected,
+                     list(self.db_con.iter_data([1, 2], self.start, end)))
+    self.assertEqual(expected, sorted(
+      (d.ts, d.topic_id, d.value)
+      for d in self.db_con.get_data([1, 2], self.start, end, 1)))
+
+    self.assertEqual(2, self.db_con.seal_chunks(hour + 2 * chunks.WIDTH))
+    self.assertEqual([], self.read_table(db_model.TypedDatum))
+    self.assertEqual([(1, hour, 2, [0.0, 1.0]),
+                      (1, hour + chunks.WIDTH, 2, [2.0, 3.0]),
+                      (2, hour, 1, [1.0])], self.read_chunks())
+    self.assertEqual(expected,
+                     list(self.db_con.iter_data([1, 2], self.start, end)))
+    self.assertEqual(expected[1:4], list(self.db_con.iter_data(
+      [1, 2], self.start + self.second, self.start + 2 * self.second)))
+
+  def test_conflicts(self):
+    """Tests that values written for sealed hours are merged into chunks."""
+    self.db_con.write_data(self.new_data(range(0, 4), 1))
+    self.db_con.write_data(self.new_data([-30], 1))
+    self.assertEqual([-30.0, 0.0, 1.0], self.read_chunks()[0][3])
+
+    # Sealed values do not have rows, but still conflict with new values.
+    with self.assertRaises(sqlalchemy.exc.IntegrityError):
+      self.db_con.write_data(self.new_data([0, 4], 1))
+    self.assertEqual([(1, self.start + 2 * self.second, 2.0),
+                      (1, self.start + 3 * self.second, 3.0)],
+                     self.read_table(db_model.TypedDatum))
+
+    self.db_con.write_data(self.new_data(range(-30, 4), 1, 5),
+                           on_conflict=db_accessor.ON_CONFLICT_IGNORE)
+    self.db_con.write_data(self.new_data([0, 3], 1, 9),
+                           on_conflict=db_accessor.ON_CONFLICT_UPDATE)
+    self.db_con.write_data(self.new_data([3600], 1))
+    self.assertEqual(
+      [-30.0] + [5.0] * 29 + [9.0, 1.0],
+      [v[2] for v in self.db_con.iter_data([1], self.start - 30 * self.second,
+                                           self.start + self.second)])
+
+    watermark = self.db_con.get_topic_watermarks()[0]
+    self.assertEqual((self.start - 30 * self.second,
+                      self.start + 3600 * self.second, 35),
+                     (watermark.first_ts, watermark.last_ts,
+                      watermark.row_count))
+    self.assertEqual(self.start - 30 * self.second,
+                     self.db_con.get_earliest_data_timestamp())
+
+    day = self.read_table(rollups.DAY.model)[0]
+    self.assertEqual((35, -30 + 5 * 29 + 9 + 1 + 2 + 9 + 3600, -30, 3600),
+                     day[2:6])
+
+  def test_restart(self):
+    """Tests that hours partly written by another accessor are sealed."""
+    self.db_con.write_data(self.new_data([2, 3], 1))
+    restarted = testdb.create_accessor(self.db_file,
+                                       db_accessor.STORAGE_CHUNKED)
+    restarted.write_data(self.new_data([4, 3605], 1))
+    self.assertEqual([(1, datetime.datetime(2018, 1, 1, 11), 3,
+                       [2.0, 3.0, 4.0])], self.read_chunks())
+
+  def test_downsampling(self):
+    """Tests that chunked values are aggregated in memory."""
+    self.db_con.write_data(self.new_data(range(0, 5), 1))
+    self.assertEqual(
+      [downsampling.Bucket(self.start, 1, 2, 0.5, 0, 1, 0, 1),
+       downsampling.Bucket(self.start + 2 * self.second, 1, 2, 2.5, 2, 3, 2,
+                           3),
+       downsampling.Bucket(self.start + 4 * self.second, 1, 1, 4, 4, 4, 4,
+                           4)],
+      self.db_con.get_downsampled_data([1], self.start,
+                                       self.start + 4 * self.second,
+                                       bucket_width=2))
+    self.assertEqual(
+      [self.start, self.start + 4 * self.second],
+      [row[0] for row in self.db_con.get_lttb_data(
+        [1], self.start, self.start + 4 * self.second, 3)][::2])
+    self.assertRaises(ValueError, self.db_con.rebuild_rollups, self.start,
+                      self.start)
+    self.assertRaises(ValueError, self.db_con.rebuild_topic_watermarks)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,136 @@
+"""A program that copies existing data into the typed_data table.
+
+Moving from the data table to the typed_data table happens in three steps:
+
+  1. Run the collector with --db_storage_mode=dual, so that new values are
+     written to both tables.
+  2. Run this program to copy the values that were written before then. Values
+     that are already in the typed_data table are skipped, so the ranges may
+     overlap.
+  3. Run the collector with --db_storage_mode=typed.
+
+The range is copied in chunks of whole days, each in its own transaction, so
+that the program may be interrupted and resumed with a later --start date.
+
+    $ PYTHONPATH=. python db/copy_typed_data.py \
+          --db_type=mysql+mysqlconnector --db_host=localhost
+"""
+
+import argparse
+import datetime
+import logging
+import time
+import sqlalchemy
+from db import db_accessor, db_model
+
+DEFAULT_DB_TYPE = 'sqlite'
+DEFAULT_DB_USER = 'uwsolar'
+DEFAULT_DB_PASSWORD = ''
+DEFAULT_DB_HOST = ':memory:'
+DEFAULT_DB_NAME = 'uwsolar'
+DEFAULT_CHUNK_DAYS = 1
+
+
+def parse_date(value):
+  """Parses a date in YYYY-MM-DD form."""
+  return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--log_level', default='INFO',
+                      help='The logging threshold.')
+
+  # Database connectivity arguments.
+  db_group = parser.add_argument_group(
+    'database', 'Database connectivity arguments.')
+  db_group.add_argument(
+    '--db_type', choices=['mysql+mysqlconnector', 'sqlite'],
+    default=DEFAULT_DB_TYPE, help='Which database type should be used.')
+  db_group.add_argument(
+    '--db_user', default=DEFAULT_DB_USER, help='The database user.')
+  db_group.add_argument(
+    '--db_password', default=DEFAULT_DB_PASSWORD, help='The database password.')
+  db_group.add_argument(
+    '--db_host', default=DEFAULT_DB_HOST, help='The database host.')
+  db_group.add_argument(
+    '--db_name', default=DEFAULT_DB_NAME, help='The database name.')
+
+  # Copy arguments.
+  copy_group = parser.add_argument_group('copy', 'Copy arguments.')
+  copy_group.add_argument(
+    '--start', type=parse_date,
+    help='The first day to copy (YYYY-MM-DD). Defaults to the day of the '
+         'earliest datum.')
+  copy_group.add_argument(
+    '--end', type=parse_date,
+    help='The last day to copy (YYYY-MM-DD). Defaults to the day of the latest '
+         'datum.')
+  copy_group.add_argument(
+    '--chunk_days', type=int, default=DEFAULT_CHUNK_DAYS,
+    help='The number of days copied in each transaction.')
+
+  return parser.parse_args()
+
+
+def copy(engine, start, end, chunk_days=DEFAULT_CHUNK_DAYS):
+  """Copies the values of every day in a range into the typed_data table.
+
+  Args:
+    engine: The database engine.
+    start: A time within the first day to copy.
+    end: A time within the last day to copy.
+    chunk_days: The number of days copied in each transaction.
+
+  Returns:
+    The number of values copied.
+  """
+  chunk = datetime.timedelta(days=max(1, chunk_days))
+  day = datetime.datetime.combine(start.date(), datetime.time())
+  end = (datetime.datetime.combine(end.date(), datetime.time())
+         + datetime.timedelta(days=1))
+  count = 0
+  while day < end:
+    last = min(day + chunk, end) - datetime.timedelta(microseconds=1)
+    begin = time.monotonic()
+    with engine.begin() as con:
+      copied = db_accessor.copy_typed_data(con, day, last)
+
+    logging.info('Copied %d values from %s to %s in %.1f seconds.', copied,
+                 day.date(), last.date(), time.monotonic() - begin)
+    count += copied
+    day += chunk
+
+  return count
+
+
+def main():
+  """Parses command line arguments and copies data."""
+  args = parse_arguments()
+  logging.basicConfig(level=logging.getLevelName(args.log_level))
+
+  db_opts = db_accessor.DatabaseOptions(
+    args.db_type, args.db_user, args.db_password, args.db_host, args.db_name, 1)
+  db_con = db_accessor.DatabaseAccessor(db_opts)
+  data = db_model.TopicDatum.__table__
+  with db_con.engine.connect() as con:
+    first, last = con.execute(sqlalchemy.select([
+      sqlalchemy.func.min(data.c.ts), sqlalchemy.func.max(data.c.ts)])).first()
+
+  start = args.start or first
+  end = args.end or last
+  if start is None or end is None:
+    logging.info('There is no data to copy.')
+    return
+
+  count = copy(db_con.engine, start, end, args.chunk_days)
+  logging.info('Copied %d values.', count)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,15 +1,190 @@
 """A module containing a SQL database connection handler."""
 
+import concurrent.futures
 import dataclasses
+import datetime
+import functools
+import heapq
+import logging
+import random
 import sys
+import threading
 import sqlalchemy
+import sqlalchemy.dialects.mysql
 import sqlalchemy.orm
 import sqlalchemy.sql.expression
-from db import db_model
+from db import (archive, chunks, db_model, downsampling, query_cache,
+                rollups, sqlite_profile)
 from sqlalchemy.sql import exists
 
 SQLITE_MAX_INT = sys.maxsize
 
+# The default number of rows fetched at a time when streaming data.
+DEFAULT_FETCH_SIZE = 10000
+
+# Writing a value that already exists for a topic and timestamp is an error.
+ON_CONFLICT_ERROR = 'error'
+
+# Values that already exist for a topic and timestamp are left unchanged.
+ON_CONFLICT_IGNORE = 'ignore'
+
+# Values that already exist for a topic and timestamp are replaced.
+ON_CONFLICT_UPDATE = 'update'
+
+# Values are stored as strings in the data table.
+STORAGE_LEGACY = 'legacy'
+
+# Values are written to both the data and typed_data tables, and read from the
+# data table. This is used while existing data is copied to typed_data.
+STORAGE_DUAL = 'dual'
+
+# Values are stored as numbers in the typed_data table.
+STORAGE_TYPED = 'typed'
+
+# Values are written to the typed_data table, and the values of each past hour
+# are compressed into the data_chunks table (see db/chunks.py).
+STORAGE_CHUNKED = 'chunked'
+
+STORAGE_MODES = (STORAGE_LEGACY, STORAGE_DUAL, STORAGE_TYPED, STORAGE_CHUNKED)
+
+
+def rebuild_topic_watermarks(con, topic_ids=None, data=None):
+  """Recomputes topic watermarks from the data table.
+
+  This should be called after data is written or deleted without using a
+  DatabaseAccessor (e.g. by bulk loading tools).
+
+  Args:
+    con: A connection or session on which to execute the statements.
+    topic_ids: The topics whose watermarks should be rebuilt, or None to
+        rebuild every watermark.
+    data: The table from which values are read: the data table (the default)
+        or the typed_data table.
+  """
+  if data is None:
+    data = db_model.TopicDatum.__table__
+
+  watermarks = db_model.TopicWatermark.__table__
+  delete = watermarks.delete()
+  query = sqlalchemy.select([data.c.topic_id, sqlalchemy.func.min(data.c.ts),
+                             sqlalchemy.func.max(data.c.ts),
+                             sqlalchemy.func.count()])
+  if topic_ids is not None:
+    delete = delete.where(watermarks.c.topic_id.in_(topic_ids))
+    query = query.where(data.c.topic_id.in_(topic_ids))
+
+  con.execute(delete)
+  con.execute(watermarks.insert().from_select(
+    ['topic_id', 'first_ts', 'last_ts', 'row_count'],
+    query.group_by(data.c.topic_id)))
+
+
+def _to_number(value_string):
+  """Converts a value string into a number, or None if it is not a number."""
+  try:
+    return float(value_string)
+  except (TypeError, ValueError):
+    return None
+
+
+def _to_series(rows, start_dt, bucket_width):
+  """Annotates (ts, topic_id, value_string) rows for downsampling.lttb.
+
+  Yields:
+    (bucket, x, y, row) tuples, where x is the number of seconds from the start
+    of the range to the row.
+  """
+  for row in rows:
+    x = (row[0] - start_dt).total_seconds()
+    yield int(x) // bucket_width, x, float(row[2]), row
+
+
+def _serialized(method):
+  """Runs a method that writes to the database on the accessor's writer.
+
+  When the accessor has a writer thread (see db/sqlite_profile.py), calls from
+  other threads are executed by that thread, in the order they are made, and
+  wait for its result.
+  """
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    if (self._writer is None
+        or threading.get_ident() == self._writer_thread_id):
+      return method(self, *args, **kwargs)
+
+    return self._writer.submit(method, self, *args, **kwargs).result()
+
+  return wrapper
+
+
+@functools.lru_cache(maxsize=None)
+def _watermark_statements():
+  """Builds the statements that extend topic watermarks.
+
+  Returns:
+    An (insert, update) pair. The insert creates missing watermarks, and the
+    update extends a watermark given b_topic_id, b_first_ts, b_last_ts and
+    b_row_count parameters.
+  """
+  table = db_model.TopicWatermark.__table__
+  insert = (table.insert().prefix_with('IGNORE', dialect='mysql')
+            .prefix_with('OR IGNORE', dialect='sqlite'))
+
+  first_ts = sqlalchemy.bindparam('b_first_ts', type_=sqlalchemy.DateTime)
+  last_ts = sqlalchemy.bindparam('b_last_ts', type_=sqlalchemy.DateTime)
+  update = (table.update()
+            .where(table.c.topic_id == sqlalchemy.bindparam('b_topic_id'))
+            .values(
+              first_ts=sqlalchemy.case([(table.c.first_ts > first_ts,
+                                         first_ts)], else_=table.c.first_ts),
+              last_ts=sqlalchemy.case([(table.c.last_ts < last_ts, last_ts)],
+                                      else_=table.c.last_ts),
+              row_count=(table.c.row_count
+                         + sqlalchemy.bindparam('b_row_count'))))
+  return insert, update
+
+
+def copy_typed_data(con, start_dt, end_dt):
+  """Copies values from the data table into the typed_data table.
+
+  Values that already exist in the typed_data table (e.g. because they were
+  written while both tables were in use) are left unchanged.
+
+  Args:
+    con: The connection on which to execute the statement.
+    start_dt: The start of the range to copy.
+    end_dt: The end of the range to copy (inclusive).
+
+  Returns:
+    The number of values copied.
+  """
+  data = db_model.TopicDatum.__table__
+  typed = db_model.TypedDatum.__table__
+  query = (sqlalchemy.select([
+    data.c.topic_id, data.c.ts,
+    rollups.to_number(con.dialect.name, data.c.value_string)])
+           .where(data.c.ts >= start_dt).where(data.c.ts <= end_dt))
+  return con.execute(
+    typed.insert().prefix_with('IGNORE', dialect='mysql')
+    .prefix_with('OR IGNORE', dialect='sqlite')
+    .from_select(['topic_id', 'ts', 'value'], query)).rowcount
+
+
+# The aggregates of a topic's values within a time bucket, as returned by
+# DatabaseAccessor._get_buckets when they are computed from chunks.
+@dataclasses.dataclass(frozen=True)
+class _BucketRow:
+  topic_id: int
+  bucket: int
+  count: int
+  avg: float
+  min: float
+  max: float
+  first: float
+  last: float
+  avg_offset: float
+
 
 # An object containing database options.
 @dataclasses.dataclass(frozen=True)
@@ -20,6 +195,10 @@ class DatabaseOptions:
   host: str
   database: str
   pool_size: int
+  storage_mode: str = STORAGE_LEGACY
+  archive_dir: str = None
+  sqlite_production: bool = False
+  query_cache_bytes: int = 0
 
 
 class DatabaseAccessor:
@@ -27,14 +206,68 @@ class DatabaseAccessor:
 
   def __init__(self, opts):
     """Initializes the database handler."""
+    if opts.storage_mode not in STORAGE_MODES:
+      raise ValueError('Unknown storage mode: %s.' % opts.storage_mode)
+
     self.db_type = opts.db_type
-    if opts.db_type == 'sqlite':
+    self.storage_mode = opts.storage_mode
+    self._model = (db_model.TypedDatum
+                   if opts.storage_mode in (STORAGE_TYPED, STORAGE_CHUNKED)
+                   else db_model.TopicDatum)
+    # Writes use their own engine and thread with the production SQLite
+    # profile, and the same engine as reads otherwise.
+    self._writer = None
+    self._writer_thread_id = None
+    if opts.db_type == 'sqlite' and opts.sqlite_production:
+      self.engine, self._write_engine = sqlite_profile.create_engines(
+        opts.host, opts.pool_size or None)
+      self._writer = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix='sqlite-writer',
+        initializer=self._init_writer)
+    elif opts.db_type == 'sqlite':
       dsn = '%s:///%s' % (opts.db_type, opts.host)
-      self.engine = sqlalchemy.create_engine(dsn)
+      self.engine = self._write_engine = sqlalchemy.create_engine(dsn)
     else:
       dsn = '%s://%s:%s@%s/%s' % (opts.db_type, opts.user, opts.password,
                                   opts.host, opts.database)
-      self.engine = sqlalchemy.create_engine(dsn, pool_size=opts.pool_size)
+      self.engine = self._write_engine = sqlalchemy.create_engine(
+        dsn, pool_size=opts.pool_size)
+
+    # A cache of topic IDs keyed by topic name, and the largest cached ID.
+    self._topic_lock = threading.Lock()
+    self._topic_ids = {}
+    self._max_topic_id = 0
+
+    # Statements that write data are built once, and their compiled forms are
+    # reused by every batch.
+    self._insert_statements = {}
+    self._compiled_cache = sqlalchemy.util.LRUCache(100)
+
+    # The chunk of the current hour for each topic, when values are chunked.
+    self._chunk_lock = threading.Lock()
+    self._open_chunks = {}
+
+    # Cold values that were moved out of the database (see db/archive.py).
+    self._archive = (archive.Archive(opts.archive_dir) if opts.archive_dir
+                     else None)
+
+    # Recent results of iter_data (see db/query_cache.py), or None if they are
+    # not cached. Results are invalidated when values are written behind the
+    # watermarks, but not when values are deleted.
+    self.query_cache = (query_cache.QueryCache(self, opts.query_cache_bytes)
+                        if opts.query_cache_bytes else None)
+
+  def _init_writer(self):
+    """Records the identity of the writer thread."""
+    self._writer_thread_id = threading.get_ident()
+
+  def close(self):
+    """Waits for pending writes and closes every database connection."""
+    if self._writer is not None:
+      self._writer.shutdown()
+
+    self._write_engine.dispose()
+    self.engine.dispose()
 
   def get_data(self, topic_ids, start_dt, end_dt, sample_rate):
     """Gets time-series data for the given topics and date range.
@@ -48,63 +281,474 @@ class DatabaseAccessor:
       sample_rate: A sample rate, between 0 and 1 inclusive.
 
     Returns:
-      A list of time-series data objects.
+      A list of time-series data objects, which are TypedDatum objects when
+      values are stored in the typed_data table. Values decoded from chunks,
+      and then archived values, follow those read from rows as TypedDatum
+      objects.
     """
-    # MySQL's rand() method returns a decimal in the range [0, 1]. SQLite's
-    # random() method returns an integer between
-    # [-9223372036854775808, 9223372036854775807]. Since we expect the caller to
-    # send us a decimal in [0, 1], convert it into something suitable for SQLite
-    # queries.
-    if self.db_type == 'sqlite':
-      sample_rate = SQLITE_MAX_INT * 2 * (sample_rate - 0.5)
-
+    threshold = self._sample_threshold(sample_rate)
+    model = self._model
     s = sqlalchemy.orm.Session(self.engine)
     try:
-      result = (s.query(db_model.TopicDatum).filter(
-        db_model.TopicDatum.topic_id.in_(topic_ids))
-                .filter(db_model.TopicDatum.ts >= start_dt)
-                .filter(db_model.TopicDatum.ts <= end_dt)
-                .filter(sqlalchemy.sql.functions.random() <= sample_rate).all())
+      result = (s.query(model).filter(model.topic_id.in_(topic_ids))
+                .filter(model.ts >= start_dt)
+                .filter(model.ts <= end_dt)
+                .filter(sqlalchemy.sql.functions.random() <= threshold).all())
+      keys = {(d.ts, d.topic_id) for d in result}
+      for values in self._iter_cold_data(s.connection(), topic_ids, start_dt,
+                                         end_dt):
+        for v in values:
+          if v[:2] not in keys and random.random() <= sample_rate:
+            keys.add(v[:2])
+            result.append(db_model.TypedDatum(*v))
+
       return result
     finally:
       s.close()
 
-  def get_earliest_data_timestamp(self):
+  def iter_data(self, topic_ids, start_dt, end_dt, sample_rate=1,
+                fetch_size=DEFAULT_FETCH_SIZE, cached=True):
+    """Streams time-series data for the given topics and date range.
+
+    Unlike get_data, rows are fetched from the database a chunk at a time and
+    are returned as plain tuples, so that arbitrarily large ranges may be
+    processed in bounded memory. A server-side cursor is used where the
+    database driver supports one. The database connection is held until the
+    generator is exhausted or closed. When values are chunked, chunks are
+    decoded an hour at a time and merged with the rows, as are the values of
+    any archive files.
+
+    When the accessor has a query cache, unsampled reads are served from it
+    instead, and the whole range is held in memory.
+
+    NOTE: Sampling does not work when using a SQLite backend.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+      sample_rate: A sample rate, between 0 and 1 inclusive.
+      fetch_size: The number of rows fetched from the database at a time.
+      cached: Whether the query cache may be used.
+
+    Yields:
+      (ts, topic_id, value) tuples, ordered by timestamp and topic. The value
+      is a string, or a number when values are stored in the typed_data table.
+    """
+    if cached and self.query_cache is not None and sample_rate == 1:
+      yield from self.query_cache.read_data(topic_ids, start_dt, end_dt)
+      return
+
+    table = self._model.__table__
+    value = (table.c.value if self._model is db_model.TypedDatum
+             else table.c.value_string)
+    query = (sqlalchemy.select([table.c.ts, table.c.topic_id, value])
+             .where(table.c.topic_id.in_(topic_ids))
+             .where(table.c.ts >= start_dt)
+             .where(table.c.ts <= end_dt)
+             .order_by(table.c.ts, table.c.topic_id))
+    if sample_rate < 1:
+      query = query.where(sqlalchemy.sql.functions.random()
+                          <= self._sample_threshold(sample_rate))
+
+    rows = self._iter_rows(query, fetch_size)
+    if self._rows_only():
+      yield from rows
+      return
+
+    # Rows precede chunk values with the same topic and timestamp, which
+    # precede archived values, and replace them.
+    with self.engine.connect() as con:
+      streams = [(v for v in values if random.random() <= sample_rate)
+                 for values in self._iter_cold_data(con, topic_ids, start_dt,
+                                                    end_dt)]
+      previous = None
+      for row in heapq.merge(rows, *streams, key=lambda r: r[:2]):
+        if row[:2] != previous:
+          previous = row[:2]
+          yield row
+
+  def _iter_cold_data(self, con, topic_ids, start_dt, end_dt):
+    """Streams the values that are not stored as rows.
+
+    Args:
+      con: The connection on which to read chunks.
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+
+    Returns:
+      A list of iterators of (ts, topic_id, value) tuples, ordered by timestamp
+      and topic: the values of chunks, and then those of archive files.
+    """
+    streams = []
+    if self.storage_mode == STORAGE_CHUNKED:
+      streams.append(chunks.iter_data(con, topic_ids, start_dt, end_dt))
+
+    if self._archive is not None:
+      streams.append(self._archive.iter_data(topic_ids, start_dt, end_dt))
+
+    return streams
+
+  def _rows_only(self):
+    """Checks whether every value is stored as a row."""
+    return self.storage_mode != STORAGE_CHUNKED and self._archive is None
+
+  def _iter_rows(self, query, fetch_size):
+    """Streams the rows of a query as tuples, a chunk at a time."""
+    with self.engine.connect() as con:
+      result = con.execution_options(stream_results=True).execute(query)
+      try:
+        while True:
+          rows = result.fetchmany(fetch_size)
+          if not rows:
+            return
+
+          for row in rows:
+            yield tuple(row)
+      finally:
+        result.close()
+
+  def _sample_threshold(self, sample_rate):
+    """Converts a sample rate into a threshold for the random() function.
+
+    MySQL's rand() method returns a decimal in the range [0, 1]. SQLite's
+    random() method returns an integer between
+    [-9223372036854775808, 9223372036854775807]. Since we expect the caller to
+    send us a decimal in [0, 1], convert it into something suitable for SQLite
+    queries.
+
+    Args:
+      sample_rate: A sample rate, between 0 and 1 inclusive.
+
+    Returns:
+      A value to which the result of random() may be compared.
+    """
+    if self.db_type == 'sqlite':
+      return SQLITE_MAX_INT * 2 * (sample_rate - 0.5)
+
+    return sample_rate
+
+  def get_downsampled_data(self, topic_ids, start_dt, end_dt, points=None,
+                           bucket_width=None):
+    """Gets per-bucket aggregates of the data for the given topics and range.
+
+    The range is divided into buckets of equal width, aligned to its start, and
+    the values within each bucket are aggregated by the database. The result is
+    the same on every call and does not depend on the size of the range.
+
+    When the bucket width is a multiple of a rollup's width and the range
+    starts on a rollup boundary, the coarsest such rollup is read instead of
+    the data table. The range is then widened to end with the rollup bucket
+    that contains the end datetime. When a number of points is given, the
+    bucket width is rounded up to a multiple of the coarsest rollup width that
+    does not exceed it, so that a rollup may be used.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+      points: The largest number of buckets per topic.
+      bucket_width: The bucket width in whole seconds. Exactly one of points
+          and bucket_width must be given.
+
+    Returns:
+      A list of downsampling.Bucket objects, ordered by topic and time. Buckets
+      that contain no data are omitted.
+    """
+    if (points is None) == (bucket_width is None):
+      raise ValueError('Exactly one of points and bucket_width must be given.')
+
+    if bucket_width is None:
+      bucket_width = downsampling.bucket_width(start_dt, end_dt, points)
+      for rollup in reversed(rollups.ROLLUPS):
+        width = int(rollup.width.total_seconds())
+        if width <= bucket_width and rollup.floor(start_dt) == start_dt:
+          bucket_width = -(-bucket_width // width) * width
+          break
+    elif bucket_width < 1:
+      raise ValueError('The bucket width must be at least one second.')
+
+    rollup = rollups.choose(start_dt, bucket_width)
+    source = rollup.model.__table__ if rollup else None
+    return [downsampling.Bucket(
+      start_dt + datetime.timedelta(seconds=row.bucket * bucket_width),
+      row.topic_id, row.count, row.avg, row.min, row.max, float(row.first),
+      float(row.last))
+            for row in self._get_buckets(topic_ids, start_dt, end_dt,
+                                         bucket_width, source)]
+
+  def get_lttb_data(self, topic_ids, start_dt, end_dt, points):
+    """Gets the visually significant data for the given topics and range.
+
+    Points are selected from each topic's data using the
+    largest-triangle-three-buckets algorithm, so that at most the given number
+    of points are returned for each topic however wide the range. Rows are
+    streamed from the database, so memory use does not grow with the range.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+      points: The largest number of points per topic, at least three.
+
+    Returns:
+      A list of (ts, topic_id, value) tuples, ordered by topic and time, as
+      returned by iter_data.
+    """
+    if points < 3:
+      raise ValueError('At least three points are required.')
+
+    # The first and last points are selected in addition to one per bucket.
+    width = downsampling.bucket_width(start_dt, end_dt, points - 2)
+    averages = {}
+    for row in self._get_buckets(topic_ids, start_dt, end_dt, width):
+      averages.setdefault(row.topic_id, {})[row.bucket] = (row.avg_offset,
+                                                           row.avg)
+
+    result = []
+    for topic_id in sorted(averages):
+      rows = self.iter_data([topic_id], start_dt, end_dt)
+      result.extend(downsampling.lttb(_to_series(rows, start_dt, width),
+                                      averages[topic_id]))
+
+    return result
+
+  def _get_buckets(self, topic_ids, start_dt, end_dt, bucket_width,
+                   source=None):
+    """Aggregates the data for the given topics and range into time buckets.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+      bucket_width: The bucket width in whole seconds.
+      source: A rollup table from which to compute the buckets, or None to
+          compute them from the data table.
+
+    Returns:
+      A list of rows with topic_id, bucket, count, avg, min, max, first, last
+      and avg_offset columns, where bucket is the index of the bucket from the
+      start of the range, and avg_offset is the average number of seconds from
+      the start of the range to the bucket's values.
+    """
+    if source is None and not self._rows_only():
+      return self._aggregate_buckets(topic_ids, start_dt, end_dt, bucket_width)
+
+    dialect = self.engine.dialect.name
+    table = self._model.__table__ if source is None else source
+    cols = rollups.source_columns(dialect, table)
+    offset = self._seconds_since(start_dt, table.c.ts)
+    bucket = self._floor_divide(offset, bucket_width)
+    count = sqlalchemy.func.sum(cols['row_count'])
+    buckets = (sqlalchemy.select([
+      table.c.topic_id, bucket.label('bucket'), count.label('count'),
+      (sqlalchemy.func.sum(cols['value_sum']) / count).label('avg'),
+      sqlalchemy.func.min(cols['value_min']).label('min'),
+      sqlalchemy.func.max(cols['value_max']).label('max'),
+      sqlalchemy.func.min(table.c.ts).label('first_key'),
+      sqlalchemy.func.max(table.c.ts).label('last_key'),
+      sqlalchemy.func.avg(offset).label('avg_offset')])
+               .where(table.c.topic_id.in_(topic_ids))
+               .where(table.c.ts >= start_dt)
+               .where(table.c.ts <= end_dt)
+               .group_by(table.c.topic_id, bucket)
+               .alias('buckets'))
+
+    first = table.alias('first_source')
+    last = table.alias('last_source')
+    query = (sqlalchemy.select([
+      buckets.c.topic_id, buckets.c.bucket, buckets.c.count, buckets.c.avg,
+      buckets.c.min, buckets.c.max,
+      rollups.source_columns(dialect, first)['first_value'].label('first'),
+      rollups.source_columns(dialect, last)['last_value'].label('last'),
+      buckets.c.avg_offset])
+             .select_from(buckets.join(first, sqlalchemy.and_(
+               first.c.topic_id == buckets.c.topic_id,
+               first.c.ts == buckets.c.first_key)).join(last, sqlalchemy.and_(
+                 last.c.topic_id == buckets.c.topic_id,
+                 last.c.ts == buckets.c.last_key)))
+             .order_by(buckets.c.topic_id, buckets.c.bucket))
+
+    with self.engine.connect() as con:
+      return con.execute(query).fetchall()
+
+  def _aggregate_buckets(self, topic_ids, start_dt, end_dt, bucket_width):
+    """Aggregates the data for the given topics and range in memory.
+
+    Chunks and archive files cannot be aggregated by the database, so every
+    value in the range is read with iter_data.
+
+    Returns:
+      A list of _BucketRow objects, ordered by topic and bucket.
+    """
+    buckets = {}
+    for ts, topic_id, value in self.iter_data(topic_ids, start_dt, end_dt):
+      value = float(value)
+      offset = int((ts - start_dt).total_seconds())
+      key = (topic_id, offset // bucket_width)
+      b = buckets.get(key)
+      if b is None:
+        buckets[key] = [1, value, value, value, value, value, offset]
+      else:
+        b[0] += 1
+        b[1] += value
+        b[2] = min(b[2], value)
+        b[3] = max(b[3], value)
+        b[5] = value
+        b[6] += offset
+
+    return [_BucketRow(topic_id, bucket, b[0], b[1] / b[0], b[2], b[3], b[4],
+                       b[5], b[6] / b[0])
+            for (topic_id, bucket), b in sorted(buckets.items())]
+
+  def _seconds_since(self, start_dt, ts):
+    """Builds an expression for the whole seconds between two times."""
+    start = sqlalchemy.literal(start_dt, sqlalchemy.DateTime)
+    if self.db_type == 'sqlite':
+      return (sqlalchemy.cast(sqlalchemy.func.strftime('%s', ts),
+                              sqlalchemy.Integer)
+              - sqlalchemy.cast(sqlalchemy.func.strftime('%s', start),
+                                sqlalchemy.Integer))
+
+    return sqlalchemy.func.timestampdiff(sqlalchemy.literal_column('SECOND'),
+                                         start, ts)
+
+  def _floor_divide(self, a, b):
+    """Builds an expression for the integer quotient of two integers."""
+    if self.db_type == 'sqlite':
+      # SQLite divides integers with integer division.
+      return a / b
+
+    return a.op('DIV')(b)
+
+  def get_earliest_data_timestamp(self, topic_ids=None):
     """Gets the earliest timestamp from the data table.
 
+    Without topics, this is a MIN() over the data table's timestamp index.
+    Otherwise, or when values are only stored in the typed_data table (which
+    is not indexed by timestamp alone), chunked or archived, it is answered
+    from the topic watermarks.
+
+    Args:
+      topic_ids: The topics to consider, or None to consider every topic.
+
     Returns:
-      A datetime object for the earliest data entry.
+      A datetime object for the earliest data entry, or None if there is no
+      data.
     """
-    s = sqlalchemy.orm.Session(self.engine)
-    try:
-      result = s.query(db_model.TopicDatum).order_by(
-        db_model.TopicDatum.ts.asc())
-      if result.count() == 0:
-        return None
+    if (topic_ids is None and self._model is db_model.TopicDatum
+        and self._rows_only()):
+      column = db_model.TopicDatum.ts
+    else:
+      column = db_model.TopicWatermark.first_ts
 
-      datum = result.first()
-      return datum.ts
-    finally:
-      s.close()
+    return self._get_data_timestamp(sqlalchemy.func.min(column), topic_ids)
 
-  def get_latest_data_timestamp(self):
+  def get_latest_data_timestamp(self, topic_ids=None):
     """Gets the latest timestamp from the data table.
 
+    Without topics, this is a MAX() over the data table's timestamp index.
+    Otherwise, or when values are only stored in the typed_data table (which
+    is not indexed by timestamp alone), chunked or archived, it is answered
+    from the topic watermarks.
+
+    Args:
+      topic_ids: The topics to consider, or None to consider every topic.
+
+    Returns:
+      A datetime object for the latest data entry, or None if there is no
+      data.
+    """
+    if (topic_ids is None and self._model is db_model.TopicDatum
+        and self._rows_only()):
+      column = db_model.TopicDatum.ts
+    else:
+      column = db_model.TopicWatermark.last_ts
+
+    return self._get_data_timestamp(sqlalchemy.func.max(column), topic_ids)
+
+  def _get_data_timestamp(self, aggregate, topic_ids):
+    """Evaluates an aggregate over data or watermark timestamps."""
+    query = sqlalchemy.select([aggregate])
+    if topic_ids is not None:
+      query = query.where(db_model.TopicWatermark.topic_id.in_(topic_ids))
+
+    with self.engine.connect() as con:
+      return con.execute(query).scalar()
+
+  def get_topic_watermarks(self, topic_ids=None):
+    """Gets a summary of the data written for each topic.
+
+    Args:
+      topic_ids: The topics to summarize, or None to summarize every topic.
+
     Returns:
-      A datetime object for the earliest data entry.
+      A list of TopicWatermark objects. Topics without data are omitted.
     """
     s = sqlalchemy.orm.Session(self.engine)
     try:
-      result = s.query(db_model.TopicDatum).order_by(
-        db_model.TopicDatum.ts.desc())
-      if result.count() == 0:
-        return None
+      query = s.query(db_model.TopicWatermark)
+      if topic_ids is not None:
+        query = query.filter(db_model.TopicWatermark.topic_id.in_(topic_ids))
 
-      datum = result.first()
-      return datum.ts
+      return query.all()
     finally:
       s.close()
 
+  @_serialized
+  def rebuild_rollups(self, start_dt, end_dt, topic_ids=None):
+    """Recomputes the rollup buckets that contain a range of time.
+
+    Args:
+      start_dt: The start of the range.
+      end_dt: The end of the range (inclusive).
+      topic_ids: The topics whose rollups should be rebuilt, or None to rebuild
+          the rollups of every topic.
+    """
+    self._check_rows_only()
+    with self._write_engine.begin() as con:
+      rollups.rebuild(con, start_dt, end_dt, topic_ids, self._model.__table__)
+
+  @_serialized
+  def rebuild_topic_watermarks(self, topic_ids=None):
+    """Recomputes topic watermarks from the data table.
+
+    Args:
+      topic_ids: The topics whose watermarks should be rebuilt, or None to
+          rebuild every watermark.
+    """
+    self._check_rows_only()
+    with self._write_engine.begin() as con:
+      rebuild_topic_watermarks(con, topic_ids, self._model.__table__)
+
+  def _check_rows_only(self):
+    """Raises a ValueError if values are chunked or archived.
+
+    Aggregates are only computed from rows, and the rows of sealed chunks and
+    archived months have been deleted.
+    """
+    if not self._rows_only():
+      raise ValueError(
+        'Aggregates cannot be rebuilt from chunked or archived values.')
+
+  @_serialized
+  def seal_chunks(self, end_dt):
+    """Compresses the values of every hour that ended before a time.
+
+    Chunks are sealed as values are written, but the hours of topics that are
+    no longer written, or whose values were not written by this accessor (e.g.
+    before a restart), must be sealed separately.
+
+    Args:
+      end_dt: The time before which hours should be sealed.
+
+    Returns:
+      The number of chunks sealed.
+    """
+    with self._chunk_lock, self._write_engine.begin() as con:
+      return chunks.seal_before(con, end_dt)
+
   def get_all_topics(self):
     """Gets a list of topic values.
 
@@ -133,15 +777,386 @@ class DatabaseAccessor:
     finally:
       s.close()
 
-  def write_data(self, data):
-    """Writes a list of topic values to the database.
+  def get_topic_ids(self, topic_names):
+    """Resolves topic names to their IDs, creating any missing topics.
+
+    Topic IDs are cached. When a name is not in the cache, topics added since
+    the cache was last refreshed are loaded, and any topics that still do not
+    exist are created in a single batch. Resolving known names does not query
+    the database.
 
     Args:
-      data: A list of topic values to be written.
+      topic_names: An iterable of topic names.
+
+    Returns:
+      A dict from each topic name to its ID.
     """
-    s = sqlalchemy.orm.Session(self.engine)
+    topic_names = set(topic_names)
+    with self._topic_lock:
+      if not topic_names <= self._topic_ids.keys():
+        self._refresh_topics()
+
+      missing = topic_names - self._topic_ids.keys()
+      if missing:
+        self._create_topics(missing)
+
+      return {name: self._topic_ids[name] for name in topic_names}
+
+  def _refresh_topics(self):
+    """Caches the IDs of topics added since the cache was last refreshed."""
+    table = db_model.Topic.__table__
+    with self.engine.connect() as con:
+      rows = con.execute(
+        sqlalchemy.select([table.c.topic_id, table.c.topic_name])
+        .where(table.c.topic_id > self._max_topic_id))
+      self._cache_topics(rows)
+
+  @_serialized
+  def _create_topics(self, topic_names):
+    """Creates topics in a single batch and caches their IDs.
+
+    Topics created concurrently by another process are ignored, and their IDs
+    are cached instead.
+
+    Args:
+      topic_names: A set of topic names that are not in the cache.
+    """
+    table = db_model.Topic.__table__
+    with self._write_engine.begin() as con:
+      con.execute(table.insert().prefix_with('IGNORE', dialect='mysql')
+                  .prefix_with('OR IGNORE', dialect='sqlite'),
+                  [{'topic_name': name} for name in sorted(topic_names)])
+      rows = con.execute(
+        sqlalchemy.select([table.c.topic_id, table.c.topic_name])
+        .where(table.c.topic_name.in_(topic_names)))
+      self._cache_topics(rows)
+
+  def _cache_topics(self, rows):
+    """Adds (topic ID, topic name) rows to the cache."""
+    for topic_id, topic_name in rows:
+      self._topic_ids[topic_name] = topic_id
+      self._max_topic_id = max(self._max_topic_id, topic_id)
+
+  @_serialized
+  def write_topics(self, topics):
+    """Writes a list of topics to the database.
+
+    Args:
+      topics: A list of topics to be written.
+    """
+    s = sqlalchemy.orm.Session(self._write_engine)
     try:
-      s.add_all(data)
+      s.add_all(topics)
       s.commit()
     finally:
       s.close()
+
+  @_serialized
+  def write_data(self, data, on_conflict=ON_CONFLICT_ERROR):
+    """Writes a list of topic values to the database.
+
+    The values are written in a single transaction with one executemany
+    statement per table, bypassing the ORM's unit of work. The watermarks and
+    rollups of the values' topics are updated in the same transaction.
+
+    Depending on the storage mode, values are written to the data table, the
+    typed_data table, or both. Values that are not numbers (e.g. those of
+    string metrics) are not written to the typed_data table, and are logged
+    and dropped when it is the only table written to. When values are chunked,
+    the chunks of hours that have ended are sealed in the same transaction.
+    Values that already exist in sealed chunks or archive files conflict with
+    new values just as rows do, and updating them writes rows that replace
+    them.
+
+    Args:
+      data: A list of topic values to be written.
+      on_conflict: How to handle values whose topic and timestamp already exist
+          in the database: ON_CONFLICT_ERROR, ON_CONFLICT_IGNORE or
+          ON_CONFLICT_UPDATE. Ignoring or updating conflicts makes it safe to
+          write the same data more than once.
+    """
+    if not data:
+      return
+
+    numbers = None
+    if self.storage_mode != STORAGE_LEGACY:
+      numbers = [(d, _to_number(d.value_string)) for d in data]
+      numbers = [(d, v) for d, v in numbers if v is not None]
+      if len(numbers) < len(data):
+        logging.warning('Not writing %d values that are not numbers to the '
+                        'typed_data table.', len(data) - len(numbers))
+        if self._model is db_model.TypedDatum:
+          data = [d for d, _ in numbers]
+          if not data:
+            return
+
+    statements = []
+    if self._model is db_model.TopicDatum:
+      statements.append((
+        self._insert_data_statement(on_conflict, db_model.TopicDatum),
+        [{'ts': d.ts, 'topic_id': d.topic_id, 'value_string': d.value_string}
+         for d in data]))
+
+    if self.storage_mode != STORAGE_LEGACY:
+      statements.append((
+        self._insert_data_statement(on_conflict, db_model.TypedDatum),
+        [{'ts': d.ts, 'topic_id': d.topic_id, 'value': v} for d, v in numbers]))
+
+    # Summarize the data written for each topic.
+    summary = {}
+    for d in data:
+      s = summary.get(d.topic_id)
+      if s is None:
+        summary[d.topic_id] = [d.ts, d.ts, 1]
+      else:
+        s[0] = min(s[0], d.ts)
+        s[1] = max(s[1], d.ts)
+        s[2] += 1
+
+    with self._write_engine.begin() as con:
+      con = con.execution_options(compiled_cache=self._compiled_cache)
+
+      # When conflicting rows are ignored or replaced, the number of new rows
+      # per topic is only known by counting them.
+      counts = None
+      if on_conflict != ON_CONFLICT_ERROR:
+        counts = self._count_data(con, summary)
+
+      # Cached results may include the times of values written behind the
+      # watermarks, so they are found before the watermarks move.
+      behind = []
+      if self.query_cache is not None:
+        watermarks = db_model.TopicWatermark.__table__
+        behind = [row.topic_id for row in con.execute(
+          sqlalchemy.select([watermarks.c.topic_id, watermarks.c.last_ts])
+          .where(watermarks.c.topic_id.in_(summary)))
+                  if summary[row.topic_id][0] <= row.last_ts]
+
+      # Rows do not conflict with the values of sealed chunks or archive files,
+      # so values that already exist there are found first, and rejected or
+      # skipped.
+      if not self._rows_only() and on_conflict != ON_CONFLICT_UPDATE:
+        cold = {v[:2] for stream in self._iter_cold_data(
+          con, summary, min(s[0] for s in summary.values()),
+          max(s[1] for s in summary.values())) for v in stream}
+        if on_conflict == ON_CONFLICT_ERROR:
+          conflicts = sum((d.ts, d.topic_id) in cold for d in data)
+          if conflicts:
+            raise sqlalchemy.exc.IntegrityError(None, None, ValueError(
+              '%d values already exist in chunks or archive files.'
+              % conflicts))
+        else:
+          statements = [(statement,
+                         [r for r in rows
+                          if (r['ts'], r['topic_id']) not in cold])
+                        for statement, rows in statements]
+
+      for statement, rows in statements:
+        if rows:
+          con.execute(statement, rows)
+
+      # When every value of the batch was new, nothing was ignored or
+      # replaced. When every value was ignored, nothing changed.
+      merge = True
+      changed = True
+      if counts is not None:
+        new_counts = self._count_data(con, summary)
+        for topic_id, s in summary.items():
+          count = new_counts.get(topic_id, 0) - counts.get(topic_id, 0)
+          merge = merge and count == s[2]
+          s[2] = count
+
+        changed = (on_conflict != ON_CONFLICT_IGNORE
+                   or any(s[2] for s in summary.values()))
+
+      if changed:
+        self._update_watermarks(con, summary)
+        self._update_rollups(con, data, summary, merge)
+
+      if self.storage_mode == STORAGE_CHUNKED:
+        with self._chunk_lock:
+          self._update_chunks(con, data)
+
+    if behind and changed:
+      self.query_cache.invalidate(behind)
+
+  def _update_rollups(self, con, data, summary, merge):
+    """Adds a batch of data to the rollups.
+
+    Args:
+      con: The connection on which to execute the statements.
+      data: A list of topic values that have been written.
+      summary: A dict from each topic ID in the batch to a list containing the
+          topic's earliest and latest timestamps in the batch.
+      merge: Whether every value was new, so that the values may be combined
+          with the rollups. Otherwise, values that were ignored or replaced
+          must not be added to the rollups again, so the buckets they fall in
+          are recomputed instead.
+    """
+    if merge:
+      rollups.merge(con, data)
+      return
+
+    start_dt = min(s[0] for s in summary.values())
+    end_dt = max(s[1] for s in summary.values())
+    if not self._rows_only():
+      values = self._read_values(
+        con, summary, rollups.MINUTE.floor(start_dt),
+        rollups.MINUTE.floor(end_dt) + rollups.MINUTE.width
+        - datetime.timedelta(microseconds=1))
+      rollups.rebuild_from_values(
+        con, ((topic_id, ts, v) for (ts, topic_id), v in values.items()),
+        start_dt, end_dt, summary)
+    else:
+      rollups.rebuild(con, start_dt, end_dt, summary, self._model.__table__)
+
+  def _update_chunks(self, con, data):
+    """Appends values to the open chunks, and seals chunks that have ended.
+
+    Args:
+      con: The connection on which to execute the statements.
+      data: A list of topic values that have been written to the typed_data
+          table.
+    """
+    ended = {}
+    for d in sorted(data, key=lambda d: (d.topic_id, d.ts)):
+      start_ts = chunks.window(d.ts)
+      chunk = self._open_chunks.get(d.topic_id)
+      if chunk is None or chunk.start_ts < start_ts:
+        if chunk is not None:
+          ended[(d.topic_id, chunk.start_ts)] = chunk
+
+        chunk = chunks.OpenChunk(start_ts)
+        self._open_chunks[d.topic_id] = chunk
+
+      if chunk.start_ts == start_ts:
+        chunk.append(d.ts, float(d.value_string))
+      else:
+        # The value belongs to an hour that has already ended.
+        ended.setdefault((d.topic_id, start_ts), None)
+
+    for (topic_id, start_ts), chunk in sorted(ended.items()):
+      chunks.seal(con, topic_id, start_ts, chunk)
+
+  def _read_values(self, con, topic_ids, start_dt, end_dt):
+    """Reads the values of the given topics and date range.
+
+    Unlike iter_data, the values are read on the given connection, so that
+    values written in its transaction are included.
+
+    Args:
+      con: The connection on which to execute the queries.
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+
+    Returns:
+      A dict from each (ts, topic_id) pair to its value. Rows and chunks
+      replace archived values with the same topic and timestamp.
+    """
+    values = {}
+    if self._archive is not None:
+      values.update((v[:2], v[2]) for v in self._archive.iter_data(
+        topic_ids, start_dt, end_dt))
+
+    if self.storage_mode == STORAGE_CHUNKED:
+      values.update(chunks.read_values(con, topic_ids, start_dt, end_dt))
+    else:
+      table = self._model.__table__
+      value = rollups.source_columns(self.engine.dialect.name,
+                                     table)['value_sum']
+      values.update(((row[0], row[1]), row[2]) for row in con.execute(
+        sqlalchemy.select([table.c.ts, table.c.topic_id, value])
+        .where(table.c.topic_id.in_(topic_ids))
+        .where(table.c.ts >= start_dt).where(table.c.ts <= end_dt)))
+
+    return values
+
+  def _count_data(self, con, summary):
+    """Counts the values within the time range of a batch for each topic.
+
+    Args:
+      con: The connection on which to execute the query.
+      summary: A dict from each topic ID in the batch to a list containing the
+          topic's earliest and latest timestamps in the batch.
+
+    Returns:
+      A dict from the topic ID to its number of values, including those of
+      chunks and archive files.
+    """
+    if not self._rows_only():
+      counts = {}
+      for _, topic_id in self._read_values(
+          con, summary, min(s[0] for s in summary.values()),
+          max(s[1] for s in summary.values())):
+        counts[topic_id] = counts.get(topic_id, 0) + 1
+
+      return counts
+
+    table = self._model.__table__
+    query = (sqlalchemy.select([table.c.topic_id, sqlalchemy.func.count()])
+             .where(table.c.topic_id.in_(summary))
+             .where(table.c.ts >= min(s[0] for s in summary.values()))
+             .where(table.c.ts <= max(s[1] for s in summary.values()))
+             .group_by(table.c.topic_id))
+    return dict(con.execute(query).fetchall())
+
+  @staticmethod
+  def _update_watermarks(con, summary):
+    """Extends topic watermarks to include a batch of data.
+
+    Args:
+      con: The connection on which to execute the statements.
+      summary: A dict from each topic ID in the batch to a list containing the
+          topic's earliest and latest timestamps, and its number of new rows.
+    """
+    insert, update = _watermark_statements()
+    con.execute(insert,
+                [{'topic_id': topic_id, 'first_ts': first_ts,
+                  'last_ts': last_ts, 'row_count': 0}
+                 for topic_id, (first_ts, last_ts, _) in summary.items()])
+    con.execute(update,
+                [{'b_topic_id': topic_id, 'b_first_ts': first,
+                  'b_last_ts': last, 'b_row_count': count}
+                 for topic_id, (first, last, count) in summary.items()])
+
+  def _insert_data_statement(self, on_conflict, model):
+    """Gets a statement that inserts rows into a data table.
+
+    Args:
+      on_conflict: How to handle rows that conflict with existing data.
+      model: The model of the table: TopicDatum or TypedDatum.
+
+    Returns:
+      An insert statement.
+    """
+    key = (on_conflict, model)
+    statement = self._insert_statements.get(key)
+    if statement is None:
+      statement = self._build_insert_data_statement(on_conflict, model)
+      self._insert_statements[key] = statement
+
+    return statement
+
+  def _build_insert_data_statement(self, on_conflict, model):
+    """Builds a statement that inserts rows into a data table."""
+    table = model.__table__
+    if on_conflict == ON_CONFLICT_ERROR:
+      return table.insert()
+
+    if on_conflict == ON_CONFLICT_IGNORE:
+      return (table.insert().prefix_with('IGNORE', dialect='mysql')
+              .prefix_with('OR IGNORE', dialect='sqlite'))
+
+    if on_conflict == ON_CONFLICT_UPDATE:
+      if self.db_type == 'sqlite':
+        return table.insert().prefix_with('OR REPLACE')
+
+      stmt = sqlalchemy.dialects.mysql.insert(table)
+      if model is db_model.TypedDatum:
+        return stmt.on_duplicate_key_update(value=stmt.inserted.value)
+
+      return stmt.on_duplicate_key_update(
+        value_string=stmt.inserted.value_string)
+
+    raise ValueError('Unknown conflict handling: %s.' % on_conflict)
@@ -0,0 +1,326 @@
+"""Database accessor unit tests."""
+
+import datetime
+import os
+import tempfile
+import unittest
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.orm
+from db import db_accessor, db_model, downsampling, testdb
+
+
+class DatabaseAccessorTestCase(unittest.TestCase):
+  """A test case for database accessor operations."""
+
+  def setUp(self):
+    """Creates a temporary database."""
+    _, self.db_file = tempfile.mkstemp()
+    self.engine = testdb.create_engine(self.db_file)
+    self.db_con = testdb.create_accessor(self.db_file)
+    self.start = datetime.datetime(2018, 1, 1)
+
+  def tearDown(self):
+    """Removes the temporary database file."""
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def read_data(self):
+    """Reads every row of the data table.
+
+    Returns:
+      A list of (ts, topic_id, value_string) tuples.
+    """
+    session = sqlalchemy.orm.Session(bind=self.engine)
+    try:
+      return sorted((d.ts, d.topic_id, d.value_string)
+                    for d in session.query(db_model.TopicDatum).all())
+    finally:
+      session.close()
+
+  def test_write_data(self):
+    """Tests that data is written in a single batch."""
+    data = testdb.new_data(self.start, self.start + datetime.timedelta(0, 9), 1,
+                           '1.5', datetime.timedelta(0, 1))
+    self.db_con.write_data(data)
+    self.db_con.write_data([])
+    actual = self.read_data()
+    self.assertEqual(10, len(actual))
+    self.assertEqual((self.start, 1, '1.5'), actual[0])
+
+  def test_write_data_conflicts(self):
+    """Tests each way of handling data that has already been written."""
+    datum = db_model.TopicDatum(self.start, 1, '1.5')
+    self.db_con.write_data([datum])
+    with self.assertRaises(sqlalchemy.exc.IntegrityError):
+      self.db_con.write_data([datum])
+
+    self.db_con.write_data([datum, db_model.TopicDatum(self.start, 2, '2.5')],
+                           on_conflict=db_accessor.ON_CONFLICT_IGNORE)
+    self.assertEqual([(self.start, 1, '1.5'), (self.start, 2, '2.5')],
+                     self.read_data())
+
+    self.db_con.write_data([datum], on_conflict=db_accessor.ON_CONFLICT_UPDATE)
+    self.assertEqual(2, len(self.read_data()))
+
+    with self.assertRaises(ValueError):
+      self.db_con.write_data([datum], on_conflict='retry')
+
+  def test_get_topic_ids(self):
+    """Tests that topics are created in a batch and cached."""
+    statements = []
+    sqlalchemy.event.listen(
+      self.db_con.engine, 'before_cursor_execute',
+      lambda con, cursor, statement, *args: statements.append(statement))
+
+    topic_ids = self.db_con.get_topic_ids(['UW/Elm/W', 'UW/Elm/freq'])
+    self.assertEqual(['UW/Elm/W', 'UW/Elm/freq'], sorted(topic_ids))
+    self.assertEqual(3, len(statements))
+    self.assertEqual(topic_ids, {t.topic_name: t.topic_id
+                                 for t in self.db_con.get_all_topics()})
+
+    # Known topics are resolved from the cache.
+    del statements[:]
+    self.assertEqual({'UW/Elm/W': topic_ids['UW/Elm/W']},
+                     self.db_con.get_topic_ids(['UW/Elm/W']))
+    self.assertEqual([], statements)
+
+    # Topics added by another process are found by an incremental refresh.
+    other = testdb.create_accessor(self.db_file)
+    other_ids = other.get_topic_ids(['UW/Elm/W', 'UW/Oak/W'])
+    self.assertEqual(topic_ids['UW/Elm/W'], other_ids['UW/Elm/W'])
+    self.assertEqual(other_ids['UW/Oak/W'],
+                     self.db_con.get_topic_ids(['UW/Oak/W'])['UW/Oak/W'])
+    self.assertEqual(3, len(self.db_con.get_all_topics()))
+
+  def test_data_timestamps(self):
+    """Tests that earliest and latest timestamps are found per topic."""
+    self.assertIsNone(self.db_con.get_earliest_data_timestamp())
+    self.assertIsNone(self.db_con.get_latest_data_timestamp([1]))
+
+    delta = datetime.timedelta(0, 1)
+    self.db_con.write_data(testdb.new_data(
+      self.start, self.start + 9 * delta, 1, '1.5', delta))
+    self.db_con.write_data(testdb.new_data(
+      self.start + 5 * delta, self.start + 19 * delta, 2, '2.5', delta))
+
+    self.assertEqual(self.start, self.db_con.get_earliest_data_timestamp())
+    self.assertEqual(self.start + 19 * delta,
+                     self.db_con.get_latest_data_timestamp())
+    self.assertEqual(self.start + 5 * delta,
+                     self.db_con.get_earliest_data_timestamp([2]))
+    self.assertEqual(self.start + 9 * delta,
+                     self.db_con.get_latest_data_timestamp([1]))
+
+  def test_topic_watermarks(self):
+    """Tests that watermarks are maintained as data is written."""
+    delta = datetime.timedelta(0, 1)
+    self.db_con.write_data(testdb.new_data(
+      self.start + 5 * delta, self.start + 9 * delta, 1, '1.5', delta))
+    self.db_con.write_data(testdb.new_data(
+      self.start, self.start + 4 * delta, 1, '1.5', delta)
+                           + [db_model.TopicDatum(self.start, 2, '2.5')])
+
+    # Rows that already exist are not counted again.
+    self.db_con.write_data(testdb.new_data(
+      self.start + 8 * delta, self.start + 11 * delta, 1, '1.5', delta),
+                           on_conflict=db_accessor.ON_CONFLICT_IGNORE)
+
+    expected = [(1, self.start, self.start + 11 * delta, 12),
+                (2, self.start, self.start, 1)]
+    actual = sorted((w.topic_id, w.first_ts, w.last_ts, w.row_count)
+                    for w in self.db_con.get_topic_watermarks())
+    self.assertEqual(expected, actual)
+    self.assertEqual(expected[1:], [
+      (w.topic_id, w.first_ts, w.last_ts, w.row_count)
+      for w in self.db_con.get_topic_watermarks([2])])
+
+    self.db_con.rebuild_topic_watermarks()
+    actual = sorted((w.topic_id, w.first_ts, w.last_ts, w.row_count)
+                    for w in self.db_con.get_topic_watermarks())
+    self.assertEqual(expected, actual)
+
+  def test_iter_data(self):
+    """Tests that data is streamed in order as plain tuples."""
+    delta = datetime.timedelta(0, 1)
+    end = self.start + 9 * delta
+    self.db_con.write_data(
+      testdb.new_data(self.start, end, 1, '1.5', delta)
+      + testdb.new_data(self.start, end, 2, '2.5', delta)
+      + testdb.new_data(self.start, end, 3, '3.5', delta))
+
+    rows = self.db_con.iter_data([1, 2], self.start + delta, end - delta,
+                                 fetch_size=3)
+    self.assertNotIsInstance(rows, list)
+    rows = list(rows)
+    self.assertEqual(16, len(rows))
+    self.assertEqual((self.start + delta, 1, '1.5'), rows[0])
+    self.assertEqual((self.start + delta, 2, '2.5'), rows[1])
+    self.assertEqual((end - delta, 2, '2.5'), rows[-1])
+    self.assertIs(tuple, type(rows[0]))
+
+    # A generator may be closed before it is exhausted.
+    rows = self.db_con.iter_data([1], self.start, end, fetch_size=2)
+    self.assertEqual((self.start, 1, '1.5'), next(rows))
+    rows.close()
+    self.assertRaises(StopIteration, next, rows)
+
+  def test_get_downsampled_data(self):
+    """Tests that values are aggregated into buckets aligned to the start."""
+    delta = datetime.timedelta(0, 1)
+    data = [db_model.TopicDatum(self.start + i * delta, 1, str(i))
+            for i in range(0, 10)]
+    data += [db_model.TopicDatum(self.start + i * delta, 2, str(-i))
+             for i in range(0, 10, 3)]
+    self.db_con.write_data(data)
+
+    actual = self.db_con.get_downsampled_data(
+      [1, 2], self.start + delta, self.start + 9 * delta, bucket_width=4)
+    self.assertEqual([
+      downsampling.Bucket(self.start + delta, 1, 4, 2.5, 1, 4, 1, 4),
+      downsampling.Bucket(self.start + 5 * delta, 1, 4, 6.5, 5, 8, 5, 8),
+      downsampling.Bucket(self.start + 9 * delta, 1, 1, 9, 9, 9, 9, 9),
+      downsampling.Bucket(self.start + delta, 2, 1, -3, -3, -3, -3, -3),
+      downsampling.Bucket(self.start + 5 * delta, 2, 1, -6, -6, -6, -6, -6),
+      downsampling.Bucket(self.start + 9 * delta, 2, 1, -9, -9, -9, -9, -9)
+    ], actual)
+
+    actual = self.db_con.get_downsampled_data(
+      [1], self.start, self.start + 9 * delta, points=2)
+    self.assertEqual([(self.start, 0, 4), (self.start + 5 * delta, 5, 9)],
+                     [(b.ts, b.first, b.last) for b in actual])
+
+    self.assertRaises(ValueError, self.db_con.get_downsampled_data, [1],
+                      self.start, self.start)
+    self.assertRaises(ValueError, self.db_con.get_downsampled_data, [1],
+                      self.start, self.start, 1, 1)
+
+  def test_get_downsampled_data_from_rollups(self):
+    """Tests that aligned buckets are computed from the coarsest rollup."""
+    minute = datetime.timedelta(minutes=1)
+    data = [db_model.TopicDatum(self.start + i * minute / 2, 1, str(i))
+            for i in range(0, 360)]
+    self.db_con.write_data(data)
+    end = self.start + 3 * 60 * minute
+    expected = self.db_con.get_downsampled_data([1], self.start, end,
+                                                bucket_width=3600)
+
+    # Rows deleted from the data table are still counted by the rollups.
+    with self.engine.begin() as con:
+      con.execute(db_model.TopicDatum.__table__.delete())
+
+    self.assertEqual(expected, self.db_con.get_downsampled_data(
+      [1], self.start, end, bucket_width=3600))
+    self.assertEqual([
+      downsampling.Bucket(self.start, 1, 120, 59.5, 0, 119, 0, 119),
+      downsampling.Bucket(self.start + 60 * minute, 1, 120, 179.5, 120, 239,
+                          120, 239),
+      downsampling.Bucket(self.start + 120 * minute, 1, 120, 299.5, 240, 359,
+                          240, 359)
+    ], expected)
+
+    # A number of points is rounded to a whole number of rollup buckets.
+    self.assertEqual([(self.start, 240), (self.start + 120 * minute, 120)],
+                     [(b.ts, b.count) for b in self.db_con.get_downsampled_data(
+                       [1], self.start, end, points=2)])
+    self.assertEqual([], self.db_con.get_downsampled_data(
+      [1], self.start + minute / 2, end, bucket_width=3600))
+
+  def test_get_lttb_data(self):
+    """Tests that the response size is bounded by the number of points."""
+    delta = datetime.timedelta(0, 1)
+    values = [0, 1, 0, 0, 9, 0, 0, -5, 0, 0, 1, 0] * 10
+    data = [db_model.TopicDatum(self.start + i * delta, t, str(v))
+            for i, v in enumerate(values) for t in (1, 2)]
+    self.db_con.write_data(data)
+
+    end = self.start + (len(values) - 1) * delta
+    actual = self.db_con.get_lttb_data([1, 2], self.start, end, 12)
+    self.assertEqual(24, len(actual))
+    self.assertEqual((self.start, 1, '0'), actual[0])
+    self.assertEqual((end, 1, '0'), actual[11])
+    self.assertEqual((self.start, 2, '0'), actual[12])
+    self.assertEqual({'9', '-5'}, {row[2] for row in actual[1:11]})
+    self.assertRaises(ValueError, self.db_con.get_lttb_data, [1], self.start,
+                      end, 2)
+
+  def test_typed_storage(self):
+    """Tests moving from the data table to the typed_data table."""
+    delta = datetime.timedelta(0, 1)
+    self.db_con.write_data(testdb.new_data(
+      self.start, self.start + 4 * delta, 1, '1.5', delta))
+
+    dual = testdb.create_accessor(self.db_file, db_accessor.STORAGE_DUAL)
+    dual.write_data(testdb.new_data(
+      self.start + 5 * delta, self.start + 9 * delta, 1, '2.5', delta))
+    self.assertEqual(10, len(self.read_data()))
+    self.assertEqual(10, len(dual.get_data([1], self.start,
+                                           self.start + 9 * delta, 1)))
+
+    with self.engine.begin() as con:
+      self.assertEqual(5, db_accessor.copy_typed_data(
+        con, self.start, self.start + 9 * delta))
+
+    typed = testdb.create_accessor(self.db_file, db_accessor.STORAGE_TYPED)
+    typed.write_data([db_model.TopicDatum(self.start + 10 * delta, 1, '3')])
+    self.assertEqual(10, len(self.read_data()))
+
+    actual = typed.get_data([1], self.start, self.start + 10 * delta, 1)
+    self.assertEqual(11, len(actual))
+    self.assertIsInstance(actual[0], db_model.TypedDatum)
+    self.assertEqual({'1.5', '2.5', '3.0'}, {d.value_string for d in actual})
+    self.assertEqual((self.start + 10 * delta, 1, 3.0),
+                     list(typed.iter_data([1], self.start,
+                                          self.start + 10 * delta))[-1])
+
+    actual = typed.get_downsampled_data([1], self.start,
+                                        self.start + 9 * delta, points=1)
+    self.assertEqual([downsampling.Bucket(self.start, 1, 10, 2, 1.5, 2.5, 1.5,
+                                          2.5)], actual)
+    self.assertEqual(
+      [(1, self.start, self.start + 10 * delta, 11)],
+      [(w.topic_id, w.first_ts, w.last_ts, w.row_count)
+       for w in typed.get_topic_watermarks()])
+
+    with self.assertRaises(ValueError):
+      testdb.create_accessor(self.db_file, 'text')
+
+  def test_typed_data_timestamps(self):
+    """Tests that typed_data is not scanned for the range of every topic."""
+    typed = testdb.create_accessor(self.db_file, db_accessor.STORAGE_TYPED)
+    delta = datetime.timedelta(0, 1)
+    typed.write_data(testdb.new_data(
+      self.start, self.start + 9 * delta, 1, '1.5', delta))
+
+    statements = []
+    sqlalchemy.event.listen(
+      typed.engine, 'before_cursor_execute',
+      lambda *args: statements.append(args[2]))
+    self.assertEqual(self.start, typed.get_earliest_data_timestamp())
+    self.assertEqual(self.start + 9 * delta, typed.get_latest_data_timestamp())
+    self.assertEqual(2, len(statements))
+    self.assertFalse([s for s in statements if 'typed_data' in s])
+
+  def test_non_numeric_values(self):
+    """Tests that values which are not numbers are kept out of typed_data."""
+    data = [db_model.TopicDatum(self.start, 1, '1.5'),
+            db_model.TopicDatum(self.start, 2, 'on')]
+    dual = testdb.create_accessor(self.db_file, db_accessor.STORAGE_DUAL)
+    with self.assertLogs(level='WARNING'):
+      dual.write_data(data)
+    self.assertEqual([(self.start, 1, '1.5'), (self.start, 2, 'on')],
+                     self.read_data())
+    typed = testdb.create_accessor(self.db_file, db_accessor.STORAGE_TYPED)
+    self.assertEqual([(self.start, 1, 1.5)], list(typed.iter_data(
+      [1, 2], self.start, self.start)))
+
+    with self.assertLogs(level='WARNING'):
+      typed.write_data([db_model.TopicDatum(self.start, 3, 'off')])
+    self.assertEqual([1, 2], sorted(w.topic_id
+                                    for w in typed.get_topic_watermarks()))
+
+
+if __name__ == '__main__':
+  unittest.main()
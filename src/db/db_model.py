@@ -7,14 +7,25 @@ implemented by the VOLTTRON platform, which defines the following structures:
   * Metadata: A map containing topic information (e.g. units or timezone).
 
 A process (the collector) periodically queries a solar panel for its topic data
-and writes it to the "data" table by creating a TopicDatum object.
+and writes it to the "data" table by creating a TopicDatum object. The
+"typed_data" table stores the same values as numbers, and is replacing the
+"data" table (see TypedDatum). Values of past hours may be compressed into the
+"data_chunks" table (see DataChunk). A summary of each topic's data is
+maintained in the "topic_watermarks" table, and aggregates of each topic's
+values per minute, hour and day are maintained in the "data_1m", "data_1h" and
+"data_1d" rollup tables.
 """
 
-from sqlalchemy import Column, DateTime, Integer, String, Text
+from sqlalchemy import (BigInteger, Column, DateTime, Float, Index, Integer,
+                        LargeBinary, String, Text)
+from sqlalchemy.dialects import mysql
 from sqlalchemy.ext.declarative import declarative_base
 
 BASE = declarative_base()
 
+# A double precision number. MySQL's FLOAT is single precision.
+DOUBLE = Float().with_variant(mysql.DOUBLE, 'mysql')
+
 
 class Metadata(BASE):
   """An object containing JSON-encoded metadata for a particular Topic.
@@ -51,7 +62,7 @@ class Topic(BASE):
   """
   __tablename__ = 'topics'
   topic_id = Column(Integer, primary_key=True)
-  topic_name = Column(String(512))
+  topic_name = Column(String(512), nullable=False, unique=True)
 
   def __init__(self, topic_id, topic_name):
     """Creates a new topic.
@@ -65,8 +76,15 @@ class Topic(BASE):
 
 
 class TopicDatum(BASE):
-  """An object containing the value for a given topic at a particular time."""
+  """An object containing the value for a given topic at a particular time.
+
+  Values are indexed by topic and then time, so that the values of a topic
+  over a range of time are read from one slice of the index, and by time alone
+  for queries over every topic.
+  """
   __tablename__ = 'data'
+  __table_args__ = (Index('topic_id_ts_idx', 'topic_id', 'ts', unique=True),
+                    Index('data_idx', 'ts'))
   ts = Column(DateTime, primary_key=True)
   topic_id = Column(Integer, primary_key=True)
   value_string = Column(Text, primary_key=True)
@@ -82,3 +100,129 @@ class TopicDatum(BASE):
     self.ts = ts
     self.topic_id = topic_id
     self.value_string = value_string
+
+
+class TypedDatum(BASE):
+  """An object containing the numeric value of a topic at a particular time.
+
+  Unlike TopicDatum, values are stored as floating point numbers and keyed by
+  topic and then time, which makes rows and indexes much smaller and allows
+  values to be aggregated without casts. The value_string property allows a
+  TypedDatum to be read in place of a TopicDatum.
+  """
+  __tablename__ = 'typed_data'
+  topic_id = Column(Integer, primary_key=True, autoincrement=False)
+  ts = Column(DateTime, primary_key=True)
+  value = Column(DOUBLE, nullable=False)
+
+  def __init__(self, ts, topic_id, value):
+    """Creates a new typed datum object.
+
+    Args:
+      ts: The timestamp.
+      topic_id: The topic ID.
+      value: The value, as a number.
+    """
+    self.ts = ts
+    self.topic_id = topic_id
+    self.value = value
+
+  @property
+  def value_string(self):
+    """The value, formatted as a string."""
+    return str(self.value)
+
+
+class DataChunk(BASE):
+  """An object containing the compressed values of a topic within an hour.
+
+  Values are encoded by db/gorilla.py, with timestamps in microseconds since the
+  Unix epoch. start_ts is the start of the hour, and first_ts and last_ts are
+  the timestamps of the earliest and latest values in the chunk.
+  """
+  __tablename__ = 'data_chunks'
+  topic_id = Column(Integer, primary_key=True, autoincrement=False)
+  start_ts = Column(DateTime, primary_key=True)
+  first_ts = Column(DateTime, nullable=False)
+  last_ts = Column(DateTime, nullable=False)
+  point_count = Column(Integer, nullable=False)
+  data = Column(LargeBinary, nullable=False)
+
+  def __init__(self, topic_id, start_ts, first_ts, last_ts, point_count,
+               data):
+    """Creates a new chunk object.
+
+    Args:
+      topic_id: The topic ID.
+      start_ts: The start of the hour.
+      first_ts: The timestamp of the earliest value.
+      last_ts: The timestamp of the latest value.
+      point_count: The number of values.
+      data: The encoded values.
+    """
+    self.topic_id = topic_id
+    self.start_ts = start_ts
+    self.first_ts = first_ts
+    self.last_ts = last_ts
+    self.point_count = point_count
+    self.data = data
+
+
+class TopicWatermark(BASE):
+  """An object summarizing the data that has been written for a topic.
+
+  Watermarks are updated whenever data is written, so that the range and size
+  of a topic's data can be found without scanning the data table.
+  """
+  __tablename__ = 'topic_watermarks'
+  topic_id = Column(Integer, primary_key=True, autoincrement=False)
+  first_ts = Column(DateTime, nullable=False)
+  last_ts = Column(DateTime, nullable=False)
+  row_count = Column(BigInteger, nullable=False)
+
+  def __init__(self, topic_id, first_ts, last_ts, row_count):
+    """Creates a new watermark object.
+
+    Args:
+      topic_id: The topic ID.
+      first_ts: The timestamp of the topic's earliest datum.
+      last_ts: The timestamp of the topic's latest datum.
+      row_count: The number of data for the topic.
+    """
+    self.topic_id = topic_id
+    self.first_ts = first_ts
+    self.last_ts = last_ts
+    self.row_count = row_count
+
+
+class RollupMixin:
+  """Columns containing the aggregates of a topic's values within a bucket.
+
+  ts is the start of the bucket, and first_value and last_value are the values
+  with the earliest and latest timestamps (first_ts and last_ts) in the bucket.
+  """
+  topic_id = Column(Integer, primary_key=True, autoincrement=False)
+  ts = Column(DateTime, primary_key=True)
+  row_count = Column(BigInteger, nullable=False)
+  value_sum = Column(DOUBLE, nullable=False)
+  value_min = Column(DOUBLE, nullable=False)
+  value_max = Column(DOUBLE, nullable=False)
+  first_ts = Column(DateTime, nullable=False)
+  first_value = Column(DOUBLE, nullable=False)
+  last_ts = Column(DateTime, nullable=False)
+  last_value = Column(DOUBLE, nullable=False)
+
+
+class MinuteRollup(RollupMixin, BASE):
+  """The aggregates of a topic's values within a minute."""
+  __tablename__ = 'data_1m'
+
+
+class HourRollup(RollupMixin, BASE):
+  """The aggregates of a topic's values within an hour."""
+  __tablename__ = 'data_1h'
+
+
+class DayRollup(RollupMixin, BASE):
+  """The aggregates of a topic's values within a day."""
+  __tablename__ = 'data_1d'
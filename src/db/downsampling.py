@@ -0,0 +1,109 @@
+"""Reduces time-series data to a bounded number of points.
+
+Random sampling still reads every row in a range, returns different results on
+every call, and readily drops the peaks that matter most on a chart. Instead,
+a range is divided into fixed-width time buckets that are aligned to its start.
+Either each bucket is summarized by aggregates computed in the database, or one
+representative point is chosen from each bucket using the
+largest-triangle-three-buckets (LTTB) algorithm, which preserves the visual
+shape of the series.
+"""
+
+import dataclasses
+import datetime
+import math
+
+
+# The aggregates of the values of a topic within a time bucket. ts is the start
+# of the bucket, and first and last are the values with the earliest and latest
+# timestamps in the bucket.
+@dataclasses.dataclass(frozen=True)
+class Bucket:
+  ts: datetime.datetime
+  topic_id: int
+  count: int
+  avg: float
+  min: float
+  max: float
+  first: float
+  last: float
+
+
+def bucket_width(start_dt, end_dt, points):
+  """Finds a bucket width that divides a range into a number of buckets.
+
+  Args:
+    start_dt: The start datetime.
+    end_dt: The end datetime.
+    points: The largest number of buckets.
+
+  Returns:
+    The bucket width in whole seconds, at least one. The end of the range is
+    inclusive, so the last whole second of the range always falls within the
+    last bucket.
+  """
+  if points < 1:
+    raise ValueError('The number of points must be positive.')
+
+  return math.floor((end_dt - start_dt).total_seconds()) // points + 1
+
+
+def triangle_area(a, b, c):
+  """Computes the area of the triangle formed by three (x, y) points."""
+  return abs((a[0] - c[0]) * (b[1] - a[1]) - (a[0] - b[0]) * (c[1] - a[1])) / 2
+
+
+def lttb(series, averages):
+  """Selects the visually significant points of a series using LTTB.
+
+  The first and last points of the series are always selected. From each
+  bucket, the point that forms the largest triangle with the point selected
+  from the previous bucket and the average of the next bucket is selected. The
+  series is consumed one point at a time, so it may be streamed from the
+  database.
+
+  Args:
+    series: An iterable of (bucket, x, y, item) tuples for a single series,
+        ordered by x.
+    averages: A dict from each bucket of the series to the (x, y) average of
+        its points.
+
+  Returns:
+    A list of the items of the selected points, ordered by x.
+  """
+  buckets = sorted(averages)
+  following = dict(zip(buckets, buckets[1:]))
+
+  selected = []
+  previous = None
+  current = None
+  average = None
+  best = None
+  last = None
+  for bucket, x, y, item in series:
+    last = (x, y, item)
+    if previous is None:
+      selected.append(item)
+      previous = (x, y)
+      continue
+
+    if bucket != current:
+      if best is not None:
+        selected.append(best[3])
+        previous = (best[1], best[2])
+
+      current = bucket
+      best = None
+      average = averages.get(following.get(bucket, bucket), (x, y))
+
+    area = triangle_area(previous, (x, y), average)
+    if best is None or area > best[0]:
+      best = (area, x, y, item)
+
+  if best is not None and best[3] is not last[2]:
+    selected.append(best[3])
+
+  if last is not None and selected[-1] is not last[2]:
+    selected.append(last[2])
+
+  return selected
@@ -0,0 +1,45 @@
+"""Unit tests for the downsampling module."""
+
+import datetime
+import unittest
+from db import downsampling
+
+
+class DownsamplingTestCase(unittest.TestCase):
+  """Unit tests for the downsampling module."""
+
+  def test_bucket_width(self):
+    """Tests that a range is divided into whole-second buckets."""
+    start = datetime.datetime(2018, 1, 1)
+    self.assertEqual(
+      11, downsampling.bucket_width(start, start + datetime.timedelta(0, 100),
+                                    10))
+    self.assertEqual(
+      34, downsampling.bucket_width(start, start + datetime.timedelta(0, 100),
+                                    3))
+    self.assertEqual(1, downsampling.bucket_width(start, start, 10))
+    self.assertRaises(ValueError, downsampling.bucket_width, start, start, 0)
+
+  def test_triangle_area(self):
+    """Tests the area of a triangle."""
+    self.assertEqual(2, downsampling.triangle_area((0, 0), (2, 2), (2, 0)))
+    self.assertEqual(0, downsampling.triangle_area((0, 0), (1, 1), (2, 2)))
+
+  def test_lttb(self):
+    """Tests that the first, last and most significant points are selected."""
+    ys = [0, 1, 0, 0, 9, 0, 0, -5, 0, 0, 1, 0]
+    series = [(x // 4, x, y, (x, y)) for x, y in enumerate(ys)]
+    averages = {0: (1.5, 0.25), 1: (5.5, 2.25), 2: (9.5, 0.25)}
+    self.assertEqual([(0, 0), (3, 0), (4, 9), (8, 0), (11, 0)],
+                     downsampling.lttb(iter(series), averages))
+
+  def test_lttb_short_series(self):
+    """Tests series with too few points to reduce."""
+    self.assertEqual([], downsampling.lttb([], {}))
+    self.assertEqual(['a'], downsampling.lttb([(0, 0, 1, 'a')], {0: (0, 1)}))
+    self.assertEqual(['a', 'b'], downsampling.lttb(
+      [(0, 0, 1, 'a'), (0, 1, 2, 'b')], {0: (0.5, 1.5)}))
+
+
+if __name__ == '__main__':
+  unittest.main()
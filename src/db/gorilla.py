@@ -0,0 +1,243 @@
+"""Compresses time series with the encoding of Facebook's Gorilla database.
+
+A series of (timestamp, value) points is packed into a bit stream, where
+timestamps are integers (e.g. microseconds) and values are floating point
+numbers:
+
+  * Each timestamp is encoded as the difference between its delta from the
+    previous timestamp and the previous delta. Regularly spaced timestamps have
+    a delta-of-delta of zero, which is encoded in a single bit.
+  * Each value is XORed with the previous value. Slowly changing values share
+    their sign, exponent and leading mantissa bits, so only the bits between
+    the XOR's leading and trailing zeros are written, and the position of
+    those bits is reused from the previous value where possible.
+
+The stream begins with the number of points, as a 32-bit integer, followed by
+the first timestamp and value in full.
+"""
+
+import struct
+
+# The prefix and signed width of each delta-of-delta range, from the smallest.
+# A delta-of-delta of zero is encoded as a single 0 bit.
+_DOD_RANGES = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12),
+               (0b11110, 5, 32), (0b11111, 5, 64))
+
+
+def _float_bits(value):
+  """Reinterprets a floating point number as a 64-bit integer."""
+  return struct.unpack('>Q', struct.pack('>d', value))[0]
+
+
+def _bits_float(bits):
+  """Reinterprets a 64-bit integer as a floating point number."""
+  return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+class BitWriter:
+  """Writes values of any width to a bit stream."""
+
+  def __init__(self):
+    """Creates an empty bit stream."""
+    self._bytes = bytearray()
+    self._acc = 0
+    self._bits = 0
+
+  def write(self, value, width):
+    """Appends the low bits of a non-negative integer to the stream.
+
+    Args:
+      value: The integer.
+      width: The number of bits to write.
+    """
+    self._acc = (self._acc << width) | (value & ((1 << width) - 1))
+    self._bits += width
+    if self._bits >= 64:
+      extra = self._bits % 8
+      self._bytes += (self._acc >> extra).to_bytes(self._bits // 8, 'big')
+      self._acc &= (1 << extra) - 1
+      self._bits = extra
+
+  def to_bytes(self):
+    """Returns the stream, padded with zero bits to a whole number of bytes."""
+    pad = -self._bits % 8
+    return bytes(self._bytes) + (self._acc << pad).to_bytes(
+      (self._bits + pad) // 8, 'big')
+
+
+class BitReader:
+  """Reads values of any width from a bit stream."""
+
+  def __init__(self, data, offset=0):
+    """Creates a reader.
+
+    Args:
+      data: The bytes of the stream.
+      offset: The number of bytes to skip.
+    """
+    self._data = data
+    self._pos = offset
+    self._buffer = 0
+    self._bits = 0
+
+  def read(self, width):
+    """Reads a non-negative integer of up to 64 bits from the stream."""
+    while self._bits < width:
+      if self._pos >= len(self._data):
+        raise ValueError('The bit stream is truncated.')
+
+      # Bytes are buffered eight at a time, so that reads shift small integers.
+      chunk = self._data[self._pos:self._pos + 8]
+      self._buffer = (self._buffer << (8 * len(chunk))) | int.from_bytes(
+        chunk, 'big')
+      self._bits += 8 * len(chunk)
+      self._pos += 8
+
+    self._bits -= width
+    value = self._buffer >> self._bits
+    self._buffer &= (1 << self._bits) - 1
+    return value
+
+  def read_signed(self, width):
+    """Reads a two's complement integer from the stream."""
+    value = self.read(width)
+    return value - (1 << width) if value >> (width - 1) else value
+
+  def read_ones(self, limit):
+    """Counts the 1 bits before the next 0 bit, reading at most limit bits."""
+    count = 0
+    while count < limit and self.read(1):
+      count += 1
+
+    return count
+
+
+class Encoder:
+  """Incrementally encodes a series of points.
+
+  Points must be appended in increasing timestamp order.
+  """
+
+  def __init__(self):
+    """Creates an encoder for an empty series."""
+    self.count = 0
+    self.first_timestamp = None
+    self.last_timestamp = None
+    self._writer = BitWriter()
+    self._delta = 0
+    self._value = 0
+    self._leading = None
+    self._trailing = None
+
+  def append(self, timestamp, value):
+    """Appends a point to the series.
+
+    Args:
+      timestamp: The timestamp, as an integer.
+      value: The value, as a floating point number.
+    """
+    bits = _float_bits(value)
+    if self.count == 0:
+      self._writer.write(timestamp, 64)
+      self._writer.write(bits, 64)
+      self.first_timestamp = timestamp
+    else:
+      if timestamp <= self.last_timestamp:
+        raise ValueError('Timestamps must increase.')
+
+      delta = timestamp - self.last_timestamp
+      self._write_dod(delta - self._delta)
+      self._write_xor(bits ^ self._value)
+      self._delta = delta
+
+    self.count += 1
+    self.last_timestamp = timestamp
+    self._value = bits
+
+  def _write_dod(self, dod):
+    """Writes a timestamp's delta-of-delta."""
+    if dod == 0:
+      self._writer.write(0, 1)
+      return
+
+    for prefix, prefix_width, width in _DOD_RANGES:
+      if -(1 << (width - 1)) <= dod < (1 << (width - 1)):
+        self._writer.write(prefix, prefix_width)
+        self._writer.write(dod, width)
+        return
+
+    raise ValueError('The timestamp is out of range.')
+
+  def _write_xor(self, xor):
+    """Writes the XOR of a value with the previous value."""
+    if xor == 0:
+      self._writer.write(0, 1)
+      return
+
+    leading = min(64 - xor.bit_length(), 31)
+    trailing = (xor & -xor).bit_length() - 1
+    if (self._leading is not None and leading >= self._leading
+        and trailing >= self._trailing):
+      self._writer.write(0b10, 2)
+      self._writer.write(xor >> self._trailing,
+                         64 - self._leading - self._trailing)
+      return
+
+    significant = 64 - leading - trailing
+    self._writer.write(0b11, 2)
+    self._writer.write(leading, 5)
+    self._writer.write(significant - 1, 6)
+    self._writer.write(xor >> trailing, significant)
+    self._leading = leading
+    self._trailing = trailing
+
+  def to_bytes(self):
+    """Returns the encoded series."""
+    return struct.pack('>I', self.count) + self._writer.to_bytes()
+
+
+def encode(points):
+  """Encodes a series of (timestamp, value) points, ordered by timestamp."""
+  encoder = Encoder()
+  for timestamp, value in points:
+    encoder.append(timestamp, value)
+
+  return encoder.to_bytes()
+
+
+def decode(data):
+  """Decodes a series of points.
+
+  Args:
+    data: The bytes returned by encode or Encoder.to_bytes.
+
+  Yields:
+    (timestamp, value) tuples, ordered by timestamp.
+  """
+  count = struct.unpack_from('>I', data)[0]
+  if count == 0:
+    return
+
+  reader = BitReader(data, 4)
+  timestamp = reader.read_signed(64)
+  bits = reader.read(64)
+  yield timestamp, _bits_float(bits)
+
+  delta = 0
+  leading = 0
+  trailing = 0
+  for _ in range(1, count):
+    ones = reader.read_ones(len(_DOD_RANGES))
+    if ones:
+      delta += reader.read_signed(_DOD_RANGES[ones - 1][2])
+
+    timestamp += delta
+    if reader.read(1):
+      if reader.read(1):
+        leading = reader.read(5)
+        significant = reader.read(6) + 1
+        trailing = 64 - leading - significant
+
+      bits ^= reader.read(64 - leading - trailing) << trailing
+
+    yield timestamp, _bits_float(bits)
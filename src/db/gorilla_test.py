@@ -0,0 +1,57 @@
+"""Unit tests for the gorilla module."""
+
+import math
+import random
+import unittest
+from db import gorilla
+
+
+class GorillaTestCase(unittest.TestCase):
+  """Unit tests for the gorilla module."""
+
+  def test_round_trip(self):
+    """Tests that points are decoded exactly as they were encoded."""
+    rng = random.Random(1)
+    points = []
+    timestamp = 1514764800000000
+    value = 120.0
+    for _ in range(1000):
+      timestamp += rng.choice([1000000, 1000000, rng.randint(1, 10 ** 12)])
+      value = rng.choice([value, value + 0.25, rng.uniform(-1e9, 1e9)])
+      points.append((timestamp, value))
+
+    points += [(timestamp + 1, -0.0), (timestamp + 2, 1e308),
+               (timestamp + 3, 5e-324)]
+    self.assertEqual(points, list(gorilla.decode(gorilla.encode(points))))
+
+    decoded = list(gorilla.decode(gorilla.encode([(-1, math.nan)])))
+    self.assertEqual(-1, decoded[0][0])
+    self.assertTrue(math.isnan(decoded[0][1]))
+    self.assertEqual([], list(gorilla.decode(gorilla.encode([]))))
+
+  def test_compression(self):
+    """Tests that regular, constant series need two bits per point."""
+    points = [(i * 1000000, 1.5) for i in range(1, 3601)]
+    data = gorilla.encode(points)
+
+    # The count and first point, the first delta in 32 bits, and then one bit
+    # for each timestamp and value.
+    self.assertEqual(4 + 16 + math.ceil((5 + 32 + 1 + 2 * 3598) / 8),
+                     len(data))
+
+  def test_encoder(self):
+    """Tests that points must be appended in timestamp order."""
+    encoder = gorilla.Encoder()
+    encoder.append(10, 1.0)
+    encoder.append(20, 2.0)
+    self.assertRaises(ValueError, encoder.append, 20, 3.0)
+    self.assertEqual((2, 10, 20), (encoder.count, encoder.first_timestamp,
+                                   encoder.last_timestamp))
+    self.assertEqual([(10, 1.0), (20, 2.0)],
+                     list(gorilla.decode(encoder.to_bytes())))
+    self.assertRaises(ValueError, list,
+                      gorilla.decode(encoder.to_bytes()[:-3]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,119 @@
+"""A program that creates and drops the monthly partitions of the data table.
+
+The data table is partitioned by month on MySQL (see db/partitions.py). This
+program should be run regularly (e.g. daily by cron) to create the partitions
+of the coming months before values are written to them and, if --retention is
+given, to delete the values of expired months by dropping their partitions.
+
+    $ PYTHONPATH=. python db/maintain_partitions.py \
+          --db_type=mysql+mysqlconnector --db_host=localhost --retention=24
+
+Dropping a partition does not read its rows. Topic watermarks are updated from
+the per-day rollups, which keep the aggregates of deleted values.
+"""
+
+import argparse
+import datetime
+import logging
+from db import db_accessor, partitions
+
+DEFAULT_DB_TYPE = 'mysql+mysqlconnector'
+DEFAULT_DB_USER = 'uwsolar'
+DEFAULT_DB_PASSWORD = ''
+DEFAULT_DB_HOST = 'localhost'
+DEFAULT_DB_NAME = 'uwsolar'
+DEFAULT_DB_STORAGE_MODE = db_accessor.STORAGE_LEGACY
+DEFAULT_MONTHS_AHEAD = 3
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--log_level', default='INFO',
+                      help='The logging threshold.')
+
+  # Database connectivity arguments.
+  db_group = parser.add_argument_group(
+    'database', 'Database connectivity arguments.')
+  db_group.add_argument(
+    '--db_type', choices=['mysql+mysqlconnector'], default=DEFAULT_DB_TYPE,
+    help='Which database type should be used.')
+  db_group.add_argument(
+    '--db_user', default=DEFAULT_DB_USER, help='The database user.')
+  db_group.add_argument(
+    '--db_password', default=DEFAULT_DB_PASSWORD, help='The database password.')
+  db_group.add_argument(
+    '--db_host', default=DEFAULT_DB_HOST, help='The database host.')
+  db_group.add_argument(
+    '--db_name', default=DEFAULT_DB_NAME, help='The database name.')
+  db_group.add_argument(
+    '--db_storage_mode', choices=db_accessor.STORAGE_MODES,
+    default=DEFAULT_DB_STORAGE_MODE,
+    help='Which tables the collector stores values in. Topic watermarks are '
+         'only updated when values are stored in the data table.')
+
+  # Partition arguments.
+  partition_group = parser.add_argument_group(
+    'partition', 'Partition maintenance arguments.')
+  partition_group.add_argument(
+    '--months_ahead', type=int, default=DEFAULT_MONTHS_AHEAD,
+    help='The number of months after the current month that should have '
+         'partitions.')
+  partition_group.add_argument(
+    '--retention', type=int,
+    help='The number of months of values to keep, including the current '
+         'month. By default, values are kept forever.')
+
+  return parser.parse_args()
+
+
+def maintain(con, now, months_ahead, retention=None, watermarks=True):
+  """Creates future partitions and drops expired ones.
+
+  Args:
+    con: A connection to a MySQL database.
+    now: The current time.
+    months_ahead: The number of months after the current month that should
+        have partitions.
+    retention: The number of months of values to keep, including the current
+        month, or None to keep every value.
+    watermarks: Whether topic watermarks should be updated.
+
+  Returns:
+    A (created, dropped) pair of lists of partition names.
+  """
+  month = partitions.month_floor(now)
+  created = partitions.create_partitions(
+    con, partitions.add_months(month, months_ahead))
+  dropped = []
+  if retention is not None:
+    dropped = partitions.drop_partitions(
+      con, partitions.add_months(month, 1 - max(1, retention)), watermarks)
+
+  return created, dropped
+
+
+def main():
+  """Parses command line arguments and maintains partitions."""
+  args = parse_arguments()
+  logging.basicConfig(level=logging.getLevelName(args.log_level))
+
+  db_opts = db_accessor.DatabaseOptions(
+    args.db_type, args.db_user, args.db_password, args.db_host, args.db_name, 1)
+  db_con = db_accessor.DatabaseAccessor(db_opts)
+  with db_con.engine.connect() as con:
+    created, dropped = maintain(
+      con, datetime.datetime.now(), args.months_ahead, args.retention,
+      args.db_storage_mode in (db_accessor.STORAGE_LEGACY,
+                               db_accessor.STORAGE_DUAL))
+
+  logging.info('Created partitions: %s', ', '.join(created) or 'none')
+  logging.info('Dropped partitions: %s', ', '.join(dropped) or 'none')
+
+
+if __name__ == '__main__':
+  main()
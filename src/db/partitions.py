@@ -0,0 +1,203 @@
+"""Maintains the monthly partitions of the data table on MySQL.
+
+On MySQL, the data table is partitioned by range on UNIX_TIMESTAMP(ts), with one
+partition per calendar month named after it (e.g. p201801), followed by a pmax
+partition that holds any values beyond the last month. Queries over a range of
+time only read the partitions that overlap the range, and a month of data is
+deleted by dropping its partition rather than row by row.
+
+Partitions for future months must be created before values are written to
+them, by splitting the (normally empty) pmax partition. Month boundaries are
+computed by MySQL in the session time zone, which should be the same every time
+partitions are created.
+"""
+
+import datetime
+import sqlalchemy
+from db import db_model, rollups
+
+# The name of the partitioned table.
+TABLE = 'data'
+
+# The name of the partition that holds values beyond the last month.
+MAXVALUE_PARTITION = 'pmax'
+
+
+def month_floor(ts):
+  """Finds the start of the month containing a time."""
+  return datetime.datetime(ts.year, ts.month, 1)
+
+
+def add_months(month, months):
+  """Finds the start of a month relative to another.
+
+  Args:
+    month: The start of a month.
+    months: The number of months to add, which may be negative.
+
+  Returns:
+    The start of the month.
+  """
+  index = month.year * 12 + month.month - 1 + months
+  return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+  """Names the partition that holds the values of a month."""
+  return 'p%04d%02d' % (month.year, month.month)
+
+
+def partition_month(name):
+  """Finds the month whose values a partition holds.
+
+  Args:
+    name: The partition name.
+
+  Returns:
+    The start of the month, or None if the partition does not hold the values
+    of a month.
+  """
+  try:
+    return datetime.datetime.strptime(name, 'p%Y%m')
+  except ValueError:
+    return None
+
+
+def partition_definition(month):
+  """Builds the definition of the partition that holds the values of a month."""
+  return "PARTITION %s VALUES LESS THAN (UNIX_TIMESTAMP('%s'))" % (
+    partition_name(month), add_months(month, 1))
+
+
+def partition_definitions(months):
+  """Builds the definitions of the partitions of a table.
+
+  Args:
+    months: The months whose partitions should be defined, in order.
+
+  Returns:
+    A comma-separated list of partition definitions, ending with the pmax
+    partition.
+  """
+  return ', '.join(
+    [partition_definition(m) for m in months]
+    + ['PARTITION %s VALUES LESS THAN MAXVALUE' % MAXVALUE_PARTITION])
+
+
+def _check_dialect(con):
+  """Raises a ValueError if a connection is not to a MySQL database."""
+  if con.dialect.name != 'mysql':
+    raise ValueError('Partitioning is only supported on MySQL.')
+
+
+def get_partitions(con):
+  """Finds the monthly partitions of the data table.
+
+  Args:
+    con: A connection to a MySQL database.
+
+  Returns:
+    A list of the months that have partitions, in order.
+  """
+  _check_dialect(con)
+  rows = con.execute(sqlalchemy.text(
+    'select partition_name from information_schema.partitions '
+    'where table_schema = database() and table_name = :table '
+    'and partition_name is not null order by partition_ordinal_position'),
+                     table=TABLE)
+  return [m for m in (partition_month(row[0]) for row in rows) if m]
+
+
+def _get_partitions_or_raise(con):
+  """Finds the monthly partitions of the data table, which must exist."""
+  months = get_partitions(con)
+  if not months:
+    raise ValueError('The %s table is not partitioned.' % TABLE)
+
+  return months
+
+
+def create_partitions(con, until):
+  """Creates the partitions of every month up to a time.
+
+  Args:
+    con: A connection to a MySQL database.
+    until: A time within the last month that should have a partition.
+
+  Returns:
+    A list of the names of the partitions created.
+  """
+  months = _get_partitions_or_raise(con)
+  new_months = []
+  month = add_months(months[-1], 1)
+  while month <= month_floor(until):
+    new_months.append(month)
+    month = add_months(month, 1)
+
+  if new_months:
+    con.execute('alter table %s reorganize partition %s into (%s)' % (
+      TABLE, MAXVALUE_PARTITION, partition_definitions(new_months)))
+
+  return [partition_name(m) for m in new_months]
+
+
+def drop_partitions(con, before, watermarks=True):
+  """Deletes the values of every month that ended before a time.
+
+  The partition of the latest month is never dropped, so that later partitions
+  may be created after it.
+
+  Args:
+    con: A connection to a MySQL database.
+    before: The time before which months should be deleted.
+    watermarks: Whether topic watermarks should be updated.
+
+  Returns:
+    A list of the names of the partitions dropped.
+  """
+  months = _get_partitions_or_raise(con)
+  expired = [m for m in months[:-1] if add_months(m, 1) <= before]
+  if not expired:
+    return []
+
+  names = [partition_name(m) for m in expired]
+  con.execute('alter table %s drop partition %s' % (TABLE, ', '.join(names)))
+  if watermarks:
+    with con.begin():
+      expire_watermarks(con, add_months(expired[-1], 1))
+
+  return names
+
+
+def expire_watermarks(con, start_dt):
+  """Updates the topic watermarks after the values before a time are deleted.
+
+  The earliest time and number of the values that remain are read from the
+  per-day rollups, which are kept when data is deleted, rather than from the
+  data table. The rollups must be current (see db/backfill_rollups.py).
+
+  Args:
+    con: The connection on which to execute the statements.
+    start_dt: The start of a day, before which every value has been deleted.
+  """
+  day = rollups.DAY.model.__table__
+  watermarks = db_model.TopicWatermark.__table__
+  topic_ids = [row[0] for row in con.execute(
+    sqlalchemy.select([watermarks.c.topic_id])
+    .where(watermarks.c.first_ts < start_dt))]
+  if not topic_ids:
+    return
+
+  remaining = {row[0]: row[1:] for row in con.execute(
+    sqlalchemy.select([day.c.topic_id, sqlalchemy.func.min(day.c.first_ts),
+                       sqlalchemy.func.sum(day.c.row_count)])
+    .where(day.c.ts >= start_dt).where(day.c.topic_id.in_(topic_ids))
+    .group_by(day.c.topic_id))}
+  for topic_id in topic_ids:
+    where = watermarks.c.topic_id == topic_id
+    if topic_id in remaining:
+      first_ts, row_count = remaining[topic_id]
+      con.execute(watermarks.update().where(where).values(
+        first_ts=first_ts, row_count=row_count))
+    else:
+      con.execute(watermarks.delete().where(where))
@@ -0,0 +1,92 @@
+"""Partition maintenance unit tests."""
+
+import datetime
+import os
+import tempfile
+import unittest
+import sqlalchemy
+from db import db_model, partitions, testdb
+
+
+class PartitionsTestCase(unittest.TestCase):
+  """A test case for partition maintenance."""
+
+  def setUp(self):
+    """Creates a temporary database."""
+    _, self.db_file = tempfile.mkstemp()
+    self.engine = testdb.create_engine(self.db_file)
+    self.db_con = testdb.create_accessor(self.db_file)
+
+  def tearDown(self):
+    """Removes the temporary database file."""
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def read_watermarks(self):
+    """Reads every topic watermark.
+
+    Returns:
+      A list of (topic_id, first_ts, last_ts, row_count) tuples.
+    """
+    table = db_model.TopicWatermark.__table__
+    with self.engine.connect() as con:
+      return [tuple(row) for row in con.execute(
+        sqlalchemy.select([table]).order_by(table.c.topic_id))]
+
+  def test_months(self):
+    """Tests month arithmetic."""
+    month = datetime.datetime(2018, 11, 1)
+    self.assertEqual(month,
+                     partitions.month_floor(datetime.datetime(2018, 11, 30, 1)))
+    self.assertEqual(datetime.datetime(2019, 2, 1),
+                     partitions.add_months(month, 3))
+    self.assertEqual(datetime.datetime(2017, 12, 1),
+                     partitions.add_months(month, -11))
+
+  def test_names(self):
+    """Tests that partitions are named after their months."""
+    month = datetime.datetime(2018, 1, 1)
+    self.assertEqual('p201801', partitions.partition_name(month))
+    self.assertEqual(month, partitions.partition_month('p201801'))
+    self.assertIsNone(partitions.partition_month('pmax'))
+
+  def test_definitions(self):
+    """Tests that partitions are bounded by the start of the next month."""
+    self.assertEqual(
+      "PARTITION p201812 VALUES LESS THAN (UNIX_TIMESTAMP('2019-01-01 "
+      "00:00:00')), PARTITION pmax VALUES LESS THAN MAXVALUE",
+      partitions.partition_definitions([datetime.datetime(2018, 12, 1)]))
+
+  def test_sqlite(self):
+    """Tests that partitioning is only attempted on MySQL."""
+    with self.engine.connect() as con:
+      self.assertRaises(ValueError, partitions.get_partitions, con)
+      self.assertRaises(ValueError, partitions.drop_partitions, con,
+                        datetime.datetime(2018, 1, 1))
+
+  def test_expire_watermarks(self):
+    """Tests that watermarks are updated from the remaining rollups."""
+    start = datetime.datetime(2018, 1, 31, 23, 59)
+    day = datetime.timedelta(days=1)
+    second = datetime.timedelta(seconds=1)
+    self.db_con.write_data(
+      testdb.new_data(start, start + day, 1, '1', day)
+      + testdb.new_data(start, start + second, 2, '1', second)
+      + [db_model.TopicDatum(start + 2 * day, 3, '1')])
+
+    feb = datetime.datetime(2018, 2, 1)
+    with self.engine.begin() as con:
+      con.execute(db_model.TopicDatum.__table__.delete().where(
+        db_model.TopicDatum.ts < feb))
+      partitions.expire_watermarks(con, feb)
+      partitions.expire_watermarks(con, feb)
+
+    self.assertEqual([(1, start + day, start + day, 1),
+                      (3, start + 2 * day, start + 2 * day, 1)],
+                     self.read_watermarks())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,222 @@
+"""An in-process cache of the results of range reads.
+
+Dashboards repeatedly read the same windows (e.g. the last 24 hours of a few
+topics), which overlap with those read a moment before. QueryCache divides each
+read into spans aligned to the epoch (an hour, by default), and caches the
+result of each span keyed by the set of topics, the start of the span and the
+resolution (raw values, or the width of downsampled buckets). A window that
+slides forward then reads only the spans that it has not read before.
+
+A span is closed if it ended before the latest datum of every topic in the set,
+as recorded by the topic watermarks, when it was read. Closed spans stay cached
+until they are evicted. The open span at the head of the data is read again
+whenever the watermarks of its topics change. Values that are written behind
+the watermarks (e.g. by a backfill, or when a spool is replayed after newer
+values were written) are not noticed, and invalidate should be called after
+writing them.
+
+Entries are evicted in least recently used order once the estimated size of the
+cached results exceeds a number of bytes.
+"""
+
+import collections
+import dataclasses
+import datetime
+import sys
+import threading
+
+# The default estimated size of the cached results, in bytes.
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# The default width of the spans into which reads are divided.
+DEFAULT_SPAN_WIDTH = datetime.timedelta(hours=1)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def _estimate_size(rows):
+  """Estimates the memory used by a list of tuples or dataclass objects."""
+  size = sys.getsizeof(rows)
+  for row in rows:
+    fields = row if isinstance(row, tuple) else vars(row).values()
+    size += sys.getsizeof(row) + sum(sys.getsizeof(f) for f in fields)
+
+  return size
+
+
+# The cached result of a span.
+#
+# Args:
+#   rows: The result.
+#   size: The estimated size of the result in bytes.
+#   version: The watermarks of the span's topics when it was read, or None if
+#       the span was closed.
+@dataclasses.dataclass(frozen=True)
+class _Entry:
+  rows: list
+  size: int
+  version: tuple
+
+
+class QueryCache:
+  """A cache of the values and downsampled buckets read by an accessor."""
+
+  def __init__(self, db_con, max_bytes=DEFAULT_MAX_BYTES,
+               span_width=DEFAULT_SPAN_WIDTH):
+    """Creates a new cache.
+
+    Args:
+      db_con: The DatabaseAccessor from which results are read.
+      max_bytes: The largest estimated size of the cached results, in bytes.
+      span_width: The width of the spans into which reads are divided.
+    """
+    self._db_con = db_con
+    self._max_bytes = max_bytes
+    self._span_width = span_width
+    self._lock = threading.Lock()
+    self._entries = collections.OrderedDict()
+    self._size = 0
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def size(self):
+    """The estimated size of the cached results, in bytes."""
+    return self._size
+
+  def read_data(self, topic_ids, start_dt, end_dt):
+    """Reads the values of the given topics and date range.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+
+    Returns:
+      A list of (ts, topic_id, value) tuples, ordered by timestamp and topic, as
+      returned by DatabaseAccessor.iter_data.
+    """
+    def read(topic_ids, span_start, span_end):
+      return list(self._db_con.iter_data(topic_ids, span_start,
+                                         span_end - _MICROSECOND,
+                                         cached=False))
+
+    result = []
+    for rows in self._read_spans(topic_ids, start_dt, end_dt, None,
+                                 self._span_width, read):
+      result.extend(r for r in rows if start_dt <= r[0] <= end_dt)
+
+    return result
+
+  def read_downsampled_data(self, topic_ids, start_dt, end_dt, bucket_width):
+    """Reads per-bucket aggregates of the given topics and date range.
+
+    Unlike DatabaseAccessor.get_downsampled_data, buckets are aligned to the
+    epoch rather than to the start of the range, so that they are the same for
+    every range. Every bucket that overlaps the range is returned.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+      bucket_width: The bucket width in whole seconds.
+
+    Returns:
+      A list of downsampling.Bucket objects, ordered by topic and time.
+    """
+    if bucket_width < 1:
+      raise ValueError('The bucket width must be at least one second.')
+
+    # Spans hold a whole number of buckets.
+    width = datetime.timedelta(seconds=bucket_width)
+    span_width = -(-self._span_width // width) * width
+
+    def read(topic_ids, span_start, span_end):
+      return self._db_con.get_downsampled_data(
+        topic_ids, span_start, span_end - _MICROSECOND,
+        bucket_width=bucket_width)
+
+    first = _EPOCH + (start_dt - _EPOCH) // width * width
+    result = []
+    for rows in self._read_spans(topic_ids, start_dt, end_dt, bucket_width,
+                                 span_width, read):
+      result.extend(b for b in rows if first <= b.ts <= end_dt)
+
+    return sorted(result, key=lambda b: (b.topic_id, b.ts))
+
+  def _read_spans(self, topic_ids, start_dt, end_dt, resolution, span_width,
+                  read):
+    """Reads the results of the spans that overlap a range.
+
+    Args:
+      topic_ids: The topics to query.
+      start_dt: The start datetime.
+      end_dt: The end datetime.
+      resolution: The resolution of the results, which is part of their keys.
+      span_width: The width of each span.
+      read: A function that reads the result of a span given the topics and
+          the start and end (exclusive) of the span.
+
+    Returns:
+      A list of results, ordered by time.
+    """
+    topics = frozenset(topic_ids)
+    watermarks = self._db_con.get_topic_watermarks(sorted(topics))
+    version = tuple(sorted((w.topic_id, w.last_ts, w.row_count)
+                           for w in watermarks))
+    closed_before = (min(w.last_ts for w in watermarks)
+                     if len(watermarks) == len(topics) else None)
+
+    results = []
+    span_start = _EPOCH + (start_dt - _EPOCH) // span_width * span_width
+    while span_start <= end_dt:
+      span_end = span_start + span_width
+      key = (topics, span_start, resolution)
+      with self._lock:
+        entry = self._entries.get(key)
+        if entry is not None and entry.version in (None, version):
+          self._entries.move_to_end(key)
+          self.hits += 1
+          results.append(entry.rows)
+          span_start = span_end
+          continue
+
+        self.misses += 1
+
+      rows = read(sorted(topics), span_start, span_end)
+      closed = closed_before is not None and span_end <= closed_before
+      self._put(key, _Entry(rows, _estimate_size(rows),
+                            None if closed else version))
+      results.append(rows)
+      span_start = span_end
+
+    return results
+
+  def _put(self, key, entry):
+    """Caches a result, evicting the least recently used results."""
+    with self._lock:
+      previous = self._entries.pop(key, None)
+      if previous is not None:
+        self._size -= previous.size
+
+      if entry.size > self._max_bytes:
+        return
+
+      self._entries[key] = entry
+      self._size += entry.size
+      while self._size > self._max_bytes:
+        _, evicted = self._entries.popitem(last=False)
+        self._size -= evicted.size
+
+  def invalidate(self, topic_ids=None):
+    """Removes cached results.
+
+    Args:
+      topic_ids: Results for topic sets that include any of these topics are
+          removed, or None to remove every result.
+    """
+    with self._lock:
+      for key in list(self._entries):
+        if topic_ids is None or not key[0].isdisjoint(topic_ids):
+          self._size -= self._entries.pop(key).size
@@ -0,0 +1,128 @@
+"""Query cache unit tests."""
+
+import datetime
+import os
+import tempfile
+import unittest
+from db import db_accessor, db_model, query_cache, testdb
+
+
+class QueryCacheTestCase(unittest.TestCase):
+  """A test case for the QueryCache class."""
+
+  def setUp(self):
+    """Creates a temporary database with three hours of values."""
+    _, self.db_file = tempfile.mkstemp()
+    testdb.create_engine(self.db_file)
+    self.db_con = testdb.create_accessor(self.db_file,
+                                         db_accessor.STORAGE_TYPED)
+    self.start = datetime.datetime(2018, 1, 1)
+    self.hour = datetime.timedelta(hours=1)
+    self.minute = datetime.timedelta(minutes=1)
+    for topic_id in (1, 2):
+      self.db_con.write_data(testdb.new_data(
+        self.start, self.start + 3 * self.hour - self.minute, topic_id,
+        str(topic_id), self.minute))
+
+  def tearDown(self):
+    """Removes the temporary database file."""
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def test_read_data(self):
+    """Tests that closed spans are cached and the head span is refreshed."""
+    cache = query_cache.QueryCache(self.db_con)
+    start = self.start + 30 * self.minute
+    end = self.start + 3 * self.hour + 10 * self.minute
+    expected = list(self.db_con.iter_data([1, 2], start, end))
+    self.assertEqual(expected, cache.read_data([2, 1], start, end))
+    self.assertEqual((0, 4), (cache.hits, cache.misses))
+
+    self.assertEqual(expected[2:], cache.read_data([1, 2], start + self.minute,
+                                                   end))
+    self.assertEqual((4, 4), (cache.hits, cache.misses))
+
+    # A new value changes the watermarks, so the spans that were open when they
+    # were read are read again.
+    ts = self.start + 3 * self.hour + 5 * self.minute
+    self.db_con.write_data([db_model.TopicDatum(ts, 1, '5')])
+    self.assertEqual(expected + [(ts, 1, 5.0)],
+                     cache.read_data([1, 2], start, end))
+    self.assertEqual((6, 6), (cache.hits, cache.misses))
+
+    cache.invalidate([2])
+    self.assertEqual(0, cache.size)
+    cache.read_data([1], start, end)
+    self.assertEqual((6, 10), (cache.hits, cache.misses))
+
+  def test_read_downsampled_data(self):
+    """Tests that buckets are aligned to the epoch and cached."""
+    cache = query_cache.QueryCache(self.db_con)
+    start = self.start + 90 * self.minute
+    end = self.start + 3 * self.hour
+    expected = [b for b in self.db_con.get_downsampled_data(
+      [1, 2], self.start + self.hour, end, bucket_width=1800)
+                if b.ts >= start]
+    self.assertEqual(6, len(expected))
+    self.assertEqual(expected, cache.read_downsampled_data(
+      [1, 2], start + self.minute, end, 1800))
+    self.assertEqual(expected, cache.read_downsampled_data(
+      [1, 2], start, end, 1800))
+    self.assertEqual((3, 3), (cache.hits, cache.misses))
+
+    cache.read_downsampled_data([1, 2], start, end, 60)
+    self.assertEqual((3, 6), (cache.hits, cache.misses))
+    self.assertRaises(ValueError, cache.read_downsampled_data, [1], start, end,
+                      0)
+
+  def test_eviction(self):
+    """Tests that least recently used results are evicted."""
+    cache = query_cache.QueryCache(self.db_con)
+    cache.read_data([1], self.start, self.start)
+    size = cache.size
+    cache = query_cache.QueryCache(self.db_con, max_bytes=2 * size)
+    cache.read_data([1], self.start, self.start)
+    cache.read_data([2], self.start, self.start)
+    cache.read_data([1], self.start, self.start)
+    cache.read_data([1], self.start + self.hour, self.start + self.hour)
+    self.assertLessEqual(cache.size, 2 * size)
+    self.assertEqual((1, 3), (cache.hits, cache.misses))
+
+    cache.read_data([1], self.start, self.start)
+    cache.read_data([2], self.start, self.start)
+    self.assertEqual((2, 4), (cache.hits, cache.misses))
+
+  def test_accessor(self):
+    """Tests that an accessor serves range reads from its query cache."""
+    self.assertIsNone(self.db_con.query_cache)
+    db_con = db_accessor.DatabaseAccessor(db_accessor.DatabaseOptions(
+      'sqlite', None, None, self.db_file, None, None,
+      db_accessor.STORAGE_TYPED, query_cache_bytes=1024 * 1024))
+    cache = db_con.query_cache
+    start = self.start + 30 * self.minute
+    end = self.start + 2 * self.hour
+    expected = list(self.db_con.iter_data([1, 2], start, end))
+    self.assertEqual(expected, list(db_con.iter_data([1, 2], start, end)))
+    self.assertEqual((0, 3), (cache.hits, cache.misses))
+    self.assertEqual(expected, list(db_con.iter_data([1, 2], start, end)))
+    self.assertEqual((3, 3), (cache.hits, cache.misses))
+
+    # Sampled and uncached reads bypass the cache.
+    list(db_con.iter_data([1, 2], start, end, sample_rate=0.5))
+    list(db_con.iter_data([1, 2], start, end, cached=False))
+    self.assertEqual((3, 3), (cache.hits, cache.misses))
+
+    # A value written behind the watermarks invalidates the results of its
+    # topic.
+    ts = self.start + self.hour + 30 * self.minute
+    db_con.write_data([db_model.TopicDatum(ts, 1, '4')],
+                      on_conflict=db_accessor.ON_CONFLICT_UPDATE)
+    self.assertEqual(0, cache.size)
+    self.assertIn((ts, 1, 4.0), list(db_con.iter_data([1, 2], start, end)))
+    db_con.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
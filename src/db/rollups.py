@@ -0,0 +1,374 @@
+"""Maintains per-minute, per-hour and per-day aggregates of topic values.
+
+Queries over weeks or years of data at one sample per second read far too many
+rows to be interactive. Instead, the count, sum, minimum, maximum, first and
+last value of each topic within each minute, hour and day are kept in rollup
+tables, which a range query may read in place of the data table.
+
+When new data is written, its aggregates are computed in memory and merged into
+the existing rollup rows. When existing data may have been skipped or replaced,
+the affected buckets are rebuilt instead: minutes from the data table, hours
+from minutes and days from hours, so that the cost is proportional to the data
+written.
+
+Values that are not numbers are aggregated as zero, as they are by a SQL cast.
+"""
+
+import dataclasses
+import datetime
+import functools
+import sqlalchemy
+from db import db_model
+
+_EPOCH = datetime.datetime(2000, 1, 1)
+
+# The aggregate columns of every rollup table, in the order in which they are
+# computed.
+_COLUMNS = ('row_count', 'value_sum', 'value_min', 'value_max', 'first_ts',
+            'first_value', 'last_ts', 'last_value')
+
+
+# A rollup table, and the width of its buckets. Bucket start times are
+# formatted by the database with sqlite_format or mysql_format.
+@dataclasses.dataclass(frozen=True)
+class Rollup:
+  name: str
+  model: type
+  width: datetime.timedelta
+  sqlite_format: str
+  mysql_format: str
+
+  def floor(self, ts):
+    """Finds the start of the bucket containing a time."""
+    return _EPOCH + (ts - _EPOCH) // self.width * self.width
+
+  def bucket(self, dialect, ts):
+    """Builds an expression for the start of the bucket containing a time."""
+    if dialect == 'sqlite':
+      return sqlalchemy.func.strftime(self.sqlite_format, ts)
+
+    return sqlalchemy.func.date_format(ts, self.mysql_format)
+
+
+MINUTE = Rollup('1m', db_model.MinuteRollup, datetime.timedelta(minutes=1),
+                '%Y-%m-%d %H:%M:00.000000', '%Y-%m-%d %H:%i:00')
+HOUR = Rollup('1h', db_model.HourRollup, datetime.timedelta(hours=1),
+              '%Y-%m-%d %H:00:00.000000', '%Y-%m-%d %H:00:00')
+DAY = Rollup('1d', db_model.DayRollup, datetime.timedelta(days=1),
+             '%Y-%m-%d 00:00:00.000000', '%Y-%m-%d 00:00:00')
+
+# Every rollup, from the finest to the coarsest.
+ROLLUPS = (MINUTE, HOUR, DAY)
+
+
+def to_number(dialect, value):
+  """Builds an expression that converts a value string into a number.
+
+  Args:
+    dialect: The name of the database dialect.
+    value: The value string expression.
+
+  Returns:
+    A floating point expression.
+  """
+  if dialect == 'sqlite':
+    return sqlalchemy.cast(value, sqlalchemy.Float)
+
+  # MySQL cannot CAST to a floating point type, but converts strings to numbers
+  # in arithmetic.
+  return sqlalchemy.type_coerce(value, sqlalchemy.Float) + 0.0
+
+
+def source_columns(dialect, table):
+  """Describes the data or rollup table from which aggregates are computed.
+
+  Each row of a data table is treated as a bucket containing one value, so that
+  rollups of any resolution may be computed the same way from it or from a
+  finer rollup.
+
+  Args:
+    dialect: The name of the database dialect.
+    table: The data table, the typed_data table, a rollup table, or an alias
+        of any of them.
+
+  Returns:
+    A dict from each aggregate column name to an expression for it.
+  """
+  if 'value_string' in table.c:
+    value = to_number(dialect, table.c.value_string)
+  elif 'value' in table.c:
+    value = table.c.value
+  else:
+    return {name: table.c[name] for name in _COLUMNS}
+
+  return {
+    'row_count': sqlalchemy.literal(1), 'value_sum': value, 'value_min': value,
+    'value_max': value, 'first_ts': table.c.ts, 'first_value': value,
+    'last_ts': table.c.ts, 'last_value': value
+  }
+
+
+def choose(start_dt, bucket_width):
+  """Chooses the coarsest rollup from which buckets may be computed.
+
+  Args:
+    start_dt: The start of the first bucket.
+    bucket_width: The bucket width in whole seconds.
+
+  Returns:
+    A Rollup whose buckets are aligned to the start time and evenly divide the
+    bucket width, or None if there is no such rollup.
+  """
+  width = datetime.timedelta(seconds=bucket_width)
+  for rollup in reversed(ROLLUPS):
+    if width % rollup.width == datetime.timedelta(0) and rollup.floor(
+        start_dt) == start_dt:
+      return rollup
+
+  return None
+
+
+def _parse(value_string):
+  """Converts a value string into a number, or zero if it is not a number."""
+  try:
+    return float(value_string)
+  except (TypeError, ValueError):
+    return 0.0
+
+
+def _combine(a, b):
+  """Combines the aggregates of two sets of values in place.
+
+  Args:
+    a: A list of aggregates, in the order of _COLUMNS, which is updated.
+    b: A list of aggregates, in the order of _COLUMNS.
+  """
+  a[0] += b[0]
+  a[1] += b[1]
+  a[2] = min(a[2], b[2])
+  a[3] = max(a[3], b[3])
+  if b[4] < a[4]:
+    a[4], a[5] = b[4], b[5]
+  if b[6] >= a[6]:
+    a[6], a[7] = b[6], b[7]
+
+
+def _minute_buckets(values):
+  """Aggregates values by topic and minute.
+
+  Args:
+    values: An iterable of (topic ID, timestamp, number) tuples.
+
+  Returns:
+    A dict from each (topic ID, minute) pair to its aggregates, in the order of
+    _COLUMNS.
+  """
+  buckets = {}
+  for topic_id, ts, value in values:
+    key = (topic_id, MINUTE.floor(ts))
+    aggregates = [1, value, value, value, ts, value, ts, value]
+    if key in buckets:
+      _combine(buckets[key], aggregates)
+    else:
+      buckets[key] = aggregates
+
+  return buckets
+
+
+def merge(con, data):
+  """Adds new data to the rollups.
+
+  The data must not already have been added, since its aggregates are combined
+  with those of the existing rollup rows.
+
+  Args:
+    con: The connection on which to execute the statements.
+    data: A list of topic values that have been written to the data table.
+  """
+  buckets = _minute_buckets(
+    (d.topic_id, d.ts, _parse(d.value_string)) for d in data)
+  for rollup in ROLLUPS:
+    if rollup is not MINUTE:
+      coarser = {}
+      for (topic_id, ts), aggregates in buckets.items():
+        key = (topic_id, rollup.floor(ts))
+        if key in coarser:
+          _combine(coarser[key], aggregates)
+        else:
+          coarser[key] = list(aggregates)
+      buckets = coarser
+
+    _merge_buckets(con, rollup.model.__table__, buckets)
+
+
+def _merge_buckets(con, table, buckets):
+  """Combines aggregates with the existing rows of a rollup table.
+
+  Args:
+    con: The connection on which to execute the statements.
+    table: The rollup table.
+    buckets: A dict from each (topic ID, bucket start) pair to its aggregates.
+  """
+  insert, update = _merge_statements(table)
+
+  # Missing rows are created with aggregates that leave the update unchanged.
+  con.execute(insert,
+              [dict(zip(_COLUMNS, [0, 0.0] + a[2:]), topic_id=topic_id, ts=ts)
+               for (topic_id, ts), a in buckets.items()])
+  con.execute(update,
+              [dict({'b_' + name: v for name, v in zip(_COLUMNS, a)},
+                    b_topic_id=topic_id, b_ts=ts)
+               for (topic_id, ts), a in buckets.items()])
+
+
+@functools.lru_cache(maxsize=None)
+def _merge_statements(table):
+  """Builds the statements that combine aggregates with a rollup table.
+
+  Args:
+    table: The rollup table.
+
+  Returns:
+    An (insert, update) pair. The insert creates missing rows, and the update
+    combines a row's aggregates with those given by b_-prefixed parameters.
+  """
+  insert = (table.insert().prefix_with('IGNORE', dialect='mysql')
+            .prefix_with('OR IGNORE', dialect='sqlite'))
+
+  b = {name: sqlalchemy.bindparam('b_' + name) for name in _COLUMNS}
+  b['first_ts'] = sqlalchemy.bindparam('b_first_ts', type_=sqlalchemy.DateTime)
+  b['last_ts'] = sqlalchemy.bindparam('b_last_ts', type_=sqlalchemy.DateTime)
+  c = table.c
+
+  # MySQL assigns columns from left to right, so each value is assigned before
+  # the timestamp it is compared with.
+  update = (
+    table.update(preserve_parameter_order=True)
+    .where(c.topic_id == sqlalchemy.bindparam('b_topic_id'))
+    .where(c.ts == sqlalchemy.bindparam('b_ts', type_=sqlalchemy.DateTime))
+    .values([
+      (c.row_count, c.row_count + b['row_count']),
+      (c.value_sum, c.value_sum + b['value_sum']),
+      (c.value_min, sqlalchemy.case([(c.value_min > b['value_min'],
+                                      b['value_min'])], else_=c.value_min)),
+      (c.value_max, sqlalchemy.case([(c.value_max < b['value_max'],
+                                      b['value_max'])], else_=c.value_max)),
+      (c.first_value, sqlalchemy.case([(c.first_ts > b['first_ts'],
+                                        b['first_value'])],
+                                      else_=c.first_value)),
+      (c.first_ts, sqlalchemy.case([(c.first_ts > b['first_ts'],
+                                     b['first_ts'])], else_=c.first_ts)),
+      (c.last_value, sqlalchemy.case([(c.last_ts <= b['last_ts'],
+                                       b['last_value'])],
+                                     else_=c.last_value)),
+      (c.last_ts, sqlalchemy.case([(c.last_ts < b['last_ts'], b['last_ts'])],
+                                  else_=c.last_ts))]))
+  return insert, update
+
+
+def rebuild(con, start_dt, end_dt, topic_ids=None, data=None):
+  """Recomputes the rollup buckets that contain a range of time.
+
+  This should be called after data is replaced or deleted, or is written
+  without using a DatabaseAccessor (e.g. by bulk loading tools).
+
+  Args:
+    con: The connection on which to execute the statements.
+    start_dt: The start of the range.
+    end_dt: The end of the range (inclusive).
+    topic_ids: The topics whose rollups should be rebuilt, or None to rebuild
+        the rollups of every topic.
+    data: The table from which values are read: the data table (the default)
+        or the typed_data table.
+  """
+  source = db_model.TopicDatum.__table__ if data is None else data
+  for rollup in ROLLUPS:
+    _rebuild_buckets(con, rollup, source, start_dt, end_dt, topic_ids)
+    source = rollup.model.__table__
+
+
+def _rebuild_buckets(con, rollup, source, start_dt, end_dt, topic_ids):
+  """Recomputes a rollup's buckets from the next finer table.
+
+  Args:
+    con: The connection on which to execute the statements.
+    rollup: The rollup to rebuild.
+    source: A data table or the next finer rollup table.
+    start_dt: The start of the range.
+    end_dt: The end of the range (inclusive).
+    topic_ids: The topics whose rollups should be rebuilt, or None.
+  """
+  dialect = con.dialect.name
+  table = rollup.model.__table__
+  start = rollup.floor(start_dt)
+  end = rollup.floor(end_dt) + rollup.width
+
+  delete = table.delete().where(table.c.ts >= start).where(table.c.ts < end)
+  cols = source_columns(dialect, source)
+  bucket = rollup.bucket(dialect, source.c.ts)
+  query = (sqlalchemy.select([
+    source.c.topic_id, bucket.label('ts'),
+    sqlalchemy.func.sum(cols['row_count']).label('row_count'),
+    sqlalchemy.func.sum(cols['value_sum']).label('value_sum'),
+    sqlalchemy.func.min(cols['value_min']).label('value_min'),
+    sqlalchemy.func.max(cols['value_max']).label('value_max'),
+    sqlalchemy.func.min(cols['first_ts']).label('first_ts'),
+    sqlalchemy.func.max(cols['last_ts']).label('last_ts'),
+    sqlalchemy.func.min(source.c.ts).label('first_key'),
+    sqlalchemy.func.max(source.c.ts).label('last_key')])
+           .where(source.c.ts >= start).where(source.c.ts < end)
+           .group_by(source.c.topic_id, bucket))
+  if topic_ids is not None:
+    delete = delete.where(table.c.topic_id.in_(topic_ids))
+    query = query.where(source.c.topic_id.in_(topic_ids))
+
+  buckets = query.alias('buckets')
+  first = source.alias('first_source')
+  first_value = (
+    sqlalchemy.select([source_columns(dialect, first)['first_value']])
+    .where(first.c.topic_id == buckets.c.topic_id)
+    .where(first.c.ts == buckets.c.first_key).limit(1).as_scalar())
+  last = source.alias('last_source')
+  last_value = (
+    sqlalchemy.select([source_columns(dialect, last)['last_value']])
+    .where(last.c.topic_id == buckets.c.topic_id)
+    .where(last.c.ts == buckets.c.last_key).limit(1).as_scalar())
+
+  con.execute(delete)
+  con.execute(table.insert().from_select(
+    ['topic_id', 'ts'] + list(_COLUMNS),
+    sqlalchemy.select([
+      buckets.c.topic_id, buckets.c.ts, buckets.c.row_count,
+      buckets.c.value_sum, buckets.c.value_min, buckets.c.value_max,
+      buckets.c.first_ts, first_value, buckets.c.last_ts, last_value])))
+
+
+def rebuild_from_values(con, values, start_dt, end_dt, topic_ids):
+  """Recomputes the rollup buckets that contain a range of time from values.
+
+  This is used when values are not stored in a table from which they can be
+  aggregated (e.g. when they are compressed into chunks).
+
+  Args:
+    con: The connection on which to execute the statements.
+    values: An iterable of (topic ID, timestamp, number) tuples containing
+        every value of the topics within the minutes that contain the range.
+    start_dt: The start of the range.
+    end_dt: The end of the range (inclusive).
+    topic_ids: The topics whose rollups should be rebuilt.
+  """
+  table = MINUTE.model.__table__
+  con.execute(table.delete()
+              .where(table.c.ts >= MINUTE.floor(start_dt))
+              .where(table.c.ts < MINUTE.floor(end_dt) + MINUTE.width)
+              .where(table.c.topic_id.in_(topic_ids)))
+  buckets = _minute_buckets(values)
+  if buckets:
+    con.execute(table.insert(),
+                [dict(zip(_COLUMNS, a), topic_id=topic_id, ts=ts)
+                 for (topic_id, ts), a in buckets.items()])
+
+  source = table
+  for rollup in ROLLUPS[1:]:
+    _rebuild_buckets(con, rollup, source, start_dt, end_dt, topic_ids)
+    source = rollup.model.__table__
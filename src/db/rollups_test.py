@@ -0,0 +1,150 @@
+"""Rollup unit tests."""
+
+import datetime
+import os
+import tempfile
+import unittest
+import sqlalchemy
+from db import backfill_rollups, db_accessor, db_model, rollups, testdb
+
+
+class RollupsTestCase(unittest.TestCase):
+  """A test case for rollup maintenance."""
+
+  def setUp(self):
+    """Creates a temporary database."""
+    _, self.db_file = tempfile.mkstemp()
+    self.engine = testdb.create_engine(self.db_file)
+    self.db_con = testdb.create_accessor(self.db_file)
+    self.start = datetime.datetime(2018, 1, 1, 23, 58)
+
+  def tearDown(self):
+    """Removes the temporary database file."""
+    try:
+      os.unlink(self.db_file)
+    except PermissionError:
+      pass
+
+  def read_rollup(self, rollup):
+    """Reads every row of a rollup table.
+
+    Returns:
+      A list of (topic_id, ts, row_count, value_sum, value_min, value_max,
+      first_ts, first_value, last_ts, last_value) tuples.
+    """
+    table = rollup.model.__table__
+    with self.engine.connect() as con:
+      return [tuple(row) for row in con.execute(
+        sqlalchemy.select([table]).order_by(table.c.topic_id, table.c.ts))]
+
+  def new_data(self, start, count, topic_id=1):
+    """Creates values that increase by one every 30 seconds."""
+    return [db_model.TopicDatum(start + datetime.timedelta(seconds=30 * i),
+                                topic_id, str(i)) for i in range(0, count)]
+
+  def test_floor(self):
+    """Tests that times are truncated to the start of their buckets."""
+    ts = datetime.datetime(2018, 3, 4, 5, 6, 7, 8)
+    self.assertEqual(datetime.datetime(2018, 3, 4, 5, 6),
+                     rollups.MINUTE.floor(ts))
+    self.assertEqual(datetime.datetime(2018, 3, 4, 5), rollups.HOUR.floor(ts))
+    self.assertEqual(datetime.datetime(2018, 3, 4), rollups.DAY.floor(ts))
+    self.assertEqual(datetime.datetime(1999, 12, 31),
+                     rollups.DAY.floor(datetime.datetime(1999, 12, 31, 1)))
+
+  def test_choose(self):
+    """Tests that the coarsest aligned rollup is chosen."""
+    day = datetime.datetime(2018, 1, 1)
+    self.assertIs(rollups.DAY, rollups.choose(day, 2 * 86400))
+    self.assertIs(rollups.HOUR, rollups.choose(day, 7200))
+    self.assertIs(rollups.MINUTE, rollups.choose(day, 90 * 60))
+    self.assertIs(rollups.MINUTE,
+                  rollups.choose(day + datetime.timedelta(minutes=1), 86400))
+    self.assertIsNone(rollups.choose(day, 90))
+    self.assertIsNone(
+      rollups.choose(day + datetime.timedelta(seconds=1), 86400))
+
+  def test_merge(self):
+    """Tests that new data is merged into every rollup."""
+    data = self.new_data(self.start, 8)
+    self.db_con.write_data(data[4:])
+    self.db_con.write_data(data[:4] + self.new_data(self.start, 1, 2))
+
+    minute = datetime.timedelta(minutes=1)
+    second = datetime.timedelta(seconds=30)
+    day = datetime.datetime(2018, 1, 2)
+    self.assertEqual([
+      (1, self.start, 2, 1, 0, 1, self.start, 0, self.start + second, 1),
+      (1, self.start + minute, 2, 5, 2, 3, self.start + minute, 2,
+       self.start + minute + second, 3),
+      (1, day, 2, 9, 4, 5, day, 4, day + second, 5),
+      (1, day + minute, 2, 13, 6, 7, day + minute, 6, day + minute + second,
+       7),
+      (2, self.start, 1, 0, 0, 0, self.start, 0, self.start, 0)
+    ], self.read_rollup(rollups.MINUTE))
+    self.assertEqual([
+      (1, datetime.datetime(2018, 1, 1), 4, 6, 0, 3, self.start, 0,
+       self.start + minute + second, 3),
+      (1, day, 4, 22, 4, 7, day, 4, day + minute + second, 7),
+      (2, datetime.datetime(2018, 1, 1), 1, 0, 0, 0, self.start, 0,
+       self.start, 0)
+    ], self.read_rollup(rollups.DAY))
+
+  def test_rebuild(self):
+    """Tests that rebuilt rollups match those maintained incrementally."""
+    self.db_con.write_data(self.new_data(self.start, 300))
+    self.db_con.write_data(self.new_data(self.start, 10, 2))
+    expected = {r: self.read_rollup(r) for r in rollups.ROLLUPS}
+
+    with self.engine.begin() as con:
+      for r in rollups.ROLLUPS:
+        con.execute(r.model.__table__.delete())
+
+    self.db_con.rebuild_rollups(self.start, self.start)
+    self.assertEqual(2, len(self.read_rollup(rollups.DAY)))
+    self.db_con.rebuild_rollups(self.start, datetime.datetime(2018, 1, 4))
+    for r in rollups.ROLLUPS:
+      self.assertEqual(expected[r], self.read_rollup(r))
+
+  def test_backfill(self):
+    """Tests that a range of days is rolled up in chunks."""
+    self.db_con.write_data(self.new_data(self.start, 300))
+    expected = self.read_rollup(rollups.DAY)
+    with self.engine.begin() as con:
+      for r in rollups.ROLLUPS:
+        con.execute(r.model.__table__.delete())
+
+    self.assertEqual(3, backfill_rollups.backfill(
+      self.db_con, self.start, self.start + datetime.timedelta(days=2), 2))
+    self.assertEqual(expected, self.read_rollup(rollups.DAY))
+
+  def test_conflicts(self):
+    """Tests that ignored and replaced values are not counted twice."""
+    data = self.new_data(self.start, 6)
+    self.db_con.write_data(data[:4])
+    self.db_con.write_data(data, on_conflict=db_accessor.ON_CONFLICT_IGNORE)
+    self.db_con.write_data(data[2:], on_conflict=db_accessor.ON_CONFLICT_UPDATE)
+
+    self.assertEqual([(1, datetime.datetime(2018, 1, 1), 4, 6, 0, 3),
+                      (1, datetime.datetime(2018, 1, 2), 2, 9, 4, 5)],
+                     [row[:6] for row in self.read_rollup(rollups.DAY)])
+
+    # Values that were all ignored do not touch the rollups or watermarks, and
+    # new values are merged rather than rebuilt.
+    statements = []
+    sqlalchemy.event.listen(
+      self.db_con.engine, 'before_cursor_execute',
+      lambda *args: statements.append(args[2]))
+    self.db_con.write_data(data, on_conflict=db_accessor.ON_CONFLICT_IGNORE)
+    self.assertFalse([s for s in statements
+                      if 'data_1' in s or 'topic_watermarks' in s])
+
+    del statements[:]
+    self.db_con.write_data(self.new_data(self.start + datetime.timedelta(
+      minutes=10), 2), on_conflict=db_accessor.ON_CONFLICT_UPDATE)
+    self.assertFalse([s for s in statements if s.startswith('DELETE')])
+    self.assertEqual((1, datetime.datetime(2018, 1, 2), 4, 10, 0, 5),
+                     self.read_rollup(rollups.DAY)[1][:6])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,393 @@
+"""A durable local spool for data that could not be written to the database.
+
+When the database is down or unreachable (e.g. during a maintenance window),
+collected data is appended to a spool on the local disk instead of being
+discarded. A background replayer writes the spooled data to the database in
+large batches once it becomes available again.
+
+The spool is a directory of append-only segment files. Each file begins with a
+header, followed by records of the form:
+
+  crc32 (uint32) | ts (int64) | topic_id (int32) | length (uint32) | value
+
+where ts is the number of microseconds since the epoch, value is the UTF-8
+encoded value string, and the checksum covers the rest of the record. A record
+that was only partially written before a crash fails its checksum, and marks
+the end of the segment.
+
+New records are appended to the active segment, which is closed once it grows
+beyond the segment size. Replay proceeds one closed segment at a time, oldest
+first. The active segment is only closed early for replay once every earlier
+segment has been written, so that the attempts that fail during an outage do
+not each leave a small segment behind. After each batch is written, the replay position is saved in a small
+checkpoint file next to the segment, so that a failure part way through a
+segment does not write its earlier batches again. The segment and its
+checkpoint are deleted once the segment has been written in full.
+
+Disk use is bounded. When appending a batch would take the spool beyond its
+size limit, the oldest segments are deleted to make room, and a warning is
+logged.
+"""
+
+import datetime
+import functools
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from db import db_accessor, db_model
+
+# The default largest size in bytes of a segment file.
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# The default largest size in bytes of the spool.
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Segment files are flushed to disk after every append.
+FSYNC_ALWAYS = 'always'
+
+# Segment files are flushed to disk at most once per fsync interval.
+FSYNC_INTERVAL = 'interval'
+
+# Flushing segment files to disk is left to the operating system.
+FSYNC_NEVER = 'never'
+
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+# The default time in seconds between flushes with the interval policy.
+DEFAULT_FSYNC_INTERVAL = 1
+
+# The default number of records written to the database in a transaction.
+DEFAULT_REPLAY_BATCH_SIZE = 10000
+
+# The default time in seconds between attempts to replay the spool.
+DEFAULT_REPLAY_INTERVAL = 5
+
+# The header that begins every segment file.
+SEGMENT_HEADER = b'UWSPOOL1'
+
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_SUFFIX = '.pos'
+
+_CHECKSUM = struct.Struct('>I')
+_RECORD_HEADER = struct.Struct('>IqiI')
+_RECORD_BODY = struct.Struct('>qiI')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def encode_datum(datum):
+  """Encodes a topic value as a spool record.
+
+  Args:
+    datum: A TopicDatum object.
+
+  Returns:
+    The record as bytes.
+  """
+  value = str(datum.value_string).encode('utf-8')
+  body = _RECORD_BODY.pack((datum.ts - _EPOCH) // _MICROSECOND,
+                           datum.topic_id, len(value)) + value
+  return _CHECKSUM.pack(zlib.crc32(body)) + body
+
+
+def decode_records(buf, offset=len(SEGMENT_HEADER)):
+  """Decodes the records in a segment.
+
+  Decoding stops at the end of the buffer, or at the first record that is
+  incomplete or fails its checksum.
+
+  Args:
+    buf: A buffer containing the segment's contents.
+    offset: The position of the first record to decode.
+
+  Yields:
+    (TopicDatum, offset) pairs, where offset is the position of the end of the
+    record.
+  """
+  size = len(buf)
+  while offset + _RECORD_HEADER.size <= size:
+    crc, ts, topic_id, length = _RECORD_HEADER.unpack_from(buf, offset)
+    end = offset + _RECORD_HEADER.size + length
+    if end > size or zlib.crc32(buf[offset + _CHECKSUM.size:end]) != crc:
+      return
+
+    value = bytes(buf[offset + _RECORD_HEADER.size:end]).decode('utf-8')
+    yield (db_model.TopicDatum(_EPOCH + ts * _MICROSECOND, topic_id, value),
+           end)
+    offset = end
+
+
+class Spool:
+  """An append-only, size-bounded store of topic values on the local disk."""
+
+  def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+               max_bytes=DEFAULT_MAX_BYTES, fsync=FSYNC_INTERVAL,
+               fsync_interval=DEFAULT_FSYNC_INTERVAL, use_mmap=False):
+    """Opens a spool, creating its directory if necessary.
+
+    Args:
+      directory: The directory containing the segment files.
+      segment_size: The size in bytes beyond which a segment is closed.
+      max_bytes: The largest size in bytes of all segments.
+      fsync: When appended data is flushed to disk: FSYNC_ALWAYS,
+          FSYNC_INTERVAL or FSYNC_NEVER.
+      fsync_interval: The time in seconds between flushes with the interval
+          policy.
+      use_mmap: Whether segments are memory-mapped when they are replayed.
+    """
+    if fsync not in FSYNC_POLICIES:
+      raise ValueError('Unknown fsync policy: %s.' % fsync)
+
+    os.makedirs(directory, exist_ok=True)
+    self._directory = directory
+    self._segment_size = segment_size
+    self._max_bytes = max_bytes
+    self._fsync = fsync
+    self._fsync_interval = fsync_interval
+    self._use_mmap = use_mmap
+
+    self._lock = threading.Lock()
+    self._active = None
+    self._active_path = None
+    self._last_fsync = time.monotonic()
+    self.dropped_bytes = 0
+
+    segments = self._segments()
+    self._next_segment = (int(segments[-1][:-len(SEGMENT_SUFFIX)]) + 1
+                          if segments else 0)
+
+  @property
+  def size(self):
+    """The total size in bytes of all segments."""
+    with self._lock:
+      return self._size()
+
+  def empty(self):
+    """Returns whether the spool contains no data."""
+    with self._lock:
+      return not self._segments()
+
+  def write_data(self, data):
+    """Appends a list of topic values to the spool.
+
+    Args:
+      data: A list of TopicDatum objects.
+    """
+    if not data:
+      return
+
+    records = b''.join(encode_datum(d) for d in data)
+    with self._lock:
+      self._make_room(len(records))
+      if self._active is None:
+        self._open_segment()
+
+      self._active.write(records)
+      self._active.flush()
+      now = time.monotonic()
+      if (self._fsync == FSYNC_ALWAYS
+          or (self._fsync == FSYNC_INTERVAL
+              and now - self._last_fsync >= self._fsync_interval)):
+        os.fsync(self._active.fileno())
+        self._last_fsync = now
+
+      if self._active.tell() >= self._segment_size:
+        self._close_segment()
+
+  def replay(self, write, batch_size=DEFAULT_REPLAY_BATCH_SIZE):
+    """Writes the spooled data, oldest first, and removes it from the spool.
+
+    Args:
+      write: A function that writes a list of TopicDatum objects to the
+          database.
+      batch_size: The number of records passed to each call to write.
+
+    Returns:
+      The number of records written.
+
+    Raises:
+      Exception: Any exception raised by write. Data that was written before
+          the failure is not written again by the next replay.
+    """
+    with self._lock:
+      segments = self._closed_segments()
+
+    count = self._replay_segments(segments, write, batch_size)
+    with self._lock:
+      self._close_segment()
+      segments = self._closed_segments()
+
+    return count + self._replay_segments(segments, write, batch_size)
+
+  def close(self):
+    """Flushes and closes the active segment."""
+    with self._lock:
+      self._close_segment()
+
+  def _replay_segments(self, segments, write, batch_size):
+    """Writes the records in a list of closed segments, then deletes them."""
+    count = 0
+    for name in segments:
+      count += self._replay_segment(os.path.join(self._directory, name), write,
+                                    batch_size)
+
+    return count
+
+  def _replay_segment(self, path, write, batch_size):
+    """Writes the records in a closed segment, then deletes it."""
+    checkpoint = path + CHECKPOINT_SUFFIX
+    offset = len(SEGMENT_HEADER)
+    if os.path.exists(checkpoint):
+      with open(checkpoint) as f:
+        offset = int(f.read() or offset)
+
+    count = 0
+    with open(path, 'rb') as f:
+      if self._use_mmap and os.path.getsize(path) > 0:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      else:
+        buf = f.read()
+
+      try:
+        with memoryview(buf) as view:
+          batch = []
+          for datum, end in decode_records(view, offset):
+            batch.append(datum)
+            if len(batch) >= batch_size:
+              write(batch)
+              count += len(batch)
+              batch = []
+              self._save_checkpoint(checkpoint, end)
+
+          if batch:
+            write(batch)
+            count += len(batch)
+      finally:
+        if isinstance(buf, mmap.mmap):
+          buf.close()
+
+    with self._lock:
+      self._remove_segment(path)
+
+    return count
+
+  @staticmethod
+  def _save_checkpoint(path, offset):
+    """Records the position up to which a segment has been replayed."""
+    with open(path + '.tmp', 'w') as f:
+      f.write(str(offset))
+
+    os.replace(path + '.tmp', path)
+
+  def _segments(self):
+    """Lists the names of the segment files, oldest first."""
+    return sorted(n for n in os.listdir(self._directory)
+                  if n.endswith(SEGMENT_SUFFIX))
+
+  def _closed_segments(self):
+    """Lists the names of the segment files except the active one."""
+    return [n for n in self._segments()
+            if os.path.join(self._directory, n) != self._active_path]
+
+  def _size(self):
+    """Computes the total size in bytes of all segments."""
+    return sum(os.path.getsize(os.path.join(self._directory, n))
+               for n in self._segments())
+
+  def _open_segment(self):
+    """Starts a new active segment."""
+    name = '%020d%s' % (self._next_segment, SEGMENT_SUFFIX)
+    self._next_segment += 1
+    self._active_path = os.path.join(self._directory, name)
+    self._active = open(self._active_path, 'ab')
+    self._active.write(SEGMENT_HEADER)
+
+  def _close_segment(self):
+    """Flushes and closes the active segment, if there is one."""
+    if self._active is None:
+      return
+
+    self._active.flush()
+    if self._fsync != FSYNC_NEVER:
+      os.fsync(self._active.fileno())
+
+    self._active.close()
+    self._active = None
+    self._active_path = None
+
+  def _make_room(self, size):
+    """Deletes the oldest segments until the spool has room for more data."""
+    total = self._size()
+    for name in self._segments():
+      if total + size <= self._max_bytes:
+        return
+
+      path = os.path.join(self._directory, name)
+      if path == self._active_path:
+        self._close_segment()
+
+      dropped = os.path.getsize(path)
+      logging.warning('The spool is full. Dropping %d bytes of data in %s.',
+                      dropped, name)
+      self._remove_segment(path)
+      self.dropped_bytes += dropped
+      total -= dropped
+
+  @staticmethod
+  def _remove_segment(path):
+    """Deletes a segment and its checkpoint."""
+    for p in (path, path + CHECKPOINT_SUFFIX):
+      if os.path.exists(p):
+        os.unlink(p)
+
+
+class SpoolReplayer:
+  """Periodically replays a spool into the database from a background thread.
+
+  Spooled values that already exist in the database are ignored, so that data
+  written by an earlier attempt that failed to record its progress (e.g.
+  because of a crash) is not duplicated.
+  """
+
+  def __init__(self, spool, db_con, interval=DEFAULT_REPLAY_INTERVAL,
+               batch_size=DEFAULT_REPLAY_BATCH_SIZE):
+    """Creates a new replayer and starts its thread.
+
+    Args:
+      spool: The spool to replay.
+      db_con: A handle to the database.
+      interval: The time in seconds between attempts to replay the spool.
+      batch_size: The number of records written in a single transaction.
+    """
+    self._spool = spool
+    self._db_con = db_con
+    self._interval = interval
+    self._batch_size = batch_size
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='spool-replayer',
+                                    daemon=True)
+    self._thread.start()
+
+  def close(self):
+    """Stops the replayer thread."""
+    self._stop.set()
+    self._thread.join()
+
+  def _run(self):
+    """Replays the spool whenever it contains data."""
+    while not self._stop.wait(self._interval):
+      if self._spool.empty():
+        continue
+
+      try:
+        count = self._spool.replay(
+          functools.partial(self._db_con.write_data,
+                            on_conflict=db_accessor.ON_CONFLICT_IGNORE),
+          self._batch_size)
+        logging.info('Replayed %d spooled rows.', count)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.warning('Failed to replay the spool: %r', e)
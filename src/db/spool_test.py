@@ -0,0 +1,151 @@
+"""Spool unit tests."""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from db import db_model, spool, testdb
+
+
+def new_data(count, topic_id=1):
+  """Creates a series of topic values one second apart."""
+  start = datetime.datetime(2018, 1, 1, 12, 0, 0, 250)
+  return testdb.new_data(start, start + datetime.timedelta(seconds=count - 1),
+                         topic_id, '1.5', datetime.timedelta(seconds=1))
+
+
+def to_tuples(data):
+  """Converts topic values into comparable tuples."""
+  return [(d.ts, d.topic_id, d.value_string) for d in data]
+
+
+class FailingWriter:
+  """Records batches, failing once a number of them have been written."""
+
+  def __init__(self, fail_after=None):
+    self.batches = []
+    self.fail_after = fail_after
+
+  def __call__(self, batch):
+    if self.fail_after is not None and len(self.batches) >= self.fail_after:
+      raise ConnectionError('unavailable')
+
+    self.batches.append(batch)
+
+
+class SpoolTestCase(unittest.TestCase):
+  """A test case for spool operations."""
+
+  def setUp(self):
+    """Creates a temporary spool directory."""
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    """Removes the temporary spool directory."""
+    shutil.rmtree(self.directory)
+
+  def test_round_trip(self):
+    """Tests that spooled data is replayed in order and then removed."""
+    for use_mmap in (False, True):
+      s = spool.Spool(self.directory, segment_size=200, use_mmap=use_mmap)
+      data = new_data(10) + [db_model.TopicDatum(
+        datetime.datetime(2018, 1, 2), 2, 'Nexus é')]
+      s.write_data(data[:4])
+      s.write_data(data[4:])
+      self.assertFalse(s.empty())
+
+      writer = FailingWriter()
+      self.assertEqual(11, s.replay(writer, batch_size=3))
+      self.assertEqual(to_tuples(data),
+                       [t for b in writer.batches for t in to_tuples(b)])
+      self.assertTrue(s.empty())
+      self.assertEqual([], os.listdir(self.directory))
+
+  def test_reopen(self):
+    """Tests that data survives reopening the spool."""
+    s = spool.Spool(self.directory, fsync=spool.FSYNC_ALWAYS)
+    s.write_data(new_data(3))
+    s.close()
+
+    s = spool.Spool(self.directory)
+    s.write_data(new_data(2, topic_id=2))
+    writer = FailingWriter()
+    self.assertEqual(5, s.replay(writer))
+    self.assertEqual([1, 1, 1, 2, 2],
+                     [d.topic_id for b in writer.batches for d in b])
+
+  def test_failed_replay_resumes(self):
+    """Tests that batches written before a failure are not written again."""
+    s = spool.Spool(self.directory)
+    data = new_data(10)
+    s.write_data(data)
+
+    with self.assertRaises(ConnectionError):
+      s.replay(FailingWriter(fail_after=2), batch_size=3)
+
+    writer = FailingWriter()
+    self.assertEqual(4, s.replay(writer, batch_size=3))
+    self.assertEqual(to_tuples(data[6:]),
+                     [t for b in writer.batches for t in to_tuples(b)])
+
+  def test_failed_replay_keeps_active_segment(self):
+    """Tests that failed replays do not close a segment per attempt."""
+    s = spool.Spool(self.directory)
+    data = new_data(10)
+    s.write_data(data[:5])
+    with self.assertRaises(ConnectionError):
+      s.replay(FailingWriter(fail_after=0))
+
+    # The segment that failed is closed, and new data is appended to the next
+    # one, which stays open while the earlier segment cannot be written.
+    for i in range(5, 10):
+      s.write_data(data[i:i + 1])
+      with self.assertRaises(ConnectionError):
+        s.replay(FailingWriter(fail_after=0))
+
+    self.assertEqual(2, len(os.listdir(self.directory)))
+    writer = FailingWriter()
+    self.assertEqual(10, s.replay(writer))
+    self.assertEqual(to_tuples(data),
+                     [t for b in writer.batches for t in to_tuples(b)])
+    self.assertTrue(s.empty())
+
+  def test_torn_record(self):
+    """Tests that a partially written record ends the segment."""
+    s = spool.Spool(self.directory)
+    s.write_data(new_data(3))
+    s.close()
+
+    name = os.listdir(self.directory)[0]
+    with open(os.path.join(self.directory, name), 'r+b') as f:
+      f.truncate(os.path.getsize(f.name) - 2)
+
+    writer = FailingWriter()
+    self.assertEqual(2, spool.Spool(self.directory).replay(writer))
+
+  def test_bounded_size(self):
+    """Tests that the oldest segments are dropped to stay within the limit."""
+    record_size = len(spool.encode_datum(new_data(1)[0]))
+    segment_size = len(spool.SEGMENT_HEADER) + 10 * record_size
+    s = spool.Spool(self.directory, segment_size=segment_size,
+                    max_bytes=3 * segment_size)
+    for i in range(0, 5):
+      s.write_data(new_data(10, topic_id=i))
+
+    self.assertLessEqual(s.size, 3 * segment_size)
+    self.assertEqual(2 * segment_size, s.dropped_bytes)
+
+    writer = FailingWriter()
+    s.replay(writer)
+    self.assertEqual([2, 3, 4], sorted({d.topic_id for b in writer.batches
+                                        for d in b}))
+
+  def test_invalid_fsync_policy(self):
+    """Tests that unknown fsync policies are rejected."""
+    with self.assertRaises(ValueError):
+      spool.Spool(self.directory, fsync='sometimes')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,146 @@
+"""A program that measures concurrent reads and writes of a SQLite database.
+
+Several threads write batches of values while others read recent values, for a
+fixed time, first with the default SQLite settings and then with
+--db_sqlite_production (see db/sqlite_profile.py). For each, the program prints
+the number of rows written and reads completed per second, and the number of
+operations that failed (e.g. with "database is locked").
+
+    $ PYTHONPATH=. python db/sqlite_benchmark.py
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import sqlalchemy.exc
+from db import db_accessor, db_model, testdb
+
+DEFAULT_SECONDS = 5
+DEFAULT_WRITERS = 4
+DEFAULT_READERS = 8
+DEFAULT_BATCH_SIZE = 100
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+  benchmark_group = parser.add_argument_group(
+    'benchmark', 'Benchmark arguments.')
+  benchmark_group.add_argument(
+    '--seconds', type=float, default=DEFAULT_SECONDS,
+    help='How long each configuration is measured for.')
+  benchmark_group.add_argument(
+    '--writers', type=int, default=DEFAULT_WRITERS,
+    help='The number of threads that write values.')
+  benchmark_group.add_argument(
+    '--readers', type=int, default=DEFAULT_READERS,
+    help='The number of threads that read values.')
+  benchmark_group.add_argument(
+    '--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+    help='The number of values written in each transaction.')
+  return parser.parse_args()
+
+
+class _Counter:
+  """A thread-safe count of operations and failures."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.count = 0
+    self.errors = 0
+
+  def add(self, count=0, errors=0):
+    with self._lock:
+      self.count += count
+      self.errors += errors
+
+
+def _write(db_con, topic_id, batch_size, stop, counter):
+  """Writes batches of one value per second for a topic until stopped."""
+  ts = datetime.datetime(2018, 1, 1)
+  second = datetime.timedelta(seconds=1)
+  while not stop.is_set():
+    data = [db_model.TopicDatum(ts + i * second, topic_id, str(i))
+            for i in range(0, batch_size)]
+    try:
+      db_con.write_data(data)
+      counter.add(count=batch_size)
+      ts += batch_size * second
+    except sqlalchemy.exc.OperationalError:
+      counter.add(errors=1)
+
+
+def _read(db_con, topic_ids, stop, counter):
+  """Reads an hour of values for the topics until stopped."""
+  while not stop.is_set():
+    try:
+      end = db_con.get_latest_data_timestamp(topic_ids)
+      if end is not None:
+        db_con.get_data(topic_ids, end - datetime.timedelta(hours=1), end, 1)
+
+      counter.add(count=1)
+    except sqlalchemy.exc.OperationalError:
+      counter.add(errors=1)
+
+
+def measure(sqlite_production, args):
+  """Measures concurrent reads and writes with a SQLite configuration.
+
+  Args:
+    sqlite_production: Whether the production profile is used.
+    args: The parsed program arguments.
+
+  Returns:
+    A (writes, reads) pair of _Counter objects.
+  """
+  db_dir = tempfile.mkdtemp()
+  try:
+    db_file = os.path.join(db_dir, 'uwsolar.db')
+    testdb.create_engine(db_file)
+    opts = db_accessor.DatabaseOptions(
+      'sqlite', None, None, db_file, None, None, db_accessor.STORAGE_TYPED,
+      sqlite_production=sqlite_production)
+    db_con = db_accessor.DatabaseAccessor(opts)
+    topic_ids = list(range(1, args.writers + 1))
+    stop = threading.Event()
+    writes = _Counter()
+    reads = _Counter()
+    threads = [threading.Thread(target=_write, args=(
+      db_con, topic_id, args.batch_size, stop, writes))
+               for topic_id in topic_ids]
+    threads += [threading.Thread(target=_read, args=(
+      db_con, topic_ids, stop, reads)) for _ in range(0, args.readers)]
+    for thread in threads:
+      thread.start()
+
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+      thread.join()
+
+    db_con.close()
+    return writes, reads
+  finally:
+    shutil.rmtree(db_dir)
+
+
+def main():
+  """Parses command line arguments and runs the benchmark."""
+  args = parse_arguments()
+  for name, sqlite_production in (('default', False), ('production', True)):
+    writes, reads = measure(sqlite_production, args)
+    print('%-10s %10.0f rows/s written %8.0f reads/s %6d errors' % (
+      name, writes.count / args.seconds, reads.count / args.seconds,
+      writes.errors + reads.errors))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,109 @@
+"""Settings for serving a SQLite database to concurrent readers and writers.
+
+By default, SQLite locks the whole database while a transaction writes to it,
+so concurrent readers and writers fail with "database is locked", and every
+commit waits for several fsyncs. In production, a DatabaseAccessor connects to
+a SQLite database with two engines instead:
+
+  * Every connection uses write-ahead logging (WAL), so that readers do not
+    block the writer or each other, and synchronous=NORMAL, so that commits
+    only fsync the log at checkpoints. The database is memory-mapped, a larger
+    page cache is used, and a connection waits for locks held by other
+    processes instead of failing immediately.
+  * Writes are executed on a single connection, by a single thread (see
+    DatabaseAccessor), so that writers within a process never contend for the
+    database lock.
+  * Reads are served from a pool of read-only connections.
+
+With synchronous=NORMAL, a transaction committed just before a power failure
+may be rolled back, but the database is not corrupted.
+"""
+
+import sqlalchemy
+import sqlalchemy.pool
+
+# The default synchronous setting, which is one of OFF, NORMAL or FULL.
+DEFAULT_SYNCHRONOUS = 'NORMAL'
+
+# The default number of bytes of the database that are memory-mapped.
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+
+# The default size of each connection's page cache. Negative sizes are in KiB.
+DEFAULT_CACHE_SIZE = -64 * 1024
+
+# The default time in milliseconds to wait for a lock held by another process.
+DEFAULT_BUSY_TIMEOUT = 5000
+
+
+def pragmas(query_only=False, synchronous=DEFAULT_SYNCHRONOUS,
+            mmap_size=DEFAULT_MMAP_SIZE, cache_size=DEFAULT_CACHE_SIZE,
+            busy_timeout=DEFAULT_BUSY_TIMEOUT):
+  """Builds the statements that configure a connection.
+
+  Args:
+    query_only: Whether the connection should be prevented from writing.
+    synchronous: The synchronous setting.
+    mmap_size: The number of bytes of the database that are memory-mapped.
+    cache_size: The size of the page cache, in pages or (if negative) KiB.
+    busy_timeout: The time in milliseconds to wait for a lock.
+
+  Returns:
+    A list of PRAGMA statements.
+  """
+  statements = ['PRAGMA journal_mode=WAL',
+                'PRAGMA synchronous=%s' % synchronous,
+                'PRAGMA mmap_size=%d' % mmap_size,
+                'PRAGMA cache_size=%d' % cache_size,
+                'PRAGMA busy_timeout=%d' % busy_timeout]
+  if query_only:
+    statements.append('PRAGMA query_only=ON')
+
+  return statements
+
+
+def _configure(engine, statements):
+  """Executes statements on every new connection of an engine."""
+
+  def on_connect(dbapi_con, connection_record):
+    del connection_record
+    cursor = dbapi_con.cursor()
+    try:
+      for statement in statements:
+        cursor.execute(statement)
+    finally:
+      cursor.close()
+
+  sqlalchemy.event.listen(engine, 'connect', on_connect)
+
+
+def create_engines(path, pool_size=None):
+  """Creates the engines of a SQLite database.
+
+  Args:
+    path: The path of the database file.
+    pool_size: The number of read connections that are kept open, or None to
+        use SQLAlchemy's default.
+
+  Returns:
+    A (read, write) pair of engines. The write engine has a single connection,
+    which should only be used by one thread at a time.
+
+  Raises:
+    ValueError: The database is in memory, so that each connection would have
+        its own database.
+  """
+  if path == ':memory:':
+    raise ValueError('The production profile requires a database file.')
+
+  dsn = 'sqlite:///%s' % path
+  connect_args = {'check_same_thread': False}
+  pool_args = {} if pool_size is None else {'pool_size': pool_size}
+  read_engine = sqlalchemy.create_engine(
+    dsn, connect_args=connect_args, poolclass=sqlalchemy.pool.QueuePool,
+    **pool_args)
+  _configure(read_engine, pragmas(query_only=True))
+
+  write_engine = sqlalchemy.create_engine(
+    dsn, connect_args=connect_args, poolclass=sqlalchemy.pool.StaticPool)
+  _configure(write_engine, pragmas())
+  return read_engine, write_engine
@@ -0,0 +1,82 @@
+"""SQLite production profile unit tests."""
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import sqlalchemy
+import sqlalchemy.exc
+from db import db_accessor, db_model, sqlite_profile, testdb
+
+
+class SqliteProfileTestCase(unittest.TestCase):
+  """A test case for accessors using the production SQLite profile."""
+
+  def setUp(self):
+    """Creates a temporary database and an accessor using the profile."""
+    self.db_dir = tempfile.mkdtemp()
+    self.db_file = os.path.join(self.db_dir, 'uwsolar.db')
+    testdb.create_engine(self.db_file)
+    opts = db_accessor.DatabaseOptions(
+      'sqlite', None, None, self.db_file, None, None,
+      db_accessor.STORAGE_TYPED, sqlite_production=True)
+    self.db_con = db_accessor.DatabaseAccessor(opts)
+    self.start = datetime.datetime(2018, 1, 1)
+
+  def tearDown(self):
+    """Closes the accessor and removes the temporary database."""
+    self.db_con.close()
+    shutil.rmtree(self.db_dir)
+
+  def test_pragmas(self):
+    """Tests that connections are configured, and reads cannot write."""
+    with self.db_con.engine.connect() as con:
+      self.assertEqual('wal', con.execute('PRAGMA journal_mode').scalar())
+      self.assertEqual(1, con.execute('PRAGMA synchronous').scalar())
+      self.assertEqual(sqlite_profile.DEFAULT_CACHE_SIZE,
+                       con.execute('PRAGMA cache_size').scalar())
+      self.assertRaises(sqlalchemy.exc.OperationalError, con.execute,
+                        db_model.Topic.__table__.insert().values(
+                          topic_name='topic'))
+
+    self.assertRaises(ValueError, sqlite_profile.create_engines, ':memory:')
+
+  def test_concurrent_writes(self):
+    """Tests that writes from several threads run on the writer thread."""
+    threads = set()
+
+    def before_cursor_execute(*args):
+      del args
+      threads.add(threading.current_thread().name)
+
+    sqlalchemy.event.listen(self.db_con._write_engine, 'before_cursor_execute',
+                            before_cursor_execute)
+
+    def write(topic_id):
+      for i in range(0, 20):
+        self.db_con.write_data(testdb.new_data(
+          self.start + datetime.timedelta(minutes=i), self.start
+          + datetime.timedelta(minutes=i, seconds=50), topic_id, '1',
+          datetime.timedelta(seconds=10)))
+        self.db_con.get_data([topic_id], self.start,
+                             self.start + datetime.timedelta(hours=1), 1)
+
+    writers = [threading.Thread(target=write, args=(topic_id,))
+               for topic_id in range(1, 5)]
+    for writer in writers:
+      writer.start()
+
+    for writer in writers:
+      writer.join()
+
+    self.db_con.get_topic_ids(['topic'])
+    self.assertEqual(1, len(threads))
+    self.assertTrue(threads.pop().startswith('sqlite-writer'))
+    self.assertEqual([120] * 4, [w.row_count for w in sorted(
+      self.db_con.get_topic_watermarks(), key=lambda w: w.topic_id)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -20,16 +20,20 @@ def create_engine(db_file):
   return engine
 
 
-def create_accessor(db_file):
+def create_accessor(db_file, storage_mode=db_accessor.STORAGE_LEGACY,
+                    archive_dir=None):
   """Creates a database accessor object.
 
   Args:
     db_file: The file containing SQLite database data.
+    storage_mode: Which tables values are stored in.
+    archive_dir: The directory containing archived values, if any.
 
   Returns:
     A database accessor object.
   """
-  opts = db_accessor.DatabaseOptions('sqlite', None, None, db_file, None, None)
+  opts = db_accessor.DatabaseOptions('sqlite', None, None, db_file, None, None,
+                                     storage_mode, archive_dir)
   return db_accessor.DatabaseAccessor(opts)
 
 
@@ -0,0 +1,189 @@
+"""A program that measures how quickly data can be written to the database.
+
+Rows are written in batches through the ORM's unit of work (the original
+implementation of DatabaseAccessor.write_data), through the current Core
+executemany path with each form of conflict handling, and to the typed_data
+table. The throughput of each method is printed in rows per second.
+
+Like the other programs in this directory, the benchmark imports the db
+package, so it must be run from the src directory, either with PYTHONPATH set
+or as a module. By default a temporary SQLite database is used:
+
+    $ PYTHONPATH=. python db/write_benchmark.py
+    $ python -m db.write_benchmark
+
+A MySQL database may be measured instead. It should be a scratch database
+prepared with migrate.py, since the benchmark writes rows for topic IDs
+starting at --topic_id_base and deletes them when it finishes:
+
+    $ PYTHONPATH=. python db/write_benchmark.py \
+          --db_type=mysql+mysqlconnector --db_host=localhost
+"""
+
+import argparse
+import dataclasses
+import datetime
+import os
+import tempfile
+import time
+import sqlalchemy.orm
+from db import db_accessor, db_model, rollups
+
+DEFAULT_DB_TYPE = 'sqlite'
+DEFAULT_DB_USER = 'uwsolar'
+DEFAULT_DB_PASSWORD = ''
+DEFAULT_DB_NAME = 'uwsolar'
+DEFAULT_ROWS = 100000
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_TOPICS = 20
+DEFAULT_TOPIC_ID_BASE = 1000000
+
+
+def parse_arguments():
+  """Parses command line options.
+
+  Returns:
+    An object containing parsed program arguments.
+  """
+  parser = argparse.ArgumentParser()
+
+  # Database connectivity arguments.
+  db_group = parser.add_argument_group(
+    'database', 'Database connectivity arguments.')
+  db_group.add_argument(
+    '--db_type', choices=['mysql+mysqlconnector', 'sqlite'],
+    default=DEFAULT_DB_TYPE, help='Which database type should be used.')
+  db_group.add_argument(
+    '--db_user', default=DEFAULT_DB_USER, help='The database user.')
+  db_group.add_argument(
+    '--db_password', default=DEFAULT_DB_PASSWORD, help='The database password.')
+  db_group.add_argument(
+    '--db_host',
+    help='The database host. Defaults to a temporary SQLite database.')
+  db_group.add_argument(
+    '--db_name', default=DEFAULT_DB_NAME, help='The database name.')
+
+  # Benchmark arguments.
+  benchmark_group = parser.add_argument_group(
+    'benchmark', 'Benchmark arguments.')
+  benchmark_group.add_argument(
+    '--rows', type=int, default=DEFAULT_ROWS,
+    help='The number of rows written by each method.')
+  benchmark_group.add_argument(
+    '--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+    help='The number of rows written in each transaction.')
+  benchmark_group.add_argument(
+    '--topics', type=int, default=DEFAULT_TOPICS,
+    help='The number of topics to write rows for.')
+  benchmark_group.add_argument(
+    '--topic_id_base', type=int, default=DEFAULT_TOPIC_ID_BASE,
+    help='The first topic ID to write rows for.')
+
+  return parser.parse_args()
+
+
+def create_data(rows, topics, topic_id_base, start):
+  """Creates rows for several topics, one timestamp per second.
+
+  Args:
+    rows: The number of rows to create.
+    topics: The number of topics.
+    topic_id_base: The first topic ID.
+    start: The timestamp of the first rows.
+
+  Returns:
+    A list of TopicDatum objects.
+  """
+  return [db_model.TopicDatum(
+    start + datetime.timedelta(seconds=i // topics),
+    topic_id_base + i % topics, str(i * 0.5)) for i in range(0, rows)]
+
+
+def write_orm(db_con, data):
+  """Writes rows through the ORM's unit of work."""
+  s = sqlalchemy.orm.Session(db_con.engine)
+  try:
+    s.add_all(data)
+    s.commit()
+  finally:
+    s.close()
+
+
+def measure(write, data, batch_size):
+  """Writes rows in batches and measures the throughput.
+
+  Args:
+    write: A function that writes a list of rows.
+    data: The rows to write.
+    batch_size: The number of rows passed to each call to write.
+
+  Returns:
+    The throughput in rows per second.
+  """
+  start = time.perf_counter()
+  for i in range(0, len(data), batch_size):
+    write(data[i:i + batch_size])
+
+  return len(data) / (time.perf_counter() - start)
+
+
+def delete_data(db_con, topic_id_base, topics):
+  """Deletes the rows written by the benchmark."""
+  with db_con.engine.begin() as con:
+    for table in (db_model.TopicDatum.__table__, db_model.TypedDatum.__table__,
+                  db_model.TopicWatermark.__table__):
+      con.execute(table.delete().where(
+        table.c.topic_id.between(topic_id_base, topic_id_base + topics - 1)))
+
+    for rollup in rollups.ROLLUPS:
+      table = rollup.model.__table__
+      con.execute(table.delete().where(
+        table.c.topic_id.between(topic_id_base, topic_id_base + topics - 1)))
+
+
+def main():
+  """Parses command line arguments and runs the benchmark."""
+  args = parse_arguments()
+
+  db_file = None
+  db_host = args.db_host
+  if db_host is None:
+    if args.db_type != 'sqlite':
+      raise ValueError('--db_host is required for %s.' % args.db_type)
+
+    fd, db_file = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    db_host = db_file
+
+  db_opts = db_accessor.DatabaseOptions(
+    args.db_type, args.db_user, args.db_password, db_host, args.db_name, 1)
+  db_con = db_accessor.DatabaseAccessor(db_opts)
+  typed_con = db_accessor.DatabaseAccessor(dataclasses.replace(
+    db_opts, storage_mode=db_accessor.STORAGE_TYPED))
+  if db_file:
+    db_model.BASE.metadata.create_all(db_con.engine)
+
+  methods = [
+    ('orm add_all', lambda d: write_orm(db_con, d)),
+    ('core', db_con.write_data),
+    ('core ignore', lambda d: db_con.write_data(
+      d, on_conflict=db_accessor.ON_CONFLICT_IGNORE)),
+    ('core update', lambda d: db_con.write_data(
+      d, on_conflict=db_accessor.ON_CONFLICT_UPDATE)),
+    ('core typed', typed_con.write_data)
+  ]
+
+  try:
+    start = datetime.datetime(2000, 1, 1)
+    for name, write in methods:
+      data = create_data(args.rows, args.topics, args.topic_id_base, start)
+      rate = measure(write, data, args.batch_size)
+      print('%-12s %10.0f rows/s' % (name, rate))
+      delete_data(db_con, args.topic_id_base, args.topics)
+  finally:
+    if db_file:
+      os.unlink(db_file)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,235 @@
+"""A write-behind queue that batches data on its way to the database.
+
+Committing a transaction for every collection cycle makes the collector wait on
+database latency once per second. Instead, collected data is placed in a
+bounded in-memory queue and written by a background thread. The thread writes
+a batch in a single transaction as soon as enough rows are queued, or once the
+oldest queued row has waited for the maximum delay.
+
+When the database falls far enough behind that the queue is full, writers block
+until there is room. This applies backpressure to collection rather than
+allowing memory use to grow without bound.
+
+A batch that cannot be written (e.g. because the database is down) is passed to
+a fallback, such as a spool.Spool, so that it may be written later. Writers
+that need to know when their rows reach the database may pass a callback, which
+is called with the number of their rows in each batch that is written.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+# The default number of rows that may be queued before writers block.
+DEFAULT_MAX_SIZE = 100000
+
+# The default number of rows written in a single transaction.
+DEFAULT_BATCH_SIZE = 1000
+
+# The default time in seconds that a row may wait before it is written.
+DEFAULT_MAX_DELAY = 1
+
+
+class QueueClosedError(Exception):
+  """Raised when data is written to a queue that has been closed."""
+
+
+class WriteBehindQueue:
+  """Writes data to the database in batches from a background thread."""
+
+  def __init__(self, db_con, max_size=DEFAULT_MAX_SIZE,
+               batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY,
+               fallback=None):
+    """Creates a new queue and starts its writer thread.
+
+    Args:
+      db_con: A handle to the database, used to write each batch.
+      max_size: The number of rows that may be queued before writers block.
+      batch_size: The largest number of rows written in a single transaction.
+      max_delay: The time in seconds that a row may wait before it is written.
+      fallback: An object whose write_data method is passed each batch that
+          cannot be written to the database, or None to discard such batches.
+    """
+    self._db_con = db_con
+    self._fallback = fallback
+    self._max_size = max(1, max_size)
+    self._batch_size = max(1, batch_size)
+    self._max_delay = max_delay
+
+    self._cond = threading.Condition()
+    self._rows = collections.deque()
+    # A [row count, callback] pair for each list of queued rows, in order.
+    self._calls = collections.deque()
+    self._oldest = None
+    self._in_flight = 0
+    self._closed = False
+    self.failed_rows = 0
+
+    self._writer = threading.Thread(target=self._run, name='write-behind',
+                                    daemon=True)
+    self._writer.start()
+
+  @property
+  def pending(self):
+    """The number of rows that have not yet been written."""
+    with self._cond:
+      return len(self._rows) + self._in_flight
+
+  def write_data(self, data, timeout=None, on_written=None):
+    """Queues a list of topic values to be written to the database.
+
+    Args:
+      data: A list of topic values to be written.
+      timeout: The longest time in seconds to wait for room in the queue, or
+          None to wait forever.
+      on_written: A function that is called from the writer thread with the
+          number of the values in each batch that is written to the database.
+          Values that fail to be written, or are passed to the fallback, are
+          not reported.
+
+    Returns:
+      True if the data was queued, and False if the wait timed out.
+
+    Raises:
+      QueueClosedError: When the queue has been closed.
+    """
+    if not data:
+      return True
+
+    with self._cond:
+      # A list larger than the queue is accepted once the queue is empty.
+      if not self._cond.wait_for(
+          lambda: (self._closed or not self._rows
+                   or len(self._rows) + len(data) <= self._max_size),
+          timeout):
+        return False
+
+      if self._closed:
+        raise QueueClosedError('The write-behind queue is closed.')
+
+      if not self._rows:
+        self._oldest = time.monotonic()
+
+      self._rows.extend(data)
+      self._calls.append([len(data), on_written])
+      self._cond.notify_all()
+      return True
+
+  def flush(self, timeout=None):
+    """Waits for every queued row to be written.
+
+    Args:
+      timeout: The longest time in seconds to wait, or None to wait forever.
+
+    Returns:
+      True if the queue was drained, and False if the wait timed out.
+    """
+    with self._cond:
+      self._oldest = time.monotonic() - self._max_delay
+      self._cond.notify_all()
+      return self._cond.wait_for(
+        lambda: not self._rows and not self._in_flight, timeout)
+
+  def close(self):
+    """Writes any queued rows and stops the writer thread."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+    self._writer.join()
+
+  def _next_batch(self):
+    """Waits for a batch of rows to be ready.
+
+    Returns:
+      A list of rows, or None when the queue is closed and empty.
+    """
+    with self._cond:
+      while True:
+        if self._rows:
+          age = time.monotonic() - self._oldest
+          if (self._closed or len(self._rows) >= self._batch_size
+              or age >= self._max_delay):
+            break
+
+          self._cond.wait(self._max_delay - age)
+        elif self._closed:
+          return None
+        else:
+          self._cond.wait()
+
+      count = min(len(self._rows), self._batch_size)
+      batch = [self._rows.popleft() for _ in range(0, count)]
+      self._in_flight = count
+      if not self._rows:
+        self._oldest = None
+      self._cond.notify_all()
+      return batch
+
+  def _run(self):
+    """Writes batches of rows until the queue is closed."""
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+
+      try:
+        written = self._write(batch)
+        self._report(len(batch), written)
+      finally:
+        with self._cond:
+          self._in_flight = 0
+          self._cond.notify_all()
+
+  def _write(self, batch):
+    """Writes a batch to the database, or to the fallback if that fails.
+
+    Returns:
+      True if the batch was written to the database.
+    """
+    try:
+      self._db_con.write_data(batch)
+      return True
+    except Exception as e:  # pylint: disable=broad-except
+      if self._fallback is None:
+        logging.exception('Failed to write %d rows.', len(batch))
+        self.failed_rows += len(batch)
+        return False
+
+      logging.warning('Failed to write %d rows, spooling them: %r', len(batch),
+                      e)
+
+    try:
+      self._fallback.write_data(batch)
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Failed to spool %d rows.', len(batch))
+      self.failed_rows += len(batch)
+
+    return False
+
+  def _report(self, count, written):
+    """Attributes the rows of a batch to the lists in which they were queued.
+
+    Args:
+      count: The number of rows in the batch.
+      written: Whether the batch was written to the database, in which case
+          the callbacks of the lists are called.
+    """
+    reports = []
+    with self._cond:
+      while count:
+        call = self._calls[0]
+        n = min(count, call[0])
+        call[0] -= n
+        count -= n
+        if not call[0]:
+          self._calls.popleft()
+        if written and call[1] is not None:
+          reports.append((call[1], n))
+
+    for on_written, n in reports:
+      try:
+        on_written(n)
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Failed to report %d written rows.', n)
@@ -0,0 +1,121 @@
+"""Write-behind queue unit tests."""
+
+import threading
+import time
+import unittest
+from db import write_queue
+
+
+class FakeDatabase:
+  """A stand-in for a database that records each batch written to it."""
+
+  def __init__(self):
+    self.batches = []
+    self.error = None
+    self.release = threading.Event()
+    self.release.set()
+
+  def write_data(self, data):
+    self.release.wait()
+    if self.error:
+      raise self.error
+
+    self.batches.append(list(data))
+
+
+class WriteBehindQueueTestCase(unittest.TestCase):
+  """A test case for write-behind queue operations."""
+
+  def setUp(self):
+    """Creates a queue in front of a fake database."""
+    self.db_con = FakeDatabase()
+    self.queue = write_queue.WriteBehindQueue(
+      self.db_con, max_size=10, batch_size=4, max_delay=0.05)
+
+  def tearDown(self):
+    """Stops the queue's writer thread."""
+    self.db_con.release.set()
+    self.queue.close()
+
+  def test_batch_by_size(self):
+    """Tests that full batches are written without waiting."""
+    self.db_con.release.clear()
+    self.queue.write_data(list(range(0, 9)))
+    self.db_con.release.set()
+    self.assertTrue(self.queue.flush(1))
+    self.assertEqual([[0, 1, 2, 3], [4, 5, 6, 7], [8]], self.db_con.batches)
+
+  def test_batch_by_age(self):
+    """Tests that a partial batch is written once it is old enough."""
+    start = time.monotonic()
+    self.queue.write_data([1])
+    self.queue.write_data([2])
+    while not self.db_con.batches:
+      time.sleep(0.01)
+
+    self.assertGreaterEqual(time.monotonic() - start, 0.04)
+    self.assertEqual([[1, 2]], self.db_con.batches)
+
+  def test_backpressure(self):
+    """Tests that writers wait when the queue is full."""
+    self.db_con.release.clear()
+    self.assertTrue(self.queue.write_data(list(range(0, 10))))
+    self.assertFalse(self.queue.write_data(list(range(0, 8)), timeout=0.05))
+
+    # A batch is in flight, so there is room for four more rows.
+    self.assertTrue(self.queue.write_data(list(range(0, 4)), timeout=0.05))
+    self.assertEqual(14, self.queue.pending)
+    self.db_con.release.set()
+    self.assertTrue(self.queue.write_data([1], timeout=1))
+
+  def test_close(self):
+    """Tests that queued rows are written when the queue is closed."""
+    self.queue.write_data([1, 2])
+    self.queue.close()
+    self.assertEqual([[1, 2]], self.db_con.batches)
+    with self.assertRaises(write_queue.QueueClosedError):
+      self.queue.write_data([3])
+
+  def test_failure(self):
+    """Tests that failed batches are counted and do not stop the writer."""
+    self.db_con.error = RuntimeError('unavailable')
+    self.queue.write_data([1, 2])
+    self.assertTrue(self.queue.flush(1))
+    self.assertEqual(2, self.queue.failed_rows)
+
+    self.db_con.error = None
+    self.queue.write_data([3])
+    self.assertTrue(self.queue.flush(1))
+    self.assertEqual([[3]], self.db_con.batches)
+
+  def test_on_written(self):
+    """Tests that writers are told how many of their rows were written."""
+    written = []
+    self.db_con.release.clear()
+    self.queue.write_data(list(range(0, 3)), on_written=written.append)
+    self.queue.write_data(list(range(0, 3)))
+    self.queue.write_data(list(range(0, 3)),
+                          on_written=lambda n: written.append(-n))
+    self.db_con.release.set()
+    self.assertTrue(self.queue.flush(1))
+    self.assertEqual([3, -2, -1], written)
+
+    self.db_con.error = RuntimeError('unavailable')
+    self.queue.write_data([1, 2], on_written=written.append)
+    self.assertTrue(self.queue.flush(1))
+    self.assertEqual([3, -2, -1], written)
+
+  def test_fallback(self):
+    """Tests that failed batches are passed to the fallback."""
+    fallback = FakeDatabase()
+    queue = write_queue.WriteBehindQueue(self.db_con, max_delay=0.01,
+                                         fallback=fallback)
+    self.db_con.error = RuntimeError('unavailable')
+    queue.write_data([1, 2])
+    queue.close()
+    self.assertEqual([[1, 2]], fallback.batches)
+    self.assertEqual(0, queue.failed_rows)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -48,7 +48,7 @@ import random
 import dateutil.parser
 import jsmin
 import sqlalchemy
-from db import db_model
+from db import db_accessor, db_model, rollups
 
 DEFAULT_SAMPLE_RATE = 0.01
 DEFAULT_PERIOD = 86400
@@ -194,15 +194,15 @@ def create_topic(topics, options):
   topics[options.topic_id] = topic
 
 
-def create_datum(options, ts):
-  """Creates a datum object for the given timestamp and topic.
+def create_value(options, ts):
+  """Computes the sinusoid value for the given timestamp.
 
   Args:
     options: The configuration options for the current data generation run.
-    ts: The datum timestamp.
+    ts: The timestamp.
 
   Returns:
-    A populated datum object, ready for insertion.
+    The generated value, including a random fuzz factor.
   """
   # value = offset
   #         + A_cos * cos(omega * t)
@@ -212,12 +212,24 @@ def create_datum(options, ts):
   seconds = (ts - options.start).total_seconds()
   fuzz = random.uniform(-options.spread, options.spread)
   x = omega * seconds
-  value = (options.amplitude_offset
-           + options.amplitude_cos * math.cos(x)
-           + options.amplitude_sin * math.sin(x)
-           + fuzz)
+  return (options.amplitude_offset
+          + options.amplitude_cos * math.cos(x)
+          + options.amplitude_sin * math.sin(x)
+          + fuzz)
+
+
+def create_datum(options, ts):
+  """Creates a datum object for the given timestamp and topic.
 
-  datum = db_model.TopicDatum(ts, options.topic_id, str(value))
+  Args:
+    options: The configuration options for the current data generation run.
+    ts: The datum timestamp.
+
+  Returns:
+    A populated datum object, ready for insertion.
+  """
+  datum = db_model.TopicDatum(ts, options.topic_id,
+                              str(create_value(options, ts)))
   return datum
 
 
@@ -275,6 +287,12 @@ def write_to_db(args, options, topics, data):
 
   # Write data.
   session.add_all(data.values())
+  session.flush()
+  topic_ids = {i.topic_id for i in options}
+  db_accessor.rebuild_topic_watermarks(session, topic_ids)
+  if options:
+    rollups.rebuild(session.connection(), min(i.start for i in options),
+                    max(i.end for i in options), topic_ids)
   session.commit()
   session.close()
 
@@ -0,0 +1,376 @@
+"""Simulates energy meters that serve generated data over Modbus TCP.
+
+Each simulated meter loads a metrics workbook (e.g. maps/nexus-metrics.xlsx)
+and answers "read holding registers" requests for the addresses it describes.
+Values are generated on demand by the same sinusoid model used by gendata.py,
+and are encoded with each metric's data type and scaling factor, so that the
+collector decodes them exactly as it would decode a real meter's registers.
+
+Several meters may be simulated at once, each listening on its own port. Faults
+can be injected to exercise the collector's failure handling:
+
+  - latency: A fixed delay in seconds added to every response.
+  - jitter: A random delay of up to this many seconds added to every response.
+  - drop_rate: The probability that a request is answered by closing the
+        connection instead.
+
+Waveforms may be customized with a JSON file mapping metric names to sinusoid
+options (period, amplitude_cos, amplitude_sin, amplitude_offset and spread; see
+gendata.py). Metrics that are not listed use a default waveform chosen by the
+metric name. For example:
+
+{
+  "W": {"amplitude_offset": 2000, "amplitude_cos": -2000, "spread": 50}
+}
+
+The simulator can also write a panels file describing the meters it serves,
+which can be passed directly to the collector:
+
+    $ PYTHONPATH=.. python simulator.py \
+          --metrics_workbook=../collector/maps/nexus-metrics.xlsx \
+          --meters=20 --base_port=5020 --panels_file=panels.json
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import logging
+import os
+import random
+import struct
+import jsmin
+import gendata
+from collector import metrics_builder, model, read_planner, register_decoder
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_BASE_PORT = 5020
+DEFAULT_METERS = 1
+DEFAULT_TOPIC_PREFIX = 'UW/Simulated/meter'
+DEFAULT_METRICS_WORKSHEET_NAME = 'Metrics'
+
+# The Modbus function code for reading holding registers.
+READ_HOLDING_REGISTERS = 0x03
+
+# Modbus exception codes.
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_VALUE = 0x03
+
+# The Modbus application protocol (MBAP) header: transaction ID, protocol ID,
+# length and unit ID.
+MBAP_HEADER = struct.Struct('>HHHB')
+
+# Default waveforms, keyed by metric name prefix. Power follows a daily solar
+# curve that peaks at noon; everything else hovers around a nominal value.
+DEFAULT_WAVEFORMS = [
+  ('Voltage', {'amplitude_offset': 120, 'spread': 0.5}),
+  ('Current', {'amplitude_offset': 2, 'spread': 0.2}),
+  ('W_', {'amplitude_offset': 1500, 'amplitude_cos': -1500, 'spread': 20}),
+  ('W', {'amplitude_offset': 4500, 'amplitude_cos': -4500, 'spread': 50}),
+  ('VAR', {'amplitude_offset': 300, 'spread': 30}),
+  ('VA', {'amplitude_offset': 4700, 'amplitude_cos': -4700, 'spread': 50}),
+  ('freq', {'amplitude_offset': 60, 'spread': 0.02}),
+  ('pf', {'amplitude_offset': 0.95, 'spread': 0.02}),
+  ('Angle', {'amplitude_offset': 0, 'spread': 1})
+]
+
+
+# Fault injection options for a simulated meter.
+#
+# Args:
+#   latency: A fixed delay in seconds added to every response.
+#   jitter: A random delay of up to this many seconds added to every response.
+#   drop_rate: The probability that a request is answered by closing the
+#       connection.
+@dataclasses.dataclass(frozen=True)
+class FaultOptions:
+  latency: float = 0
+  jitter: float = 0
+  drop_rate: float = 0
+
+
+def parse_arguments():
+  """Parses command line arguments.
+
+  Returns:
+    An object containing parsed arguments.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--log_level', default='INFO',
+                      help='The logging threshold.')
+
+  # Meter arguments.
+  meter_group = parser.add_argument_group('meter', 'Simulated meter arguments.')
+  meter_group.add_argument(
+    '--metrics_workbook', required=True,
+    help='The workbook containing the meter\'s metrics data.')
+  meter_group.add_argument(
+    '--metrics_worksheet_name', default=DEFAULT_METRICS_WORKSHEET_NAME,
+    help='The name of the worksheet containing metrics data.')
+  meter_group.add_argument(
+    '--waveforms_file',
+    help='A JSON file mapping metric names to waveform options.')
+  meter_group.add_argument(
+    '--meters', type=int, default=DEFAULT_METERS,
+    help='The number of meters to simulate.')
+  meter_group.add_argument('--host', default=DEFAULT_HOST,
+                           help='The address on which to listen.')
+  meter_group.add_argument(
+    '--base_port', type=int, default=DEFAULT_BASE_PORT,
+    help='The port of the first meter. Each further meter listens on the next '
+         'port.')
+  meter_group.add_argument(
+    '--panels_file',
+    help='If present, a panels file describing the simulated meters is '
+         'written to this path.')
+  meter_group.add_argument(
+    '--topic_prefix', default=DEFAULT_TOPIC_PREFIX,
+    help='The topic prefix written to the panels file. Each meter\'s index is '
+         'appended to it.')
+
+  # Fault injection arguments.
+  fault_group = parser.add_argument_group('faults', 'Fault injection arguments.')
+  fault_group.add_argument(
+    '--latency', type=float, default=0,
+    help='A fixed delay in seconds added to every response.')
+  fault_group.add_argument(
+    '--jitter', type=float, default=0,
+    help='A random delay of up to this many seconds added to every response.')
+  fault_group.add_argument(
+    '--drop_rate', type=float, default=0,
+    help='The probability that a request is answered by closing the '
+         'connection.')
+
+  return parser.parse_args()
+
+
+def waveform_options(metric, overrides=None, start=None):
+  """Chooses the waveform for a metric.
+
+  Args:
+    metric: The metric metadata.
+    overrides: A dict from metric name to waveform options.
+    start: The time at which the waveform's period begins. Defaults to the
+        most recent midnight.
+
+  Returns:
+    A gendata.DataOptions object.
+  """
+  if start is None:
+    start = datetime.datetime.combine(datetime.date.today(),
+                                      datetime.time.min)
+
+  options = {}
+  if overrides and metric.name in overrides:
+    options = overrides[metric.name]
+  else:
+    for prefix, defaults in DEFAULT_WAVEFORMS:
+      if metric.name.startswith(prefix):
+        options = defaults
+        break
+
+  return gendata.DataOptions(
+    start, None, None, metric.topic_name, None,
+    float(options.get('period', gendata.DEFAULT_PERIOD)),
+    float(options.get('amplitude_cos', gendata.DEFAULT_AMPLITUDE_COS)),
+    float(options.get('amplitude_sin', gendata.DEFAULT_AMPLITUDE_SIN)),
+    float(options.get('amplitude_offset', gendata.DEFAULT_AMPLITUDE_OFFSET)),
+    float(options.get('spread', gendata.DEFAULT_SPREAD)))
+
+
+class SimulatedMeter:
+  """Generates register values for a set of metrics."""
+
+  def __init__(self, metrics, waveforms, faults=FaultOptions()):
+    """Creates a new simulated meter.
+
+    Args:
+      metrics: A dict from the metric name to its metadata.
+      waveforms: A dict from the metric name to its gendata.DataOptions.
+      faults: The faults to inject into responses.
+    """
+    self._metrics = list(metrics.values())
+    self._waveforms = waveforms
+    self._faults = faults
+    self.requests = 0
+
+  @property
+  def faults(self):
+    return self._faults
+
+  def read_registers(self, address, count, ts=None):
+    """Generates the values of a range of registers.
+
+    Registers that are not mapped to a metric read as zero.
+
+    Args:
+      address: The address of the first register.
+      count: The number of registers to read.
+      ts: The time at which to sample each waveform. Defaults to now.
+
+    Returns:
+      A list of register values.
+    """
+    ts = ts or datetime.datetime.now()
+    registers = [0] * count
+    end = address + count
+    for metric in self._metrics:
+      if metric.address >= end or metric.address + metric.size <= address:
+        continue
+
+      value = gendata.create_value(self._waveforms[metric.name], ts)
+      if metric.data_type == model.MetricDataType.STRING:
+        value = metric.description or metric.name
+
+      encoded = register_decoder.encode_value(metric, value)
+      for i, register in enumerate(encoded):
+        if address <= metric.address + i < end:
+          registers[metric.address + i - address] = register
+
+    return registers
+
+  def handle(self, pdu):
+    """Answers a Modbus request.
+
+    Args:
+      pdu: The request's protocol data unit.
+
+    Returns:
+      The response's protocol data unit.
+    """
+    self.requests += 1
+    function_code = pdu[0]
+    if function_code != READ_HOLDING_REGISTERS or len(pdu) != 5:
+      return struct.pack('>BB', function_code | 0x80, ILLEGAL_FUNCTION)
+
+    address, count = struct.unpack('>HH', pdu[1:])
+    if not 1 <= count <= read_planner.MAX_REGISTERS_PER_READ:
+      return struct.pack('>BB', function_code | 0x80, ILLEGAL_DATA_VALUE)
+
+    registers = self.read_registers(address, count)
+    return struct.pack('>BB%dH' % count, function_code, count * 2, *registers)
+
+  async def serve_connection(self, reader, writer):
+    """Answers requests from a single client connection.
+
+    Args:
+      reader: The connection's stream reader.
+      writer: The connection's stream writer.
+    """
+    try:
+      while True:
+        header = await reader.readexactly(MBAP_HEADER.size)
+        transaction_id, _, length, unit = MBAP_HEADER.unpack(header)
+        pdu = await reader.readexactly(length - 1)
+
+        if random.random() < self._faults.drop_rate:
+          break
+
+        delay = self._faults.latency + random.uniform(0, self._faults.jitter)
+        if delay:
+          await asyncio.sleep(delay)
+
+        response = self.handle(pdu)
+        writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1,
+                                      unit) + response)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass
+    finally:
+      writer.close()
+
+
+async def start_meters(meters, host, base_port):
+  """Starts a Modbus TCP server for each simulated meter.
+
+  Args:
+    meters: A list of SimulatedMeter objects.
+    host: The address on which to listen.
+    base_port: The port of the first meter. Each further meter listens on the
+        next port. If 0, each meter listens on an ephemeral port.
+
+  Returns:
+    A list of (server, port) pairs, in the same order as the meters.
+  """
+  servers = []
+  for i, meter in enumerate(meters):
+    server = await asyncio.start_server(
+      meter.serve_connection, host, base_port + i if base_port else 0)
+    servers.append((server, server.sockets[0].getsockname()[1]))
+
+  return servers
+
+
+def create_meters(args):
+  """Creates the simulated meters described by command line arguments.
+
+  Args:
+    args: The parsed command line arguments.
+
+  Returns:
+    A list of SimulatedMeter objects.
+  """
+  overrides = None
+  if args.waveforms_file:
+    with open(args.waveforms_file, 'r') as f:
+      # jsmin strips comments from the JSON file.
+      overrides = json.loads(jsmin.jsmin(f.read()))
+
+  faults = FaultOptions(args.latency, args.jitter, args.drop_rate)
+  meters = []
+  for i in range(0, args.meters):
+    metrics = metrics_builder.build_metrics(
+      args.metrics_workbook, args.metrics_worksheet_name,
+      '%s%d' % (args.topic_prefix, i))
+    waveforms = {m.name: waveform_options(m, overrides)
+                 for m in metrics.values()}
+    meters.append(SimulatedMeter(metrics, waveforms, faults))
+
+  return meters
+
+
+def write_panels_file(args, ports):
+  """Writes a panels file describing the simulated meters.
+
+  Args:
+    args: The parsed command line arguments.
+    ports: The port of each simulated meter.
+  """
+  panels = [{
+    'host': args.host,
+    'port': port,
+    'topic_prefix': '%s%d' % (args.topic_prefix, i),
+    'metrics_workbook': os.path.abspath(args.metrics_workbook),
+    'metrics_worksheet_name': args.metrics_worksheet_name
+  } for i, port in enumerate(ports)]
+
+  with open(args.panels_file, 'w') as f:
+    json.dump(panels, f, indent=2)
+
+
+async def run(args):
+  """Starts the simulated meters and serves requests until cancelled.
+
+  Args:
+    args: The parsed command line arguments.
+  """
+  servers = await start_meters(create_meters(args), args.host, args.base_port)
+  ports = [port for _, port in servers]
+  logging.info('Simulating %d meters on %s, ports %d-%d.', len(ports),
+               args.host, ports[0], ports[-1])
+  if args.panels_file:
+    write_panels_file(args, ports)
+
+  await asyncio.gather(*[s.serve_forever() for s, _ in servers])
+
+
+def main():
+  """Parses command line arguments and runs the simulated meters."""
+  args = parse_arguments()
+  logging.basicConfig(level=logging.getLevelName(args.log_level))
+  asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,112 @@
+"""Meter simulator unit tests."""
+
+import asyncio
+import datetime
+import os
+import threading
+import unittest
+from pymodbus.exceptions import ConnectionException
+import simulator
+from collector import metrics_builder, panel_accessor
+
+WORKBOOK = os.path.join(os.path.dirname(__file__), '..', 'collector', 'maps',
+                        'nexus-metrics.xlsx')
+
+
+class SimulatorTestCase(unittest.TestCase):
+  """A test case for simulated meter operations."""
+
+  def setUp(self):
+    """Loads the Nexus metrics map with noise-free waveforms."""
+    self.metrics = metrics_builder.build_metrics(WORKBOOK, 'Metrics',
+                                                 'UW/Test/nexus_meter')
+    self.start = datetime.datetime(2018, 1, 1)
+    overrides = {name: {'amplitude_offset': 1, 'spread': 0}
+                 for name in self.metrics}
+    overrides['W'] = {'amplitude_offset': 4500, 'amplitude_cos': -4500,
+                      'spread': 0}
+    self.waveforms = {
+      m.name: simulator.waveform_options(m, overrides, self.start)
+      for m in self.metrics.values()}
+
+  def serve(self, meters):
+    """Runs simulated meters on ephemeral ports in a background thread.
+
+    Args:
+      meters: A list of SimulatedMeter objects.
+
+    Returns:
+      The port of each meter.
+    """
+    loop = asyncio.new_event_loop()
+    servers = loop.run_until_complete(
+      simulator.start_meters(meters, '127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def shutdown():
+      for server, _ in servers:
+        server.close()
+        await server.wait_closed()
+
+      tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+      for task in tasks:
+        task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop():
+      asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+      loop.call_soon_threadsafe(loop.stop)
+      thread.join()
+      loop.close()
+
+    self.addCleanup(stop)
+    return [port for _, port in servers]
+
+  def test_read_registers(self):
+    """Tests that generated values are encoded with the metric's type."""
+    meter = simulator.SimulatedMeter(self.metrics, self.waveforms)
+    noon = self.start + datetime.timedelta(hours=12)
+    w = self.metrics['W']
+    registers = meter.read_registers(w.address, w.size, noon)
+    self.assertEqual([9000, 0], registers)
+
+    # Unmapped registers read as zero.
+    self.assertEqual([0, 0], meter.read_registers(0, 2, noon))
+
+  def test_handle_illegal_requests(self):
+    """Tests that unsupported requests receive exception responses."""
+    meter = simulator.SimulatedMeter(self.metrics, self.waveforms)
+    self.assertEqual(b'\x84\x01', meter.handle(b'\x04\x00\x00\x00\x01'))
+    self.assertEqual(b'\x83\x03', meter.handle(b'\x03\x00\x00\x00\x7e'))
+
+  def test_panel_accessor_reads_simulated_meter(self):
+    """Tests that the collector decodes values served by the simulator."""
+    meters = [simulator.SimulatedMeter(self.metrics, self.waveforms)
+              for _ in range(0, 2)]
+    for meter, port in zip(meters, self.serve(meters)):
+      panel = panel_accessor.PanelAccessor('127.0.0.1', self.metrics, 1, 1,
+                                           port=port)
+      values = panel.get_metrics()
+      panel.close()
+
+      self.assertEqual(set(self.metrics), set(values))
+      self.assertAlmostEqual(1, values['Voltage_AN'], places=4)
+      self.assertAlmostEqual(1, values['pf'], places=2)
+      self.assertAlmostEqual(1, values['Angle_I_A'], places=2)
+      self.assertEqual(2, meter.requests)
+
+  def test_dropped_connections(self):
+    """Tests that dropped connections surface as connection failures."""
+    meter = simulator.SimulatedMeter(self.metrics, self.waveforms,
+                                     simulator.FaultOptions(drop_rate=1))
+    port = self.serve([meter])[0]
+    panel = panel_accessor.PanelAccessor('127.0.0.1', self.metrics, 1, 1,
+                                         port=port, timeout=1)
+    with self.assertRaises(ConnectionException):
+      panel.get_metric('W')
+    panel.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,10 +4,15 @@ This module was generated by alembic, and has been altered to dynamically set
 the value of sqlalchemy.url.
 """
 
+import os
+import sys
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config, pool
 from alembic import context
 
+# Migrations may use the modules of the db package (e.g. db/partitions.py).
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
 # This is the Alembic Config object, which provides access to the values within
 # the .ini file in use.
 config = context.config
@@ -61,7 +66,9 @@ def run_migrations_online():
 
 
 def set_sqlalchemy_url():
-  """Sets sqlalchemy.url from command-line arguments.
+  """Sets sqlalchemy.url and db_type from command-line arguments.
+
+  Revisions that only apply to MySQL check the db_type option.
 
   Substitutions are made for the following paramters:
 
@@ -87,6 +94,7 @@ def set_sqlalchemy_url():
                                    db_port, db_name)
 
   config.set_main_option('sqlalchemy.url', url)
+  config.set_main_option('db_type', db_type)
 
 
 set_sqlalchemy_url()
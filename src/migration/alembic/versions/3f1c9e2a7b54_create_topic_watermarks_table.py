@@ -0,0 +1,39 @@
+"""Create topic_watermarks table.
+
+Revision ID: 3f1c9e2a7b54
+Revises: 54207f6995cd
+Create Date: 2026-10-18 10:02:41.513380
+
+"""
+import sqlalchemy as sa
+import sqlalchemy.dialects.mysql as samysql
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9e2a7b54'
+down_revision = '54207f6995cd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  """Creates the topic_watermarks table and fills it from the data table."""
+  timestamp = sa.DateTime().with_variant(samysql.DATETIME(fsp=6), 'mysql')
+  op.create_table(
+    'topic_watermarks',
+    sa.Column('topic_id', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('first_ts', timestamp, nullable=False),
+    sa.Column('last_ts', timestamp, nullable=False),
+    sa.Column('row_count', sa.BigInteger, nullable=False),
+    mysql_engine='innodb',
+    mysql_charset='utf8')
+
+  conn = op.get_bind()
+  conn.execute(
+    'insert into topic_watermarks (topic_id, first_ts, last_ts, row_count) '
+    'select topic_id, min(ts), max(ts), count(*) from data group by topic_id')
+
+
+def downgrade():
+  """Drops the topic_watermarks table."""
+  op.drop_table('topic_watermarks')
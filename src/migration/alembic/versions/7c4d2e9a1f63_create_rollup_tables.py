@@ -0,0 +1,49 @@
+"""Create rollup tables.
+
+Revision ID: 7c4d2e9a1f63
+Revises: 3f1c9e2a7b54
+Create Date: 2026-10-18 11:20:07.274915
+
+"""
+import sqlalchemy as sa
+import sqlalchemy.dialects.mysql as samysql
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7c4d2e9a1f63'
+down_revision = '3f1c9e2a7b54'
+branch_labels = None
+depends_on = None
+
+ROLLUP_TABLES = ('data_1m', 'data_1h', 'data_1d')
+
+
+def upgrade():
+  """Creates the per-minute, per-hour and per-day rollup tables.
+
+  The tables are created empty. They should be filled from existing data with
+  db/backfill_rollups.py.
+  """
+  timestamp = sa.DateTime().with_variant(samysql.DATETIME(fsp=6), 'mysql')
+  number = sa.Float().with_variant(samysql.DOUBLE, 'mysql')
+  for name in ROLLUP_TABLES:
+    op.create_table(
+      name,
+      sa.Column('topic_id', sa.Integer, primary_key=True, autoincrement=False),
+      sa.Column('ts', sa.DateTime, primary_key=True),
+      sa.Column('row_count', sa.BigInteger, nullable=False),
+      sa.Column('value_sum', number, nullable=False),
+      sa.Column('value_min', number, nullable=False),
+      sa.Column('value_max', number, nullable=False),
+      sa.Column('first_ts', timestamp, nullable=False),
+      sa.Column('first_value', number, nullable=False),
+      sa.Column('last_ts', timestamp, nullable=False),
+      sa.Column('last_value', number, nullable=False),
+      mysql_engine='innodb',
+      mysql_charset='utf8')
+
+
+def downgrade():
+  """Drops the rollup tables."""
+  for name in reversed(ROLLUP_TABLES):
+    op.drop_table(name)
@@ -0,0 +1,42 @@
+"""Create typed_data table.
+
+Revision ID: a91e5f3c2d80
+Revises: 7c4d2e9a1f63
+Create Date: 2026-10-18 12:41:55.806213
+
+"""
+import sqlalchemy as sa
+import sqlalchemy.dialects.mysql as samysql
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a91e5f3c2d80'
+down_revision = '7c4d2e9a1f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  """Creates the typed_data table.
+
+  Values are stored as doubles, keyed by topic and then time. On MySQL the
+  table uses InnoDB, whose rows are clustered by primary key, so that the
+  values of a topic over a range of time are stored together.
+
+  The table is created empty. Existing data should be copied into it with
+  db/copy_typed_data.py while the collector writes to both tables.
+  """
+  timestamp = sa.DateTime().with_variant(samysql.DATETIME(fsp=6), 'mysql')
+  op.create_table(
+    'typed_data',
+    sa.Column('topic_id', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('ts', timestamp, primary_key=True),
+    sa.Column('value', sa.Float().with_variant(samysql.DOUBLE, 'mysql'),
+              nullable=False),
+    mysql_engine='innodb',
+    mysql_charset='utf8')
+
+
+def downgrade():
+  """Drops the typed_data table."""
+  op.drop_table('typed_data')
@@ -0,0 +1,56 @@
+"""Partition data table by month.
+
+Revision ID: d4e8b2a6c1f7
+Revises: a91e5f3c2d80
+Create Date: 2026-10-18 14:07:12.418530
+
+"""
+import datetime
+from alembic import context
+from alembic import op
+from db import partitions
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8b2a6c1f7'
+down_revision = 'a91e5f3c2d80'
+branch_labels = None
+depends_on = None
+
+# The number of months after the current month that are given partitions.
+FUTURE_MONTHS = 3
+
+
+def upgrade():
+  """Partitions the data table by month.
+
+  There is one partition for each month from that of the earliest datum to
+  FUTURE_MONTHS after the current month, and a pmax partition for any later
+  values. The table is converted to InnoDB, which supports partitioning
+  natively. Later partitions are created by db/maintain_partitions.py.
+  """
+  if context.config.get_main_option('db_type') != 'mysql+mysqlconnector':
+    return
+
+  conn = op.get_bind()
+  first = conn.execute('select min(ts) from data').scalar()
+  now = datetime.datetime.now()
+  month = partitions.month_floor(first or now)
+  last = partitions.add_months(partitions.month_floor(now), FUTURE_MONTHS)
+  months = []
+  while month <= last:
+    months.append(month)
+    month = partitions.add_months(month, 1)
+
+  conn.execute('alter table data engine=innodb')
+  conn.execute('alter table data partition by range (unix_timestamp(ts)) (%s)'
+               % partitions.partition_definitions(months))
+
+
+def downgrade():
+  """Removes the partitions of the data table."""
+  if context.config.get_main_option('db_type') != 'mysql+mysqlconnector':
+    return
+
+  conn = op.get_bind()
+  conn.execute('alter table data remove partitioning')
+  conn.execute('alter table data engine=myisam')
@@ -0,0 +1,42 @@
+"""Create data_chunks table.
+
+Revision ID: e1f3a7c9b5d2
+Revises: d4e8b2a6c1f7
+Create Date: 2026-10-18 15:32:08.761204
+
+"""
+import sqlalchemy as sa
+import sqlalchemy.dialects.mysql as samysql
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e1f3a7c9b5d2'
+down_revision = 'd4e8b2a6c1f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  """Creates the data_chunks table.
+
+  Each row holds the compressed values of a topic within an hour, which may
+  exceed the 64 KB limit of a MySQL BLOB at high sample rates.
+  """
+  timestamp = sa.DateTime().with_variant(samysql.DATETIME(fsp=6), 'mysql')
+  op.create_table(
+    'data_chunks',
+    sa.Column('topic_id', sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column('start_ts', timestamp, primary_key=True),
+    sa.Column('first_ts', timestamp, nullable=False),
+    sa.Column('last_ts', timestamp, nullable=False),
+    sa.Column('point_count', sa.Integer, nullable=False),
+    sa.Column('data', sa.LargeBinary().with_variant(samysql.MEDIUMBLOB,
+                                                    'mysql'),
+              nullable=False),
+    mysql_engine='innodb',
+    mysql_charset='utf8')
+
+
+def downgrade():
+  """Drops the data_chunks table."""
+  op.drop_table('data_chunks')
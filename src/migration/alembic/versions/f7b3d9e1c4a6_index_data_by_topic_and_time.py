@@ -0,0 +1,35 @@
+"""Index data by topic and time.
+
+Revision ID: f7b3d9e1c4a6
+Revises: e1f3a7c9b5d2
+Create Date: 2026-10-18 16:22:41.905317
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f7b3d9e1c4a6'
+down_revision = 'e1f3a7c9b5d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  """Replaces the unique (ts, topic_id) index with a (topic_id, ts) index.
+
+  Values are read for a few topics over a range of time. The new index lets
+  each topic's range be read as one contiguous slice of the index, and makes
+  topic_id_idx redundant. data_idx is kept for queries over every topic (e.g.
+  the earliest timestamp). The new index includes ts, as every unique index of
+  a partitioned table must.
+  """
+  op.create_index('topic_id_ts_idx', 'data', ['topic_id', 'ts'], unique=True)
+  op.drop_index('ts', 'data')
+  op.drop_index('topic_id_idx', 'data')
+
+
+def downgrade():
+  """Restores the unique (ts, topic_id) and topic_id indexes."""
+  op.create_index('topic_id_idx', 'data', ['topic_id'])
+  op.create_index('ts', 'data', ['ts', 'topic_id'], unique=True)
+  op.drop_index('topic_id_ts_idx', 'data')